@@ -27,8 +27,19 @@ def make_app() -> Flask:
     return app
 
 def register_extensions(app: Flask):
+    # first, since the others check whether to instrument themselves
+    from .metrics import metrics
+    metrics.init_app(app)
     from .db import db
     db.init_app(app)
+    from .graphcache import graph_cache
+    graph_cache.init_app(app)
+    from .metacache import metadata
+    metadata.init_app(app)
+    from .imgen import renderer
+    renderer.init_app(app)
+    from .dispatch import job_notifier
+    job_notifier.init_app(app)
     from .extensions import toolbar
     toolbar.init_app(app)
 
@@ -2,12 +2,14 @@ import click
 from flask import Flask, current_app
 from flask.cli import with_appcontext
 from pathlib import Path
-import psycopg2.extras
-import csv
 
 def register_cli(app: Flask):
     app.cli.add_command(init_db)
+    app.cli.add_command(migrate_db)
+    app.cli.add_command(detach_experiment)
     app.cli.add_command(launch_experiment)
+    app.cli.add_command(s2_worker)
+    app.cli.add_command(lease_reaper)
 
 @click.command('init-db')
 @with_appcontext
@@ -18,72 +20,127 @@ def init_db():
         with conn.cursor() as c:
             with current_app.open_resource('schema.sql', 'r') as f:
                 c.execute(f.read())
+            # schema.sql is already the latest schema
+            for path in migrations():
+                c.execute('INSERT INTO schema_migrations (name) VALUES (%s)', (path.stem,))
     click.echo(click.style(f'[✔] successfully initialized database', fg='green'))
 
 
+def migrations():
+    return sorted(Path(current_app.root_path, 'migrations').glob('*.sql'))
+
+@click.command('migrate-db')
+@with_appcontext
+def migrate_db():
+    """
+    Apply the migrations in migrations/ that this database hasn't had yet, in order, each in its own transaction.
+    """
+    from .db import db
+    with db.connection as conn:
+        with conn.cursor() as c:
+            c.execute('CREATE TABLE IF NOT EXISTS schema_migrations (name varchar PRIMARY KEY, applied_at timestamp NOT NULL DEFAULT now())')
+            c.execute('SELECT name FROM schema_migrations')
+            applied = set(row[0] for row in c)
+
+    pending = [path for path in migrations() if path.stem not in applied]
+    for path in pending:
+        click.echo(f'[!] applying {path.name}')
+        with db.connection as conn:
+            with conn.cursor() as c:
+                c.execute(path.read_text())
+                c.execute('INSERT INTO schema_migrations (name) VALUES (%s)', (path.stem,))
+    click.echo(click.style(f'[✔] database is up to date ({len(pending)} migrations applied)', fg='green'))
+
+
+@click.command('detach-experiment')
+@click.argument('exp_id', type=int)
+@with_appcontext
+def detach_experiment(exp_id):
+    """
+    Detach a finished experiment's nodes, edges and jobs from the live tables, into nodes_exp_<id> and so on.
+    """
+    from .db import db
+    with db.connection as conn:
+        with conn.cursor() as c:
+            c.execute('SELECT detach_experiment(%s)', (exp_id,))
+    click.echo(click.style(f'[✔] detached experiment {exp_id}', fg='green'))
+
+
 @click.command('launch-experiment')
 @click.argument('experiment_dir', type=click.Path(exists=True, file_okay=False))
 @click.option('--required-votes', default=3)
+@click.option('--queries-per-graph', default=1, help='how many nodes of each graph are out for voting at once')
+@click.option('--lease-seconds', default=30, help='how long a worker may hold a job without renewing it')
+@click.option('--threads', default=4, help='how many graphs to load at once, each over its own connection')
 @with_appcontext
-def launch_experiment(experiment_dir, required_votes):
+def launch_experiment(experiment_dir, required_votes, queries_per_graph, lease_seconds, threads):
     from .db import db
-    from .master import Status, S2
+    from .master import Master
+    from .ingest import load_graphs
 
     click.echo('[!] launching experiment...')
 
-    experiment_dir = Path(experiment_dir)
+    graph_dirs = sorted(x for x in Path(experiment_dir).iterdir() if x.is_dir())
     with db.connection as conn:
         # create a new experiment
         with conn.cursor() as c:
-            c.execute('INSERT INTO experiments (required_votes_per_node) VALUES (%s) RETURNING id', (required_votes,))
+            c.execute('''
+            INSERT INTO experiments (required_votes_per_node, queries_per_graph, lease_seconds) VALUES (%s, %s, %s)
+                RETURNING id
+            ''', (required_votes, queries_per_graph, lease_seconds))
             exp_id = c.fetchone()[0]
+    # (committed on leaving the block, so the loaders' connections see it)
+
+    try:
+        # every graph loads in its own transaction; leave one pooled connection for ourselves
+        with click.progressbar(length=len(graph_dirs), label=f'[!] loading {len(graph_dirs)} graphs',
+                               item_show_func=lambda x: x and x.name) as bar:
+            load_graphs(db, exp_id, graph_dirs, min(threads, db.pool_size - 1),
+                        progress=lambda graph_dir: bar.update(1, graph_dir))
+
+        # first queries & push jobs, for all graphs at once
+        with db.connection as conn:
+            n_jobs = Master(conn, exp_id).queue_initial_jobs(conn, queries_per_graph, required_votes)
+        click.echo(f'[!] queued {n_jobs} jobs')
+    except BaseException:
+        # the graphs that did load are committed, so take the whole experiment back out rather than leave it half
+        # loaded
+        click.echo(click.style(f'[✘] launching experiment {exp_id} failed, deleting it', fg='red'), err=True)
+        with db.connection as conn:
+            with conn.cursor() as c:
+                c.execute('SELECT drop_experiment(%s)', (exp_id,))
+        raise
+
+    click.echo(click.style(f'[✔] successfully launched experiment ({exp_id})', fg='green'))
 
-        for x in experiment_dir.iterdir():
-            if x.is_dir():
-                # push the base image
-                with conn.cursor() as c:
-                    c.execute('INSERT INTO images (exp_id, uri) VALUES (%s, %s) RETURNING id', (exp_id, str(x / 'image.png')))
-                    graph_id = image_id = c.fetchone()[0]
-                
-                # push bases
-                bases = list(x.glob('basis_*.*'))
-                with conn.cursor() as c:
-                    psycopg2.extras.execute_values(c,
-                        'INSERT INTO bases (exp_id, image_id, uri) VALUES %s',
-                        [(exp_id, image_id, str(p)) for p in bases])
-                
-                # push nodes
-                with open(x/'nodes.csv') as f:
-                    reader = csv.reader(f)
-                    records = []
-                    for row in reader:
-                        id, *weights = row
-                        records.append((exp_id, graph_id, int(id), [float(w) for w in weights]))
-                    with conn.cursor() as c:
-                        psycopg2.extras.execute_values(c, 'INSERT INTO nodes (exp_id, graph_id, id, basis_weights) VALUES %s',
-                            records)
-                
-                # push edges
-                with open(x/'edges.csv') as f:
-                    reader = csv.reader(f)
-                    records = []
-                    for row in reader:
-                        i, j = map(int, row)
-                        records.append((exp_id, graph_id, i, j))
-                    with conn.cursor() as c:
-                        psycopg2.extras.execute_values(c, 'INSERT INTO edges (exp_id, graph_id, i, j) VALUES %s',
-                            records)
-        
-                # first query & push jobs
-                s2 = S2(conn, exp_id, graph_id)
-                node_id = s2.get_query(conn)
-                jobs = [
-                    (exp_id, graph_id, node_id, ballot_id, Status.UNASSIGNED)
-                    for ballot_id in range(required_votes)
-                ]
-
-                with conn.cursor() as c:
-                    psycopg2.extras.execute_values(c, 'INSERT INTO jobs (exp_id, graph_id, node_id, ballot_id, status) VALUES %s',
-                        jobs)
-    
-    click.echo(click.style(f'[✔] successfully launched experiment ({exp_id})', fg='green'))
\ No newline at end of file
+
+@click.command('s2-worker')
+@click.option('--processes', default=1, help='how many worker processes to run')
+@click.option('--poll-interval', default=5.0, help='seconds between checks of the queue when no notifications arrive')
+@click.option('--batch-size', default=100, help='how many finished nodes to claim per transaction')
+def s2_worker(processes, poll_interval, batch_size):
+    """
+    Label finished nodes and queue the next jobs for their graphs, off the vote request path.
+    """
+    from .worker import run_workers
+    click.echo(f'[!] starting {processes} S² worker(s)')
+    run_workers(processes, poll_interval, batch_size)
+
+
+@click.command('lease-reaper')
+@click.option('--interval', default=5.0, help='seconds between sweeps')
+@click.option('--batch-size', default=1000, help='how many expired jobs to reinstate per transaction')
+@click.option('--once', is_flag=True, help='sweep once and exit, e.g. from cron')
+@with_appcontext
+def lease_reaper(interval, batch_size, once):
+    """
+    Put jobs whose lease ran out back up for grabs.
+    """
+    from .db import db
+    from .leases import reap_expired_leases, run_reaper
+    if once:
+        n = reap_expired_leases(db.connection, batch_size)
+        click.echo(f'[!] reinstated {n} jobs')
+    else:
+        click.echo(f'[!] reaping expired leases every {interval}s')
+        run_reaper(interval, batch_size)
@@ -4,6 +4,17 @@ class Config:
     DEBUG = False
     DEBUG_TB_INTERCEPT_REDIRECTS = False
     POSTGRES_URL = os.environ.get("POSTGRES_URL", "postgres://localhost/s2")
+    # per process; requests beyond it wait up to POSTGRES_POOL_TIMEOUT seconds for a connection
+    POSTGRES_POOL_SIZE = int(os.environ.get("POSTGRES_POOL_SIZE", 10))
+    POSTGRES_POOL_TIMEOUT = float(os.environ.get("POSTGRES_POOL_TIMEOUT", 30))
+    IMAGE_FORMAT = os.environ.get("IMAGE_FORMAT", "png") # for browsers that don't take webp
+    GRAPH_CACHE_BYTES = int(os.environ.get("GRAPH_CACHE_BYTES", 512 * 2**20))
+    METADATA_CACHE_BYTES = int(os.environ.get("METADATA_CACHE_BYTES", 256 * 2**20))
+    METADATA_CACHE_TTL = float(os.environ.get("METADATA_CACHE_TTL", 600))
+    METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "") not in ("", "0", "false")
+    JOB_WAIT_SECONDS = float(os.environ.get("JOB_WAIT_SECONDS", 30)) # longest a job request is held open
+    METRICS_DIR = os.environ.get("METRICS_DIR") # shared by all server processes; see `metrics.Metrics`
+    METRICS_LOG_SAMPLE_RATE = float(os.environ.get("METRICS_LOG_SAMPLE_RATE", 0)) # of observations logged as JSON
 
 class ProdConfig(Config):
     pass
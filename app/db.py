@@ -1,38 +1,137 @@
-from typing import List
-from collections import defaultdict
+from typing import Callable, List, Tuple
+import sys
+import time
+import threading
+import numpy as np
 import psycopg2
-from psycopg2.pool import ThreadedConnectionPool
+import psycopg2.extensions
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 from flask import _app_ctx_stack
+from .metrics import metrics
+
+class TimedCursor(psycopg2.extensions.cursor):
+    """
+    A cursor timing every statement into `s2_sql_seconds`, labeled by the function that ran it.
+    """
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            metrics.observe('s2_sql_seconds', time.perf_counter() - start, caller=_caller())
+
+    def copy_expert(self, sql, file, size=8192):
+        start = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            metrics.observe('s2_sql_seconds', time.perf_counter() - start, caller=_caller())
+
+def _caller() -> str:
+    # the first frame outside this module and psycopg2 (whose helpers, like execute_values, call execute)
+    frame = sys._getframe(2)
+    while frame.f_back is not None and frame.f_globals.get('__name__', '').startswith('psycopg2'):
+        frame = frame.f_back
+    return f"{frame.f_globals.get('__name__')}.{frame.f_code.co_name}"
+
+class Connection(psycopg2.extensions.connection):
+    """
+    A connection that runs callbacks once its current transaction commits, and forgets them if it rolls back.
+    `transaction` holds whatever else callers need to keep for the current transaction only.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.transaction = {}
+        self._on_commit = []
+
+    def on_commit(self, callback: Callable[[], None]):
+        self._on_commit.append(callback)
+
+    def commit(self):
+        callbacks = self._end_transaction()
+        super().commit()
+        for callback in callbacks:
+            callback()
+
+    def rollback(self):
+        self._end_transaction()
+        super().rollback()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # end the transaction through our commit and rollback; psycopg2's own then only has nothing left to end
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return super().__exit__(exc_type, exc_value, traceback)
+
+    def _end_transaction(self) -> List[Callable[[], None]]:
+        callbacks, self._on_commit = self._on_commit, []
+        self.transaction = {}
+        return callbacks
 
 class Postgres(object):
-    def __init__(self, app=None, pool_size=10):
+    """
+    A pool of up to `pool_size` connections, one per app context. Unlike psycopg2's pool, which raises once it's
+    empty, getting a connection waits up to `pool_timeout` seconds for one to be put back.
+    """
+    def __init__(self, app=None, pool_size=10, pool_timeout=30.0):
         self.app = app
         self.pool = None
         self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        self._available = None
 
         if app is not None:
             self.init_app(app)
     
     def init_app(self, app):
-        self.pool = ThreadedConnectionPool(1, self.pool_size, app.config['POSTGRES_URL'])
+        self.pool_size = app.config.get('POSTGRES_POOL_SIZE', self.pool_size)
+        self.pool_timeout = app.config.get('POSTGRES_POOL_TIMEOUT', self.pool_timeout)
+        # statements are only timed with metrics on, so the plain cursor costs nothing extra otherwise
+        cursor_factory = TimedCursor if metrics.enabled else None
+        self.pool = ThreadedConnectionPool(1, self.pool_size, app.config['POSTGRES_URL'],
+                                           connection_factory=Connection, cursor_factory=cursor_factory)
+        self._available = threading.BoundedSemaphore(self.pool_size)
         app.teardown_appcontext(self.teardown)
+
+    def getconn(self):
+        """
+        Take a connection out of the pool, waiting for one if they're all in use; give it back with `putconn`.
+        """
+        with metrics.timer('s2_pool_wait_seconds'):
+            if not self._available.acquire(timeout=self.pool_timeout):
+                raise PoolError(f'no connection was put back within {self.pool_timeout} seconds')
+        try:
+            return self.pool.getconn()
+        except Exception:
+            self._available.release()
+            raise
+
+    def putconn(self, conn):
+        self.pool.putconn(conn)
+        self._available.release()
     
     def teardown(self, exception):
+        self.release()
+
+    def release(self):
+        """
+        Give this context's connection back to the pool early, e.g. before waiting on something else; the next
+        `connection` gets another.
+        """
         ctx = _app_ctx_stack.top
         conn = getattr(ctx, 'postgres_conn', None)
         if conn is not None:
-            self.pool.putconn(conn)
             del ctx.postgres_conn
-    
-    def _connect(self):
-        return self.pool.getconn()
+            self.putconn(conn)
     
     @property
     def connection(self):
         ctx = _app_ctx_stack.top
         if ctx is not None:
             if not hasattr(ctx, 'postgres_conn'):
-                ctx.postgres_conn = self._connect()
+                ctx.postgres_conn = self.getconn()
             return ctx.postgres_conn
     
     def cursor(self):
@@ -40,57 +139,41 @@ class Postgres(object):
 
 db = Postgres()
 
-def uri_for_image(db, exp_id: int, img_id: int) -> str:
-    with db.cursor() as c:
-        c.execute('SELECT uri FROM images WHERE exp_id = %s AND id = %s', (exp_id, img_id,))
-        return c.fetchone()[0]
-
-def get_basis_uris(db, exp_id: int, img_id: int) -> List[str]:
-    with db.cursor() as c:
-        c.execute('SELECT uri FROM bases WHERE exp_id = %s AND image_id = %s ORDER BY id ASC', (exp_id, img_id))
-        return [x[0] for x in c]
-
-def basis_weights_for_node(db, exp_id: int, node_id: int) -> List[float]:
-    with db.cursor() as c:
-        c.execute('SELECT basis_weights FROM nodes WHERE exp_id = %s AND id = %s', (exp_id, node_id))
-        return c.fetchone()[0]
-
-def required_votes(db, exp_id: int) -> int:
+def experiment_metadata(db, exp_id: int) -> dict:
     with db.cursor() as c:
-        c.execute('SELECT required_votes_per_node FROM experiments WHERE id = %s', (exp_id,))
-        return c.fetchone()[0]
+        c.execute('''
+        SELECT required_votes_per_node, queries_per_graph, lease_seconds FROM experiments WHERE id = %s
+        ''', (exp_id,))
+        row = c.fetchone()
+        if row is None:
+            raise KeyError(f'no experiment {exp_id}')
+        return dict(zip(['required_votes', 'queries_per_graph', 'lease_seconds'], row))
 
-def graphs_percent_done(db, exp_id: int) -> defaultdict:
+def image_uris(db, exp_id: int, img_id: int) -> Tuple[str, List[str]]:
+    """
+    The URI of an image and of its bases, in one query.
+    """
     with db.cursor() as c:
         c.execute('''
-        WITH
-            exp_nodes AS (
-                SELECT id, graph_id, label FROM nodes
-                WHERE exp_id = %(exp_id)s
-            ),
-            labeled AS (
-                SELECT graph_id, COUNT(*) FROM exp_nodes WHERE label IS NOT NULL GROUP BY graph_id
-            ),
-            total AS (
-                SELECT graph_id, COUNT(*) FROM exp_nodes GROUP BY graph_id
-            )
-        SELECT labeled.graph_id, (labeled.count::float / total.count::float) AS percent_done FROM labeled, total WHERE labeled.graph_id = total.graph_id
-        ''', {'exp_id': exp_id})
-    
-        d = defaultdict(int)
-        for row in c:
-            d[row[0]] = row[1]
-    
-    return d
+        SELECT images.uri, coalesce(array_agg(bases.uri ORDER BY bases.id) FILTER (WHERE bases.id IS NOT NULL), '{}')
+        FROM images LEFT JOIN bases ON bases.exp_id = images.exp_id AND bases.image_id = images.id
+        WHERE images.exp_id = %s AND images.id = %s
+        GROUP BY images.uri
+        ''', (exp_id, img_id))
+        row = c.fetchone()
+        if row is None:
+            raise KeyError(f'no image {img_id} in experiment {exp_id}')
+        return row[0], list(row[1])
 
-def graphs_touched_by(db, exp_id: int, user_id: int):
+def basis_weights_for_graph(db, exp_id: int, graph_id: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The node ids of a graph in order, and their basis weights as the rows of one `float32` matrix.
+    """
     with db.cursor() as c:
-        c.execute('''
-        SELECT graph_id
-        FROM jobs
-        WHERE
-            completing_user = %(user_id)s AND
-            exp_id = %(exp_id)s
-        ''', {'exp_id': exp_id, 'user_id': user_id})
-
-        return set([r[0] for r in c.fetchall()])
+        c.execute('SELECT id, basis_weights FROM nodes WHERE exp_id = %s AND graph_id = %s ORDER BY id',
+                  (exp_id, graph_id))
+        rows = c.fetchall()
+
+    node_ids = np.array([row[0] for row in rows], dtype=np.int64)
+    weights = np.array([row[1] for row in rows], dtype=np.float32).reshape(len(rows), -1)
+    return node_ids, weights
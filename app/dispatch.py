@@ -0,0 +1,142 @@
+from typing import Callable, Optional, TypeVar
+from collections import defaultdict, deque
+import threading
+import logging
+import select
+import time
+import psycopg2
+import psycopg2.extensions
+from .master import JOBS_CHANNEL
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# seconds between reconnects of a listener whose connection failed
+RECONNECT_SECONDS = 1.0
+
+class JobNotifier:
+    """
+    Holds requests for a job open until one becomes available, instead of having clients poll for it.
+
+    `voting_done`, `queue_initial_jobs` and the lease reaper notify `JOBS_CHANNEL` with `<exp_id> <n_jobs>` when
+    they make jobs available; one thread per process, started by the first `wait_for`, listens on a connection of
+    its own and wakes only as many waiting requests of that experiment as there are new jobs, oldest first.
+
+    Waiting blocks on nothing but `threading` and `select`, which gevent patches, so requests can be held open by
+    threaded (`gunicorn --threads`) or gevent workers alike.
+    """
+    def __init__(self, app=None, max_wait=30.0):
+        self.url = None
+        self.max_wait = max_wait
+        self._waiters = defaultdict(deque)
+        self._lock = threading.Lock()
+        self._thread = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.url = app.config['POSTGRES_URL']
+        self.max_wait = app.config.get('JOB_WAIT_SECONDS', self.max_wait)
+
+    def wait_for(self, exp_id: int, attempt: Callable[[], Optional[T]], timeout: float) -> Optional[T]:
+        """
+        Call `attempt` until it returns something other than `None`, waiting after each miss until jobs become
+        available in `exp_id`, for at most `timeout` (capped at `max_wait`) seconds in all.
+        """
+        self._ensure_listening()
+        deadline = time.monotonic() + min(timeout, self.max_wait)
+        while True:
+            # wait in line before attempting, so jobs made available in between wake us right away
+            waiter = self._add_waiter(exp_id)
+            retry = False
+            try:
+                result = attempt()
+                remaining = deadline - time.monotonic()
+                if result is None and remaining > 0:
+                    retry = waiter.wait(remaining)
+            finally:
+                self._remove_waiter(exp_id, waiter, pass_on=not retry)
+            if not retry:
+                return result
+
+    def notify(self, exp_id: int, n_jobs: Optional[int] = None):
+        """
+        Wake up to `n_jobs` requests waiting in `exp_id`, or all of them.
+        """
+        with self._lock:
+            self._wake(exp_id, n_jobs)
+
+    def _add_waiter(self, exp_id: int) -> threading.Event:
+        waiter = threading.Event()
+        with self._lock:
+            self._waiters[exp_id].append(waiter)
+        return waiter
+
+    def _remove_waiter(self, exp_id: int, waiter: threading.Event, pass_on: bool):
+        with self._lock:
+            waiters = self._waiters.get(exp_id)
+            if waiters is not None and waiter in waiters:
+                waiters.remove(waiter)
+                if not waiters:
+                    del self._waiters[exp_id]
+            elif pass_on and waiter.is_set():
+                # we were woken for a job but won't look for it, so let the next in line
+                self._wake(exp_id, 1)
+
+    def _wake(self, exp_id: int, n_jobs: Optional[int]):
+        waiters = self._waiters.get(exp_id)
+        if not waiters:
+            return
+        for _ in range(len(waiters) if n_jobs is None else min(n_jobs, len(waiters))):
+            waiters.popleft().set()
+        if not waiters:
+            del self._waiters[exp_id]
+
+    def _wake_everyone(self):
+        with self._lock:
+            for exp_id in list(self._waiters):
+                self._wake(exp_id, None)
+
+    def _ensure_listening(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                # started lazily, so that it runs in the process that serves requests, after any fork
+                self._thread = threading.Thread(target=self._listen, name='job-notifier', daemon=True)
+                self._thread.start()
+
+    def _listen(self):
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(self.url)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as c:
+                    c.execute(f'LISTEN {JOBS_CHANNEL}')
+                logger.debug(f'job notifier listening on {JOBS_CHANNEL}')
+                # whatever was notified while we weren't listening is lost, so have everyone look again
+                self._wake_everyone()
+
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._dispatch(conn.notifies.pop(0).payload)
+            except Exception:
+                logger.exception('job notifier lost its connection')
+            finally:
+                if conn is not None:
+                    conn.close()
+            time.sleep(RECONNECT_SECONDS)
+
+    def _dispatch(self, payload: str):
+        try:
+            exp_id, n_jobs = map(int, payload.split())
+        except ValueError:
+            logger.warning(f'ignoring malformed job notification {payload!r}')
+            return
+        self.notify(exp_id, n_jobs)
+
+job_notifier = JobNotifier()
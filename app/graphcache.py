@@ -0,0 +1,260 @@
+from typing import Callable, Iterable, Optional, Tuple
+from collections import OrderedDict
+import threading
+import logging
+import numpy as np
+from s2.graph import CSRGraph
+from s2.predict import predict
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class CachedGraph:
+    """
+    An experiment graph held in memory as a `CSRGraph`, along with the mapping back to database ids.
+
+    Vertex `k` is node `node_ids[k]`; row `r` of the `edges` table (id `edge_db_ids[r]`) is CSR edge
+    `edge_index[r]`.
+    """
+    def __init__(self, graph: CSRGraph, node_ids: np.ndarray, edge_db_ids: np.ndarray, edge_index: np.ndarray,
+                 version: int):
+        self.graph = graph
+        self.node_ids = node_ids
+        self.edge_db_ids = edge_db_ids
+        self.edge_index = edge_index
+        self.version = version
+
+        self._predictions = None
+        self._touched = []
+        self._predictions_lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        G = self.graph
+        return sum(a.nbytes for a in (G.indptr, G.indices, G.edge_ids, G.edges, G.alive, G.labels,
+                                      self.node_ids, self.edge_db_ids, self.edge_index))
+
+    def vertex(self, node_id: int) -> int:
+        return int(np.searchsorted(self.node_ids, node_id))
+
+    def obvious_cuts(self) -> np.ndarray:
+        """
+        Indices of the alive edges joining differently-labeled vertices.
+        """
+        G = self.graph
+        alive = np.flatnonzero(G.alive)
+        labels = G.labels.astype(np.int64)
+        return alive[labels[G.edges[alive, 0]] * labels[G.edges[alive, 1]] < 0]
+
+    def db_ids_of_edges(self, edges: np.ndarray) -> np.ndarray:
+        return self.edge_db_ids[np.isin(self.edge_index, edges)]
+
+    def touch(self, vertices: Iterable[int]):
+        """
+        Mark vertices whose labels or edges changed, so their components are rescored on the next `predictions`.
+        """
+        self._touched.extend(vertices)
+
+    def predictions(self) -> np.ndarray:
+        """
+        Label-propagation scores of every vertex (see `s2.predict.predict`), rescoring only the components touched
+        since the last call.
+        """
+        with self._predictions_lock:
+            if self._predictions is None:
+                self._predictions = predict(self.graph)
+            elif self._touched:
+                predict(self.graph, vertices=np.unique(self._touched), out=self._predictions)
+            self._touched = []
+            return self._predictions
+
+    def copy(self) -> 'CachedGraph':
+        """
+        A copy whose labels, edges and predictions can change without changing this one's.
+        """
+        copy = CachedGraph(self.graph.copy(), self.node_ids, self.edge_db_ids, self.edge_index, self.version)
+        with self._predictions_lock:
+            if self._predictions is not None:
+                copy._predictions = self._predictions.copy()
+            copy._touched = list(self._touched)
+        return copy
+
+    def inherit_predictions(self, old: 'CachedGraph'):
+        """
+        Take over the predictions of an older copy of the same graph (e.g. after another process wrote to it),
+        touching whatever changed in between, so they're updated rather than recomputed.
+        """
+        if old._predictions is None or not np.array_equal(old.node_ids, self.node_ids):
+            return
+
+        G, G_old = self.graph, old.graph
+        n = G.order()
+        changed = [np.flatnonzero(G_old.labels != G.labels)]
+        # edges are only ever deleted, and a reload only has the ones left
+        old_edges = G_old.edges[G_old.alive].astype(np.int64)
+        keys = G.edges[:, 0].astype(np.int64) * n + G.edges[:, 1]
+        changed.append(old_edges[~np.isin(old_edges[:, 0] * n + old_edges[:, 1], keys)].ravel())
+
+        with old._predictions_lock:
+            self._predictions = old._predictions
+            self._touched = old._touched + np.concatenate(changed).tolist()
+
+class GraphCache:
+    """
+    An in-process LRU cache of experiment graphs, keyed by `(exp_id, graph_id)` and bounded by memory.
+
+    Every statement that changes a graph's `nodes` or `edges` rows bumps its row in `graph_versions` (see
+    `schema.sql`), so a cached graph is reloaded whenever its version moved without going through us. Our own
+    writes are applied as deltas through `record_write`, to a copy private to the writing transaction that is only
+    shared once it commits, so the shared graphs only ever hold committed rows.
+    """
+    def __init__(self, app=None, max_bytes=512 * 2**20):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.RLock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_bytes = app.config.get('GRAPH_CACHE_BYTES', self.max_bytes)
+
+    def get(self, db, exp_id: int, graph_id: int) -> CachedGraph:
+        key = (exp_id, graph_id)
+        version = self._version(db, exp_id, graph_id)
+
+        # a graph this transaction wrote to is read from its own copy until it commits
+        written = self._written(db, create=False)
+        if written is not None and key in written:
+            entry = written[key]
+            if entry is None or entry.version != version:
+                with metrics.timer('s2_phase_seconds', phase='graph_load'):
+                    entry = written[key] = self._load(db, exp_id, graph_id, version)
+            return entry
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.version == version:
+                self._entries.move_to_end(key)
+                return entry
+            old = entry
+            if entry is not None:
+                logger.debug(f'graph {key} changed (v{entry.version} -> v{version}), reloading')
+                self._drop(key)
+
+        with metrics.timer('s2_phase_seconds', phase='graph_load'):
+            entry = self._load(db, exp_id, graph_id, version)
+        if old is not None:
+            entry.inherit_predictions(old)
+
+        with self._lock:
+            self._insert(key, entry)
+        return entry
+
+    def record_write(self, db, exp_id: int, graph_id: int, apply: Callable[[CachedGraph], None]):
+        """
+        Apply a change we just made to a graph's rows (with one statement) to the current transaction's copy of the
+        cached graph, which replaces the shared one once the transaction commits and is forgotten if it rolls back.
+        If anyone else changed the graph in the meantime, the copy is reloaded by the next `get` instead.
+
+        Writes to a graph that is read back in the same transaction must all go through here, or the shared cache
+        could pick up rows that never commit.
+        """
+        key = (exp_id, graph_id)
+        written = self._written(db)
+        if written is None:
+            # we can't tell when this connection commits, so leave the graph to be reloaded
+            self.invalidate(exp_id, graph_id)
+            return
+
+        version = self._version(db, exp_id, graph_id)
+        entry = written.get(key)
+        if entry is None:
+            with self._lock:
+                entry = self._entries.get(key)
+            # shared graphs are never changed in place, so this can copy outside the lock
+            entry = entry and entry.copy()
+
+        if entry is not None and version == entry.version + 1:
+            apply(entry)
+            entry.version = version
+            written[key] = entry
+        else:
+            written[key] = None
+
+    def _written(self, db, create=True) -> Optional[dict]:
+        """
+        The graphs the current transaction on `db` wrote to, by key, as our copies of them (or `None` where we have
+        no copy yet); `None` if `db` can't tell us when it commits (see `db.Connection`).
+        """
+        transaction = getattr(db, 'transaction', None)
+        if transaction is None:
+            return None
+        written = transaction.get('graph_cache')
+        if written is None and create:
+            written = transaction['graph_cache'] = {}
+            db.on_commit(lambda: self._publish(written))
+        return written
+
+    def _publish(self, written: dict):
+        with self._lock:
+            for key, entry in written.items():
+                shared = self._entries.get(key)
+                # someone may have loaded an even newer version since we committed
+                if entry is not None and (shared is None or shared.version < entry.version):
+                    self._insert(key, entry)
+
+    def _insert(self, key: Tuple[int, int], entry: CachedGraph):
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = entry
+        self._nbytes += entry.nbytes
+        # evict least recently used graphs, but always keep the one just inserted
+        while self._nbytes > self.max_bytes and len(self._entries) > 1:
+            evicted, _ = next(iter(self._entries.items()))
+            logger.debug(f'evicting graph {evicted} from cache')
+            self._drop(evicted)
+
+    def invalidate(self, exp_id: Optional[int] = None, graph_id: Optional[int] = None):
+        with self._lock:
+            for key in list(self._entries):
+                if (exp_id is None or key[0] == exp_id) and (graph_id is None or key[1] == graph_id):
+                    self._drop(key)
+
+    def _drop(self, key: Tuple[int, int]):
+        self._nbytes -= self._entries.pop(key).nbytes
+
+    def _version(self, db, exp_id: int, graph_id: int) -> int:
+        with db.cursor() as c:
+            c.execute('SELECT version FROM graph_versions WHERE exp_id = %s AND graph_id = %s', (exp_id, graph_id))
+            row = c.fetchone()
+            return 0 if row is None else row[0]
+
+    def _load(self, db, exp_id: int, graph_id: int, version: int) -> CachedGraph:
+        logger.debug(f'loading graph ({exp_id}, {graph_id}) v{version} into cache')
+        with db.cursor() as c:
+            c.execute('SELECT id, label FROM nodes WHERE exp_id = %s AND graph_id = %s ORDER BY id',
+                      (exp_id, graph_id))
+            nodes = np.array(c.fetchall(), dtype=object).reshape(-1, 2)
+
+            c.execute('SELECT id, i, j FROM edges WHERE exp_id = %s AND graph_id = %s', (exp_id, graph_id))
+            edges = np.array(c.fetchall(), dtype=np.int64).reshape(-1, 3)
+
+        node_ids = nodes[:, 0].astype(np.int64)
+        n = len(node_ids)
+        i, j = np.searchsorted(node_ids, edges[:, 1]), np.searchsorted(node_ids, edges[:, 2])
+        graph = CSRGraph.from_edges(n, i, j)
+
+        labels = nodes[:, 1]
+        labeled = np.flatnonzero(labels != None)
+        graph.labels[labeled] = np.sign(labels[labeled].astype(np.int64))
+
+        # CSR edges are sorted by (lo, hi), so find each row's edge by its key
+        lo, hi = np.minimum(i, j), np.maximum(i, j)
+        edge_keys = graph.edges[:, 0].astype(np.int64) * n + graph.edges[:, 1]
+        edge_index = np.searchsorted(edge_keys, lo * n + hi)
+
+        return CachedGraph(graph, node_ids, edges[:, 0], edge_index, version)
+
+graph_cache = GraphCache()
@@ -1,8 +1,23 @@
-from typing import List
+from typing import Callable, Iterable, List, Sequence, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
 from io import BytesIO
-import base64
+import threading
+import logging
 import numpy as np
 from PIL import Image
+from s2.bundle import open_bundle, is_bundle
+from .metacache import metadata
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# format name: (PIL format, MIME type, save options)
+FORMATS = {
+    'png': ('PNG', 'image/png', {}),
+    'webp': ('WEBP', 'image/webp', {'quality': 90, 'method': 4}),
+    'jpg': ('JPEG', 'image/jpeg', {'quality': 90}),
+}
 
 def load_image(fp) -> np.ndarray:
     image = Image.open(fp)
@@ -11,22 +26,167 @@ def load_image(fp) -> np.ndarray:
     arr = arr.astype('float') / maxval
     return arr
 
-def as_base64_png(img: Image) -> bytes:
-    buf = BytesIO()
-    img.save(buf, format='png')
-    data = b'data:image/png;base64,' + base64.encodestring(buf.getvalue())
-    return data.decode('utf-8')
-
-def perturb_image(base_image: np.ndarray, weights: np.ndarray, bases: List[np.ndarray]):
-    perturbation = np.zeros_like(base_image)
+def perturb_image(base_image: np.ndarray, weights: np.ndarray, bases: Union[np.ndarray, List[np.ndarray]],
+                  out: np.ndarray = None) -> np.ndarray:
+    """
+    Add the weighted sum of `bases` to `base_image` and clip to [0, 1], into `out` if given. `bases` is either a
+    list of arrays shaped like `base_image`, or all of them stacked along a new first axis.
+    """
+    bases = np.asarray(bases)
     assert(len(weights) == len(bases))
-    assert(all(base_image.shape == base.shape for base in bases))
-    
-    for i, basis in enumerate(bases):
-        perturbation += weights[i] * basis
-    
-    pimage = base_image + perturbation
-    pimage[pimage > 1] = 1
-    pimage[pimage < 0] = 0
-
-    return pimage
\ No newline at end of file
+    assert(bases.shape[1:] == base_image.shape)
+
+    if out is None:
+        out = np.empty(base_image.shape, dtype=np.result_type(base_image, bases))
+
+    # one contraction over the basis axis, written straight into `out`
+    np.matmul(np.asarray(weights, dtype=out.dtype), bases.reshape(len(bases), -1), out=out.reshape(-1))
+    out += base_image
+    np.clip(out, 0, 1, out=out)
+
+    return out
+
+class ImageStack:
+    """
+    A base image and its bases stacked into one `(n_bases, *image.shape)` tensor, both `float32`, with a buffer to
+    render into.
+    """
+    def __init__(self, base_image: np.ndarray, bases: np.ndarray):
+        self.base_image = base_image
+        self.bases = bases
+        self._buffer = np.empty(base_image.shape, dtype=np.float32)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, image_uri: str, basis_uris: Sequence[str]) -> 'ImageStack':
+        if is_bundle(image_uri):
+            # already float32 and stacked, so map it rather than read it in
+            bundle = open_bundle(image_uri)
+            return cls(bundle.image, bundle.bases)
+
+        base_image = load_image(image_uri).astype(np.float32)
+        bases = np.empty((len(basis_uris),) + base_image.shape, dtype=np.float32)
+        for k, uri in enumerate(basis_uris):
+            bases[k] = np.load(uri, mmap_mode='r')
+        return cls(base_image, bases)
+
+    @property
+    def nbytes(self) -> int:
+        return self.base_image.nbytes + self.bases.nbytes + self._buffer.nbytes
+
+    def render(self, weights: Sequence[float]) -> Image:
+        with self._lock:
+            x = perturb_image(self.base_image, weights, self.bases, out=self._buffer)
+            x *= 255
+            return Image.fromarray(x.astype(np.uint8))
+
+class Renderer:
+    """
+    Renders query images, keeping two LRU caches bounded by memory: `ImageStack`s per `(exp_id, image_id)`, and
+    encoded images per `(exp_id, graph_id, node_id, format)`, since every ballot of a node shows the same image.
+    """
+    def __init__(self, app=None, stack_cache_bytes=1024 * 2**20, image_cache_bytes=256 * 2**20, prerender_threads=2):
+        self.stack_cache_bytes = stack_cache_bytes
+        self.image_cache_bytes = image_cache_bytes
+        self._stacks = OrderedDict()
+        self._images = OrderedDict()
+        self._stacks_nbytes = self._images_nbytes = 0
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._executor = ThreadPoolExecutor(max_workers=prerender_threads, thread_name_prefix='prerender')
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.stack_cache_bytes = app.config.get('IMAGE_STACK_CACHE_BYTES', self.stack_cache_bytes)
+        self.image_cache_bytes = app.config.get('IMAGE_CACHE_BYTES', self.image_cache_bytes)
+
+    def render(self, db, exp_id: int, graph_id: int, node_id: int, format: str = 'png') -> bytes:
+        """
+        The query image for a node, encoded in one of `FORMATS`.
+        """
+        key = (exp_id, graph_id, node_id, format)
+        with self._lock:
+            data = self._images.get(key)
+            if data is not None:
+                self._images.move_to_end(key)
+                return data
+
+        weights = metadata.basis_weights(db, exp_id, graph_id, node_id)
+        if weights is None:
+            raise KeyError(f'no node {graph_id}:{node_id} in experiment {exp_id}')
+        stack = self.stack(db, exp_id, graph_id)
+        with metrics.timer('s2_phase_seconds', phase='perturb_image'):
+            img = stack.render(weights)
+        with metrics.timer('s2_phase_seconds', phase='encode_image'):
+            pil_format, _, options = FORMATS[format]
+            buf = BytesIO()
+            img.save(buf, format=pil_format, **options)
+            data = buf.getvalue()
+
+        with self._lock:
+            self._images_nbytes = self._put(self._images, self._images_nbytes, self.image_cache_bytes, key, data,
+                                            len)
+        return data
+
+    def prerender(self, app, exp_id: int, nodes: Iterable[Tuple[int, int]], format: str = 'png'):
+        """
+        Render the images of `(graph_id, node_id)` pairs in the background, so they're cached by the time they're
+        asked for.
+        """
+        for graph_id, node_id in nodes:
+            key = (exp_id, graph_id, node_id, format)
+            with self._lock:
+                if key in self._images or key in self._pending:
+                    continue
+                self._pending.add(key)
+            self._executor.submit(self._prerender, app, key)
+
+    def _prerender(self, app, key: Tuple[int, int, int, str]):
+        from .db import db
+        try:
+            with app.app_context():
+                self.render(db.connection, *key)
+        except Exception:
+            logger.exception(f'failed to prerender image {key}')
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def stack(self, db, exp_id: int, image_id: int) -> ImageStack:
+        key = (exp_id, image_id)
+        with self._lock:
+            stack = self._stacks.get(key)
+            if stack is not None:
+                self._stacks.move_to_end(key)
+                return stack
+
+        logger.debug(f'loading image stack {key}')
+        with metrics.timer('s2_phase_seconds', phase='load_image_stack'):
+            stack = ImageStack.load(*metadata.image_uris(db, exp_id, image_id))
+
+        with self._lock:
+            self._stacks_nbytes = self._put(self._stacks, self._stacks_nbytes, self.stack_cache_bytes, key, stack,
+                                            lambda s: s.nbytes)
+        return stack
+
+    @staticmethod
+    def _put(cache: OrderedDict, nbytes: int, max_bytes: int, key: Tuple, value, size: Callable) -> int:
+        """
+        Insert into an LRU cache of total size `nbytes`, evicting the least recently used entries (but never the
+        new one) to get under `max_bytes`. Returns the new total size.
+        """
+        # another thread may have put the same key meanwhile
+        old = cache.pop(key, None)
+        if old is not None:
+            nbytes -= size(old)
+        cache[key] = value
+        nbytes += size(value)
+
+        while nbytes > max_bytes and len(cache) > 1:
+            _, evicted = cache.popitem(last=False)
+            nbytes -= size(evicted)
+        return nbytes
+
+renderer = Renderer()
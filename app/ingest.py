@@ -0,0 +1,136 @@
+from typing import Callable, Iterable, List
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+import logging
+import csv
+import numpy as np
+import psycopg2.extras
+from s2.bundle import GraphBundle, open_bundle, is_bundle
+
+logger = logging.getLogger(__name__)
+
+class CopySource:
+    """
+    A read-only file over rows (e.g. from a CSV file), rewritten on the fly into the text format of
+    `COPY ... FROM STDIN` with fixed leading columns (e.g. `exp_id` and `graph_id`), so large files stream into
+    Postgres without being held in memory.
+    """
+    def __init__(self, rows: Iterable, prefix: Iterable, convert: Callable[..., Iterable[str]]):
+        prefix = ''.join(f'{value}\t' for value in prefix)
+        self._lines = (prefix + '\t'.join(convert(row)) + '\n' for row in rows if len(row))
+        self._rest = ''
+
+    def read(self, size=-1) -> str:
+        chunks, n = [self._rest], len(self._rest)
+        for line in self._lines:
+            chunks.append(line)
+            n += len(line)
+            if 0 <= size <= n:
+                break
+
+        data = ''.join(chunks)
+        if size < 0:
+            size = len(data)
+        self._rest = data[size:]
+        return data[:size]
+
+def _node_columns(row: List[str]) -> List[str]:
+    id, *weights = row
+    return [id.strip(), '{' + ','.join(w.strip() for w in weights) + '}']
+
+def _edge_columns(row: List[str]) -> List[str]:
+    i, j = row
+    return [i.strip(), j.strip()]
+
+def _bundle_node_columns(row) -> List[str]:
+    id, weights = row
+    return [str(id), '{' + ','.join(map(str, weights.tolist())) + '}']
+
+def _bundle_edge_columns(row) -> List[str]:
+    return [str(row[0]), str(row[1])]
+
+def _copy_bundle(c, exp_id: int, graph_id: int, bundle: GraphBundle, chunk_size=2**16):
+    # walk the mapped arrays in chunks, so only one chunk is ever paged in and converted at a time
+    def chunks(*arrays):
+        for start in range(0, len(arrays[0]), chunk_size):
+            yield from zip(*(np.asarray(a[start:start + chunk_size]) for a in arrays))
+
+    n = bundle.graph.order()
+    weights = bundle.weights if bundle.weights is not None else np.zeros((n, 0), dtype=np.float32)
+    c.copy_expert('COPY nodes (exp_id, graph_id, id, basis_weights) FROM STDIN',
+                  CopySource(chunks(bundle.node_ids, weights), (exp_id, graph_id), _bundle_node_columns))
+
+    def edges():
+        for start in range(0, len(bundle.graph.edges), chunk_size):
+            yield from bundle.node_ids[bundle.graph.edges[start:start + chunk_size]].tolist()
+    c.copy_expert('COPY edges (exp_id, graph_id, i, j) FROM STDIN',
+                  CopySource(edges(), (exp_id, graph_id), _bundle_edge_columns))
+
+def load_graph(conn, exp_id: int, graph_dir: Path) -> int:
+    """
+    Load one graph directory (`image.png`, `basis_*.*`, `nodes.csv` and `edges.csv`) or graph bundle (see
+    `s2.bundle`) into an experiment, in its own transaction. Returns the new graph's id.
+    """
+    if is_bundle(graph_dir):
+        return _load_bundle(conn, exp_id, graph_dir)
+
+    with conn:
+        with conn.cursor() as c:
+            # push the base image
+            c.execute('INSERT INTO images (exp_id, uri) VALUES (%s, %s) RETURNING id',
+                      (exp_id, str(graph_dir / 'image.png')))
+            graph_id = image_id = c.fetchone()[0]
+
+            # push bases
+            psycopg2.extras.execute_values(c,
+                'INSERT INTO bases (exp_id, image_id, uri) VALUES %s',
+                [(exp_id, image_id, str(p)) for p in sorted(graph_dir.glob('basis_*.*'))])
+
+            # stream nodes, then edges (which reference them)
+            with open(graph_dir / 'nodes.csv', newline='') as f:
+                c.copy_expert('COPY nodes (exp_id, graph_id, id, basis_weights) FROM STDIN',
+                              CopySource(csv.reader(f), (exp_id, graph_id), _node_columns))
+            with open(graph_dir / 'edges.csv', newline='') as f:
+                c.copy_expert('COPY edges (exp_id, graph_id, i, j) FROM STDIN',
+                              CopySource(csv.reader(f), (exp_id, graph_id), _edge_columns))
+
+    logger.debug(f'[exp:{exp_id}] loaded graph {graph_id} from {graph_dir}')
+    return graph_id
+
+def _load_bundle(conn, exp_id: int, bundle_dir: Path) -> int:
+    bundle = open_bundle(bundle_dir)
+    if bundle.image is None or bundle.bases is None:
+        raise ValueError(f'{bundle_dir} has no base image or bases to show')
+
+    with conn:
+        with conn.cursor() as c:
+            # the bundle is the image: the renderer maps its image and bases straight from it
+            c.execute('INSERT INTO images (exp_id, uri) VALUES (%s, %s) RETURNING id', (exp_id, str(bundle_dir)))
+            graph_id = c.fetchone()[0]
+            _copy_bundle(c, exp_id, graph_id, bundle)
+
+    logger.debug(f'[exp:{exp_id}] loaded graph {graph_id} from bundle {bundle_dir}')
+    return graph_id
+
+def load_graphs(db, exp_id: int, graph_dirs: List[Path], n_threads: int,
+                progress: Callable[[Path], None] = lambda graph_dir: None) -> List[int]:
+    """
+    Load graph directories in parallel, each over its own connection from `db`, calling `progress` as each one
+    finishes. Returns the new graph ids, in the order of `graph_dirs`.
+    """
+    def load(graph_dir):
+        conn = db.getconn()
+        try:
+            return load_graph(conn, exp_id, graph_dir)
+        finally:
+            db.putconn(conn)
+
+    graph_ids = [None] * len(graph_dirs)
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        futures = {executor.submit(load, graph_dir): k for k, graph_dir in enumerate(graph_dirs)}
+        for future in as_completed(futures):
+            k = futures[future]
+            graph_ids[k] = future.result()
+            progress(graph_dirs[k])
+
+    return graph_ids
@@ -0,0 +1,64 @@
+import time
+import logging
+from .db import db
+from .master import JOBS_CHANNEL
+
+logger = logging.getLogger(__name__)
+
+def reap_expired_leases(db, batch_size: int = 1000) -> int:
+    """
+    Put jobs whose lease ran out back up for grabs, `batch_size` at a time, each batch in its own short
+    transaction. Returns how many jobs were reinstated.
+    """
+    n_reaped = 0
+    while True:
+        with db.cursor() as c:
+            # jobs being completed or renewed right now are skipped; their lease is no longer ours to end
+            c.execute('''
+            WITH
+                expired AS (
+                    SELECT exp_id, id
+                    FROM jobs
+                    WHERE status = 'waiting' AND lease_expires_at < now()
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                ),
+                reaped AS (
+                    UPDATE jobs
+                    SET
+                        status = 'unassigned',
+                        checked_out_at = NULL,
+                        lease_expires_at = NULL,
+                        leased_to = NULL
+                    FROM expired
+                    WHERE jobs.exp_id = expired.exp_id AND jobs.id = expired.id
+                    RETURNING jobs.exp_id
+                )
+            -- wake requests waiting for a job in each experiment (see dispatch.py) once this commits
+            SELECT count(*), pg_notify(%s, format('%%s %%s', exp_id, count(*)))
+            FROM reaped
+            GROUP BY exp_id
+            ''', (batch_size, JOBS_CHANNEL))
+            n = sum(row[0] for row in c)
+        db.commit()
+
+        n_reaped += n
+        if n < batch_size:
+            break
+
+    if n_reaped:
+        logger.debug(f'reinstated {n_reaped} jobs with expired leases')
+    return n_reaped
+
+def run_reaper(interval: float = 5.0, batch_size: int = 1000):
+    """
+    Reap expired leases every `interval` seconds until killed.
+    """
+    conn = db.connection
+    while True:
+        try:
+            reap_expired_leases(conn, batch_size)
+        except Exception:
+            conn.rollback()
+            logger.exception('failed to reap expired leases')
+        time.sleep(interval)
@@ -1,13 +1,23 @@
-from typing import Callable
-import operator
+from typing import Iterable, List, Optional, Tuple
 import logging
-from datetime import datetime, timedelta
+import random
 import psycopg2.extras
 import numpy as np
-from .db import required_votes
+from s2.moss import disjoint_midpoints
+from s2.components import ComponentIndex, StoppingRule
+from .metacache import metadata
+from .metrics import metrics
+from .graphcache import graph_cache, CachedGraph
 
 logger = logging.getLogger(__name__)
 
+EVENTS_CHANNEL = 's2_events'
+# notified with `<exp_id> <n_jobs>` when jobs become available, see `dispatch.py`
+JOBS_CHANNEL = 's2_jobs'
+
+# when a graph needs no more random restarts, see `s2.components.StoppingRule`
+STOPPING_RULE = StoppingRule()
+
 class Status:
     UNASSIGNED = 'unassigned'
     WAITING    = 'waiting'
@@ -18,123 +28,133 @@ class S2:
         self.exp_id = exp_id
         self.graph_id = graph_id
 
-        with db.cursor() as c:
-            c.execute('''
-            SELECT
-                (SELECT COUNT(*) FROM nodes WHERE exp_id = %s AND graph_id = %s),
-                (SELECT COUNT(*) FROM edges WHERE exp_id = %s AND graph_id = %s)
-            ''', (exp_id, graph_id, exp_id, graph_id))
-            self.n_nodes, self.n_edges = c.fetchone()
+        self.graph = graph_cache.get(db, exp_id, graph_id)
+        self.n_nodes = self.graph.graph.order()
+        self.n_edges = self.graph.graph.number_of_edges()
 
-            assert self.n_nodes != 0
-            assert self.n_edges != 0
+        assert self.n_nodes != 0
+        assert self.n_edges != 0
 
-        with db.cursor() as c:
-            # do we have both -1 and +1 labelled nodes?
-            # note: this is faster than 'SELECT array_agg(label) @> '{-1,1}' FROM nodes WHERE exp_id = %s'
-            c.execute('''
-            SELECT
-                (EXISTS(SELECT 1 FROM nodes
-                       WHERE exp_id = %(exp_id)s
-                       AND graph_id = %(graph_id)s
-                       AND label=-1)
-                AND
-                EXISTS(SELECT 1 FROM nodes
-                       WHERE exp_id = %(exp_id)s
-                       AND graph_id = %(graph_id)s
-                       AND label=1))
-            ''', {'exp_id': exp_id, 'graph_id': graph_id})
-            have_pair = c.fetchone()[0]
+        # do we have both -1 and +1 labelled nodes?
+        labels = self.graph.graph.labels
+        have_pair = (labels > 0).any() and (labels < 0).any()
 
         self.state = 'mssp' if have_pair else 'random_sampling'
         logger.debug(f'S2({exp_id}, {graph_id}) constructed with state={self.state}')
 
     def get_query(self, db) -> int:
+        queries = self.get_queries(db, 1)
+        return queries[0] if queries else None
+
+    def get_queries(self, db, k: int, exclude: Iterable[int] = ()) -> List[int]:
+        """
+        Propose up to `k` distinct nodes to query at once, none of which are in `exclude` (e.g. nodes that still
+        have jobs out).
+        """
+        exclude = list(exclude)
+        if k <= 0:
+            return []
+
         if self.state == 'random_sampling':
-            with db.cursor() as c:
-                # pick a random node we know nothing about
+            with db.cursor() as c, metrics.timer('s2_phase_seconds', phase='random_sampling'):
+                # pick random nodes we know nothing about: the first ones after a random point in sample_key
+                # order, wrapping around, which walks the unlabeled index instead of sorting the whole graph
                 # TODO: activity
                 c.execute('''
-                WITH nodes_of_interest AS (
-                    SELECT id FROM nodes
-                        WHERE exp_id = %s
-                        AND graph_id = %s
-                        AND label IS NULL
-                )
-                SELECT id FROM nodes_of_interest
-                    OFFSET (SELECT floor(random()*count(*)) FROM nodes_of_interest)
-                    LIMIT 1
-                ''', (self.exp_id, self.graph_id))
-
-                node_id = c.fetchone()[0]
-                logger.debug(f'got random node {node_id}')
-
-                return node_id
+                (SELECT id, 0 AS pass, sample_key FROM nodes
+                    WHERE exp_id = %(exp_id)s
+                    AND graph_id = %(graph_id)s
+                    AND label IS NULL
+                    AND sample_key >= %(start)s
+                    AND id <> ALL(%(exclude)s)
+                    ORDER BY sample_key
+                    LIMIT %(k)s)
+                UNION ALL
+                (SELECT id, 1 AS pass, sample_key FROM nodes
+                    WHERE exp_id = %(exp_id)s
+                    AND graph_id = %(graph_id)s
+                    AND label IS NULL
+                    AND sample_key < %(start)s
+                    AND id <> ALL(%(exclude)s)
+                    ORDER BY sample_key
+                    LIMIT %(k)s)
+                ORDER BY pass, sample_key
+                LIMIT %(k)s
+                ''', {'exp_id': self.exp_id, 'graph_id': self.graph_id, 'start': random.random(), 'exclude': exclude,
+                      'k': k})
+
+                node_ids = [row[0] for row in c]
+                logger.debug(f'got random nodes {node_ids}')
+
+                return node_ids
 
         elif self.state == 'mssp':
             # try to find obvious cuts and cut them
             logger.debug('performing obvious cuts')
-            self._perform_obvious_cuts(db)
+            with metrics.timer('s2_phase_seconds', phase='obvious_cuts'):
+                self._perform_obvious_cuts(db)
 
-            # try to pick a MSSP midpoint
-            logger.debug('picking an MSSP vertex')
-            vert = self._mssp(db)
+            # try to pick MSSP midpoints
+            logger.debug('picking MSSP vertices')
+            with metrics.timer('s2_phase_seconds', phase='mssp'):
+                verts = self._mssp(db, k, exclude)
 
-            # if we can't find one, we assume that we're done (two-separable-components assumption).
-            if vert is None:
-                pass
+            # if we can't find any, restart with random nodes, but only in components that still need labels; once
+            # none do, we're done with this graph
+            if not verts:
+                with metrics.timer('s2_phase_seconds', phase='open_components'):
+                    verts = self._sample_open_components(k, exclude)
 
-            return vert
+            return verts
 
         else:
             raise ValueError()
-    
+
     def _perform_obvious_cuts(self, db):
-        with db.cursor() as c:
-            c.execute('''
-            DELETE FROM edges edge USING nodes i, nodes j
-                WHERE edge.exp_id = %(exp_id)s AND edge.graph_id = %(graph_id)s
-                     AND i.exp_id = %(exp_id)s AND i.graph_id = %(graph_id)s
-                     AND j.exp_id = %(exp_id)s AND j.graph_id = %(graph_id)s
-                AND i.id = edge.i and j.id = edge.j
-                AND i.label <> j.label
-            ''', {'exp_id': self.exp_id, 'graph_id': self.graph_id})
-    
-    def _mssp(self, db):
-        with db.cursor() as c:
-            c.execute('''
-            WITH routes AS
-                ( SELECT *
-                    FROM pgr_dijkstra( 'SELECT id, i source, j target, 1 "cost", 1 "reverse_cost" FROM edges WHERE exp_id = %(exp_id)s AND graph_id = %(graph_id)s',
-                                    (SELECT array_agg(id)
-                                    FROM nodes
-                                    WHERE exp_id = %(exp_id)s
-                                        AND graph_id = %(graph_id)s
-                                        AND label = 1),
-                                    (SELECT array_agg(id)
-                                    FROM nodes
-                                    WHERE exp_id = %(exp_id)s
-                                        AND graph_id = %(graph_id)s
-                                        AND label = -1)) ),
-                routeCosts as (
-                    SELECT start_vid, end_vid, agg_cost
-                    FROM routes
-                    WHERE edge = -1
-                ),
-                shortestShortestPath AS (
-                    SELECT *
-                    FROM routes
-                    WHERE (start_vid, end_vid) = (SELECT start_vid, end_vid FROM routeCosts ORDER BY agg_cost ASC LIMIT 1)
-                )
-            SELECT node
-            FROM shortestShortestPath
-            WHERE path_seq = (select count(*)/2 + 1 from shortestShortestPath)
-            ''', {'exp_id': self.exp_id, 'graph_id': self.graph_id})
-            row = c.fetchone()
-            mssp = None if row is None else row[0]
-            logger.debug(f"[exp:{self.exp_id}] found MSSP! for {self.graph_id}: {mssp}")
+        cuts = self.graph.obvious_cuts()
+        if not len(cuts):
+            return
 
-            return mssp
+        with db.cursor() as c:
+            c.execute('DELETE FROM edges WHERE exp_id = %s AND graph_id = %s AND id = ANY(%s)',
+                      (self.exp_id, self.graph_id, self.graph.db_ids_of_edges(cuts).tolist()))
+
+        def apply(graph: CachedGraph):
+            graph.graph.alive[cuts] = False
+            graph.touch(graph.graph.edges[cuts].ravel().tolist())
+        graph_cache.record_write(db, self.exp_id, self.graph_id, apply)
+        # (reloaded if someone else changed the graph meanwhile)
+        self.graph = graph_cache.get(db, self.exp_id, self.graph_id)
+
+    def _sample_open_components(self, k, exclude=()):
+        """
+        Pick up to `k` random unlabeled nodes, not in `exclude`, from the components of the cut graph that
+        `STOPPING_RULE` keeps open.
+        """
+        G = self.graph.graph
+        components = ComponentIndex(G, STOPPING_RULE, lambda v: G.labels[v] != 0)
+        skip = set(self.graph.vertex(node_id) for node_id in exclude)
+
+        verts = components.sample(random, min(k + len(skip), len(components.open)))
+        node_ids = self.graph.node_ids[[v for v in verts if v not in skip][:k]].tolist()
+        logger.debug(f'[exp:{self.exp_id}] {len(components.open)} nodes left in open components of {self.graph_id}, '
+                     f'picked {node_ids}')
+        return node_ids
+
+    def _mssp(self, db, k=1, exclude=()):
+        """
+        Find the midpoints of up to `k` vertex-disjoint shortest paths between +1 and -1 nodes, by BFS over the
+        cached graph.
+        """
+        G = self.graph.graph
+        U, V = np.flatnonzero(G.labels > 0), np.flatnonzero(G.labels < 0)
+        exclude = [self.graph.vertex(node_id) for node_id in exclude]
+
+        verts = disjoint_midpoints(G, U, V, k, exclude=exclude)
+        mssp = self.graph.node_ids[verts].tolist()
+        logger.debug(f"[exp:{self.exp_id}] found MSSPs! for {self.graph_id}: {mssp}")
+
+        return mssp
 
     def __repr__(self) -> str:
         return f'<S² #v: {self.n_nodes}, #e: {self.n_edges}>'
@@ -143,98 +163,349 @@ class Master:
     def __init__(self, db, exp_id):
         self.exp_id = exp_id
     
-    def get_job_for(self, db, user_id, priority: Callable[..., float]):
+    def get_job_for(self, db, user_id, completion_weight=100, recency_weight=-10000, min_priority=-100):
+        """
+        Check out the best unassigned job for `user_id`, or `None` if there isn't one worth giving them.
+
+        A job's priority is `completion_weight` times the fraction of its graph that's labeled, plus
+        `recency_weight` if the user already voted on that graph; jobs below `min_priority` are held back, so that
+        users sometimes wait rather than see the same graph twice. Choosing and checking out happen in one
+        statement that skips jobs other requests are checking out, so no two requests get the same job.
+
+        The job is leased to the user for the experiment's `lease_seconds`, which `renew_lease` extends; once a lease
+        runs out, the lease reaper (see `leases.py`) puts the job back up for grabs.
+        """
         logger.debug(f'getting job in experiment {self.exp_id} for user {user_id}')
 
         with db.cursor() as c:
-            c.execute("SELECT COUNT(*) FROM jobs WHERE exp_id = %s AND status = 'unassigned'", (self.exp_id,))
-            n_jobs = c.fetchone()[0]
-            logger.debug(f'{n_jobs} unassigned jobs available')
-
-            # TODO: handle empty job list
-            if n_jobs == 0:
-                return None
-
-            # Scan the job table for expired jobs and reinstate them
             c.execute('''
+            WITH
+                candidates AS (
+                    SELECT DISTINCT graph_id FROM jobs WHERE exp_id = %(exp_id)s AND status = 'unassigned'
+                ),
+                progress AS (
+                    SELECT graph_id, n_labeled::float / greatest(n_nodes, 1) AS percent_done
+                    FROM graph_stats
+                    WHERE exp_id = %(exp_id)s AND graph_id IN (SELECT graph_id FROM candidates)
+                ),
+                touched AS (
+                    SELECT graph_id FROM user_graphs WHERE exp_id = %(exp_id)s AND user_id = %(user_id)s
+                ),
+                best AS (
+                    SELECT jobs.id
+                    FROM jobs
+                    JOIN progress USING (graph_id)
+                    LEFT JOIN touched USING (graph_id)
+                    WHERE jobs.exp_id = %(exp_id)s
+                      AND jobs.status = 'unassigned'
+                      AND progress.percent_done * %(completion_weight)s
+                          + (touched.graph_id IS NOT NULL)::int * %(recency_weight)s >= %(min_priority)s
+                    ORDER BY progress.percent_done * %(completion_weight)s
+                             + (touched.graph_id IS NOT NULL)::int * %(recency_weight)s DESC, jobs.id
+                    LIMIT 1
+                    FOR UPDATE OF jobs SKIP LOCKED
+                )
             UPDATE jobs
             SET
-                status = 'unassigned',
-                checked_out_at = NULL
-            WHERE
-                checked_out_at + %(timeout)s < now()
-                AND exp_id = %(exp_id)s
-                AND status = 'waiting'
-            ''', {'timeout': timedelta(seconds=30), 'exp_id': self.exp_id})
-            logger.debug(f'[{self.exp_id}]: reset {c.rowcount} expired jobs to UNASSIGNED status')
+                status = 'waiting',
+                checked_out_at = now(),
+                lease_expires_at = now() + experiments.lease_seconds * interval '1 second',
+                leased_to = %(user_id)s
+            FROM best, experiments
+            WHERE jobs.exp_id = %(exp_id)s AND jobs.id = best.id AND experiments.id = %(exp_id)s
+            RETURNING jobs.id, jobs.graph_id, jobs.node_id, jobs.ballot_id, experiments.lease_seconds
+            ''', {'exp_id': self.exp_id, 'user_id': user_id,
+                  'completion_weight': completion_weight, 'recency_weight': recency_weight,
+                  'min_priority': min_priority})
 
-            c.execute('''
-            SELECT
-                id, graph_id, node_id, ballot_id
-            FROM jobs
-            WHERE exp_id = %s
-              AND status = 'unassigned'
-            ''', (self.exp_id,))
-
-            jobs = [
-                {
-                    'job_id': job_id,
-                    'graph_id': graph_id,
-                    'node_id': node_id,
-                    'ballot_id': ballot_id,
-                }
-                for job_id, graph_id, node_id, ballot_id in c
-            ]
-
-            state = None # TODO: uggghhh
-            jobs = [{'job': job, 'priority': priority(job, user_id, state)}
-                        for job in jobs]
-
-            opt_job = max(jobs, key=operator.itemgetter('priority'))
-
-            logger.debug(f'found optimal job: {opt_job}')
-
-            # just pretend negative-priority jobs are fake below some threshold, so that we actually make users wait sometimes.
-            if opt_job['priority'] < -100:
+            row = c.fetchone()
+            if row is None:
+                logger.debug(f'[{self.exp_id}]: no job for user {user_id}')
                 return None
 
-            # switch this job to WAITING and set the time we checked it out
-            c.execute("UPDATE jobs SET status = 'waiting', checked_out_at = %s WHERE id = %s",
-                      (datetime.now(), opt_job['job']['job_id'],))
-            
-            return opt_job['job']
+            job_id, graph_id, node_id, ballot_id, lease_seconds = row
+            job = {'job_id': job_id, 'graph_id': graph_id, 'node_id': node_id, 'ballot_id': ballot_id,
+                   'lease_seconds': lease_seconds}
+            logger.debug(f'checked out job: {job}')
 
-    def voting_done(self, db, graph_id, node_id):
-        # find the majority
+            return job
+
+    def leased_job_of(self, db, user_id) -> Optional[dict]:
+        """
+        The job `user_id` most recently checked out and still holds the lease on, like `get_job_for` returns it, or
+        `None`.
+        """
         with db.cursor() as c:
-            c.execute("""
-            SELECT sum(vote_label)
-                FROM jobs
-                WHERE exp_id = %s AND graph_id = %s AND node_id = %s
-            """, (self.exp_id, graph_id, node_id))
+            c.execute('''
+            SELECT jobs.id, jobs.graph_id, jobs.node_id, jobs.ballot_id, experiments.lease_seconds
+            FROM jobs JOIN experiments ON experiments.id = jobs.exp_id
+            WHERE jobs.exp_id = %(exp_id)s AND jobs.status = 'waiting' AND jobs.leased_to = %(user_id)s
+              AND jobs.lease_expires_at > now()
+            ORDER BY jobs.checked_out_at DESC
+            LIMIT 1
+            ''', {'exp_id': self.exp_id, 'user_id': user_id})
+            row = c.fetchone()
+            if row is None:
+                return None
+            return dict(zip(['job_id', 'graph_id', 'node_id', 'ballot_id', 'lease_seconds'], row))
 
-            sum_labels = c.fetchone()[0]
-            assert sum_labels is not None
-        
-        majority_label = np.sign(sum_labels)
-        logger.debug(f'voting done for {graph_id}:{node_id}, majority label is {majority_label}')
+    def renew_lease(self, db, job_id, user_id) -> bool:
+        """
+        Extend `user_id`'s lease on a job they're still working on by the experiment's `lease_seconds`. Returns
+        whether they still held it: a lease that already ran out may have gone to someone else.
+        """
+        with db.cursor() as c:
+            c.execute('''
+            UPDATE jobs
+            SET lease_expires_at = now() + experiments.lease_seconds * interval '1 second'
+            FROM experiments
+            WHERE jobs.exp_id = %(exp_id)s AND jobs.id = %(job_id)s AND experiments.id = %(exp_id)s
+              AND jobs.status = 'waiting' AND jobs.leased_to = %(user_id)s
+            ''', {'exp_id': self.exp_id, 'job_id': job_id, 'user_id': user_id})
+            return c.rowcount == 1
+
+    def queue_initial_jobs(self, db, queries_per_graph: int, required_votes: int) -> int:
+        """
+        Queue the first queries of every graph in the experiment at once: with no labels yet, S² samples
+        `queries_per_graph` random nodes of each graph. Returns how many jobs were queued.
+        """
+        with db.cursor() as c:
+            c.execute('''
+            INSERT INTO jobs (exp_id, graph_id, node_id, ballot_id, status)
+                SELECT exp_id, graph_id, id, ballot_id, 'unassigned'
+                FROM (
+                    SELECT exp_id, graph_id, id,
+                           row_number() OVER (PARTITION BY graph_id ORDER BY sample_key) AS k
+                    FROM nodes
+                    WHERE exp_id = %(exp_id)s AND label IS NULL
+                ) sampled
+                CROSS JOIN generate_series(0, %(required_votes)s - 1) AS ballot_id
+                WHERE k <= %(queries_per_graph)s
+                ON CONFLICT (exp_id, graph_id, node_id, ballot_id) DO NOTHING
+            ''', {'exp_id': self.exp_id, 'queries_per_graph': queries_per_graph, 'required_votes': required_votes})
+            n_jobs = c.rowcount
+        self.jobs_available(db, n_jobs)
+        return n_jobs
+
+    def jobs_available(self, db, n_jobs: int):
+        """
+        Wake up to `n_jobs` requests waiting for a job in this experiment, once the current transaction commits.
+        """
+        if n_jobs > 0:
+            with db.cursor() as c:
+                c.execute('SELECT pg_notify(%s, %s)', (JOBS_CHANNEL, f'{self.exp_id} {n_jobs}'))
 
+    def upcoming_nodes(self, db, limit: int) -> List[Tuple[int, int]]:
+        """
+        The `(graph_id, node_id)` of up to `limit` nodes that still have unassigned jobs, likely to be handed out
+        soon.
+        """
         with db.cursor() as c:
-            # set the node's label
-            c.execute('UPDATE nodes SET label = %s WHERE exp_id = %s AND graph_id = %s AND id = %s', (int(majority_label), self.exp_id, graph_id, node_id))
+            c.execute('''
+            SELECT graph_id, node_id
+            FROM jobs
+            WHERE exp_id = %s AND status = 'unassigned'
+            GROUP BY graph_id, node_id
+            ORDER BY min(id)
+            LIMIT %s
+            ''', (self.exp_id, limit))
+            return c.fetchall()
+
+    def complete_job(self, db, job_id, user_id, label) -> Optional[Tuple[int, int, int]]:
+        """
+        Record `user_id`'s vote of `label` on a job, and that they've now seen its graph, in one statement. Returns
+        the job's `(graph_id, node_id)` and how many of its node's ballots are still open, or `None` if there's no
+        such job.
+        """
+        with db.cursor() as c:
+            # the count sees the jobs as they were before this statement, so leaves this job out itself
+            c.execute('''
+            WITH
+                done AS (
+                    UPDATE jobs
+                    SET status = 'completed',
+                        vote_label = %(label)s,
+                        completing_user = %(user_id)s
+                    WHERE exp_id = %(exp_id)s AND id = %(job_id)s
+                    RETURNING graph_id, node_id, ballot_id
+                ),
+                seen AS (
+                    INSERT INTO user_graphs (exp_id, user_id, graph_id)
+                        SELECT %(exp_id)s, %(user_id)s, graph_id FROM done
+                        ON CONFLICT DO NOTHING
+                )
+            SELECT graph_id, node_id, ballot_id, (
+                SELECT count(*)
+                FROM jobs
+                WHERE exp_id = %(exp_id)s AND graph_id = done.graph_id AND node_id = done.node_id
+                  AND id <> %(job_id)s AND status <> 'completed'
+            )
+            FROM done
+            ''', {'exp_id': self.exp_id, 'job_id': job_id, 'user_id': user_id, 'label': label})
 
-        db.commit()
+            row = c.fetchone()
+            if row is None:
+                return None
+            graph_id, node_id, ballot_id, n_votes_remaining = row
+            logger.debug(f'exp: {self.exp_id}, job: {job_id}, graph: {graph_id}, node: {node_id}, label: {label}, ballot: {ballot_id}')
+            return graph_id, node_id, n_votes_remaining
+
+    def submit_votes(self, db, user_id, votes: List[Tuple[int, int]]) -> Tuple[int, List[Tuple[int, int]]]:
+        """
+        Record many `(job_id, label)` votes by `user_id` at once, like `complete_job`, in one statement. Jobs that
+        are already completed, or not in this experiment, are skipped. Returns how many votes were recorded, and
+        the `(graph_id, node_id)` of the nodes they finished.
+        """
+        job_ids = [job_id for job_id, _ in votes]
+        with db.cursor() as c:
+            # as in complete_job, the subquery sees the jobs as they were before this statement
+            c.execute('''
+            WITH
+                votes AS (
+                    SELECT * FROM unnest(%(job_ids)s::bigint[], %(labels)s::int[]) AS v (job_id, label)
+                ),
+                done AS (
+                    UPDATE jobs
+                    SET status = 'completed',
+                        vote_label = votes.label,
+                        completing_user = %(user_id)s
+                    FROM votes
+                    WHERE jobs.exp_id = %(exp_id)s AND jobs.id = votes.job_id AND jobs.status <> 'completed'
+                    RETURNING jobs.graph_id, jobs.node_id
+                ),
+                seen AS (
+                    INSERT INTO user_graphs (exp_id, user_id, graph_id)
+                        SELECT DISTINCT %(exp_id)s, %(user_id)s, graph_id FROM done
+                        ON CONFLICT DO NOTHING
+                )
+            SELECT graph_id, node_id, count(*) AS n_votes, NOT EXISTS (
+                SELECT 1
+                FROM jobs
+                WHERE exp_id = %(exp_id)s AND graph_id = done.graph_id AND node_id = done.node_id
+                  AND status <> 'completed' AND id <> ALL(%(job_ids)s)
+            ) AS finished
+            FROM done
+            GROUP BY graph_id, node_id
+            ''', {'exp_id': self.exp_id, 'user_id': user_id, 'job_ids': job_ids,
+                  'labels': [label for _, label in votes]})
+            rows = c.fetchall()
+
+        n_votes = sum(row[2] for row in rows)
+        finished = [(graph_id, node_id) for graph_id, node_id, _, is_finished in rows if is_finished]
+        logger.debug(f'[exp:{self.exp_id}] recorded {n_votes} votes by {user_id}, finishing {len(finished)} nodes')
+        return n_votes, finished
+
+    def import_labels(self, db, labels: List[Tuple[int, int, int]]) -> List[Tuple[int, int]]:
+        """
+        Set the labels of nodes directly from `(graph_id, node_id, label)`, e.g. labels collected offline, in one
+        statement. Returns the `(graph_id, node_id)` of the nodes whose label changed.
+        """
+        with db.cursor() as c:
+            c.execute('''
+            UPDATE nodes
+            SET label = l.label
+            FROM unnest(%s::bigint[], %s::int[], %s::int[]) AS l (graph_id, node_id, label)
+            WHERE nodes.exp_id = %s AND nodes.graph_id = l.graph_id AND nodes.id = l.node_id
+              AND nodes.label IS DISTINCT FROM l.label
+            RETURNING nodes.graph_id, nodes.id
+            ''', ([g for g, _, _ in labels], [n for _, n, _ in labels], [l for _, _, l in labels], self.exp_id))
+            return c.fetchall()
+
+    def node_finished(self, db, graph_id, node_id):
+        self.nodes_finished(db, [(graph_id, node_id)])
+
+    def nodes_finished(self, db, nodes: List[Tuple[int, int]]):
+        """
+        Queue `(graph_id, node_id)` of nodes whose votes are all in for an S² worker (see `worker.py`), which calls
+        `voting_done` once per graph.
+        """
+        if not nodes:
+            return
+        with db.cursor() as c:
+            c.execute('''
+            INSERT INTO node_events (exp_id, graph_id, node_id)
+                SELECT %s, graph_id, node_id FROM unnest(%s::bigint[], %s::bigint[]) AS n (graph_id, node_id);
+            SELECT pg_notify(%s, %s);
+            ''', (self.exp_id, [g for g, _ in nodes], [n for _, n in nodes], EVENTS_CHANNEL, str(self.exp_id)))
+
+    def voting_done(self, db, graph_id, node_ids: Iterable[int]):
+        """
+        Label finished nodes of one graph by majority vote, then run S² once to top the graph back up to its
+        number of outstanding queries. Nodes without votes (whose labels were imported) keep their label; tied
+        nodes get one more ballot instead, and are finished again once it's in.
+        """
+        node_ids = sorted(set(node_ids))
+        with db.cursor() as c:
+            # find the majorities and set them, or break ties, in one statement
+            c.execute("""
+            WITH
+                votes AS (
+                    SELECT node_id, sum(vote_label) AS total, max(ballot_id) AS last_ballot
+                    FROM jobs
+                    WHERE exp_id = %(exp_id)s AND graph_id = %(graph_id)s AND node_id = ANY(%(node_ids)s)
+                      AND vote_label IS NOT NULL
+                    GROUP BY node_id
+                ),
+                labeled AS (
+                    UPDATE nodes
+                    SET label = sign(votes.total)::int
+                    FROM votes
+                    WHERE nodes.exp_id = %(exp_id)s AND nodes.graph_id = %(graph_id)s AND nodes.id = votes.node_id
+                      AND votes.total <> 0
+                    RETURNING nodes.id, nodes.label
+                ),
+                tied AS (
+                    INSERT INTO jobs (exp_id, graph_id, node_id, ballot_id, status)
+                        SELECT %(exp_id)s, %(graph_id)s, node_id, last_ballot + 1, 'unassigned'
+                        FROM votes
+                        WHERE total = 0
+                        ON CONFLICT (exp_id, graph_id, node_id, ballot_id) DO NOTHING
+                        RETURNING node_id
+                )
+            SELECT id, label FROM labeled
+            UNION ALL
+            SELECT node_id, 0 FROM tied
+            """, {'exp_id': self.exp_id, 'graph_id': graph_id, 'node_ids': node_ids})
+            rows = c.fetchall()
+        labeled = [(node_id, label) for node_id, label in rows if label != 0]
+        n_tied = len(rows) - len(labeled)
+        if n_tied:
+            logger.debug(f'{n_tied} nodes of {graph_id} are tied, queued another ballot for each')
+            self.jobs_available(db, n_tied)
+        logger.debug(f'voting done for {len(node_ids)} nodes of {graph_id}, majority labels are {labeled}')
+
+        if labeled:
+            def apply(graph: CachedGraph):
+                verts = [graph.vertex(node_id) for node_id, _ in labeled]
+                for vert, (_, label) in zip(verts, labeled):
+                    graph.graph.set_label(vert, label)
+                graph.touch(verts)
+            graph_cache.record_write(db, self.exp_id, graph_id, apply)
+
+        # run s2 again to top this graph back up to its number of outstanding queries
+        with db.cursor() as c:
+            c.execute("""
+            SELECT DISTINCT node_id
+                FROM jobs
+                WHERE exp_id = %s AND graph_id = %s AND status <> 'completed'
+            """, (self.exp_id, graph_id))
+            outstanding = [row[0] for row in c]
 
-        # run s2 again to get new jobs for this graph
         s2 = S2(db, self.exp_id, graph_id)
-        new_node = s2.get_query(db)
-        logger.debug(f'getting new node for {graph_id}: {new_node}')
+        new_nodes = s2.get_queries(db, metadata.queries_per_graph(db, self.exp_id) - len(outstanding), exclude=outstanding)
+        logger.debug(f'getting new nodes for {graph_id}: {new_nodes}')
+        n_votes = metadata.required_votes(db, self.exp_id)
         jobs = [
             (self.exp_id, graph_id, new_node, ballot_id, Status.UNASSIGNED)
-            for ballot_id in range(required_votes(db, self.exp_id))
+            for new_node in new_nodes
+            for ballot_id in range(n_votes)
         ]
 
-        with db.cursor() as c:
-            psycopg2.extras.execute_values(c, 'INSERT INTO jobs (exp_id, graph_id, node_id, ballot_id, status) VALUES %s',
-                jobs)
-        
\ No newline at end of file
+        if jobs:
+            with db.cursor() as c:
+                # the same node can be finished twice (two last votes racing), so don't queue its successors twice
+                psycopg2.extras.execute_values(c, '''
+                INSERT INTO jobs (exp_id, graph_id, node_id, ballot_id, status) VALUES %s
+                    ON CONFLICT (exp_id, graph_id, node_id, ballot_id) DO NOTHING
+                ''', jobs)
+            self.jobs_available(db, len(jobs))
@@ -0,0 +1,108 @@
+from typing import Callable, Hashable, List, Optional, Tuple
+from collections import OrderedDict
+import threading
+import logging
+import time
+import numpy as np
+from .db import experiment_metadata, image_uris, basis_weights_for_graph
+
+logger = logging.getLogger(__name__)
+
+class GraphWeights:
+    """
+    The basis weights of every node of a graph, as the rows of one matrix in node id order.
+    """
+    def __init__(self, node_ids: np.ndarray, weights: np.ndarray):
+        self.node_ids = node_ids
+        self.weights = weights
+
+    @property
+    def nbytes(self) -> int:
+        return self.node_ids.nbytes + self.weights.nbytes
+
+    def of(self, node_id: int) -> Optional[np.ndarray]:
+        k = np.searchsorted(self.node_ids, node_id)
+        if k == len(self.node_ids) or self.node_ids[k] != node_id:
+            return None
+        return self.weights[k]
+
+class MetadataCache:
+    """
+    An in-process cache of what an experiment fixes at `launch-experiment` and never changes: its settings, the
+    URIs of its images and bases, and the basis weights of its nodes, loaded a whole graph at a time.
+
+    Entries are evicted least recently used once they take up more than `max_bytes`, and reloaded after `ttl`
+    seconds in case someone edited the database by hand; `invalidate` drops them right away.
+    """
+    def __init__(self, app=None, max_bytes=256 * 2**20, ttl=600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_bytes = app.config.get('METADATA_CACHE_BYTES', self.max_bytes)
+        self.ttl = app.config.get('METADATA_CACHE_TTL', self.ttl)
+
+    def experiment(self, db, exp_id: int) -> dict:
+        """
+        `required_votes`, `queries_per_graph` and `lease_seconds` of an experiment.
+        """
+        return self._get(('experiment', exp_id), lambda: experiment_metadata(db, exp_id), lambda meta: 256)
+
+    def required_votes(self, db, exp_id: int) -> int:
+        return self.experiment(db, exp_id)['required_votes']
+
+    def queries_per_graph(self, db, exp_id: int) -> int:
+        return self.experiment(db, exp_id)['queries_per_graph']
+
+    def image_uris(self, db, exp_id: int, image_id: int) -> Tuple[str, List[str]]:
+        return self._get(('image', exp_id, image_id), lambda: image_uris(db, exp_id, image_id),
+                         lambda uris: sum(len(uri) for uri in uris[1]) + len(uris[0]) + 256)
+
+    def graph_weights(self, db, exp_id: int, graph_id: int) -> GraphWeights:
+        return self._get(('weights', exp_id, graph_id),
+                         lambda: GraphWeights(*basis_weights_for_graph(db, exp_id, graph_id)),
+                         lambda weights: weights.nbytes)
+
+    def basis_weights(self, db, exp_id: int, graph_id: int, node_id: int) -> Optional[np.ndarray]:
+        return self.graph_weights(db, exp_id, graph_id).of(node_id)
+
+    def invalidate(self, exp_id: Optional[int] = None):
+        with self._lock:
+            for key in list(self._entries):
+                if exp_id is None or key[1] == exp_id:
+                    self._drop(key)
+
+    def _get(self, key: Hashable, load: Callable, size: Callable):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    return entry[1]
+                self._drop(key)
+
+        # loaded outside the lock; two threads may both load the same entry, which is harmless
+        logger.debug(f'loading {key} into the metadata cache')
+        value = load()
+
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            nbytes = size(value)
+            self._entries[key] = (now + self.ttl, value, nbytes)
+            self._nbytes += nbytes
+            while self._nbytes > self.max_bytes and len(self._entries) > 1:
+                self._drop(next(iter(self._entries)))
+        return value
+
+    def _drop(self, key: Hashable):
+        self._nbytes -= self._entries.pop(key)[2]
+
+metadata = MetadataCache()
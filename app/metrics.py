@@ -0,0 +1,198 @@
+import atexit
+import bisect
+import threading
+import logging
+import random
+import json
+import time
+import os
+from pathlib import Path
+from flask import g, request
+
+logger = logging.getLogger(__name__)
+
+# seconds; from a fast index lookup to a slow S² step
+DEFAULT_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+HELP = {
+    's2_request_seconds': 'Time to handle a request, by endpoint and status.',
+    's2_sql_seconds': 'Time to run an SQL statement, by the function that ran it.',
+    's2_pool_wait_seconds': 'Time spent waiting for a pooled connection to be put back.',
+    's2_phase_seconds': 'Time spent in a phase of S² or image rendering.',
+}
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class _Timer:
+    __slots__ = ('metrics', 'name', 'labels', 'start')
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+_NULL_TIMER = _NullTimer()
+
+class Metrics:
+    """
+    Timing histograms for the hot paths, rendered in the Prometheus text format by `/metrics`.
+
+    Disabled (the default, see `METRICS_ENABLED`), `timer` hands out a shared no-op and nothing is recorded.
+    Enabled, a `METRICS_LOG_SAMPLE_RATE` fraction of observations is also logged as JSON, one per line.
+
+    Histograms are kept per process. With several server processes (e.g. gunicorn workers), point `METRICS_DIR` at
+    a directory they share, emptied whenever the server starts: each process writes its histograms there at most
+    every `flush_interval` seconds, as `<pid>.json`, and `render` adds up every file, including those of processes
+    that have since exited.
+    """
+    def __init__(self, app=None, enabled=False, log_sample_rate=0.0, directory=None, flush_interval=1.0):
+        self.enabled = enabled
+        self.log_sample_rate = log_sample_rate
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._next_flush = 0.0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('METRICS_ENABLED', self.enabled)
+        self.log_sample_rate = app.config.get('METRICS_LOG_SAMPLE_RATE', self.log_sample_rate)
+        self.directory = app.config.get('METRICS_DIR', self.directory)
+        if self.enabled:
+            if self.directory:
+                Path(self.directory).mkdir(parents=True, exist_ok=True)
+                atexit.register(self.flush)
+            app.before_request(self._start_request)
+            app.after_request(self._end_request)
+
+    def timer(self, name: str, **labels):
+        """
+        A context manager observing how long its block takes into the histogram `name`.
+        """
+        return _Timer(self, name, labels) if self.enabled else _NULL_TIMER
+
+    def observe(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if os.getpid() != self._pid:
+                # a forked child starts over, rather than count its parent's observations again
+                self._histograms.clear()
+                self._pid = os.getpid()
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+        if self.directory and time.monotonic() >= self._next_flush:
+            self.flush()
+
+        if self.log_sample_rate and random.random() < self.log_sample_rate:
+            logger.info(json.dumps({'metric': name, 'value': value, **labels}))
+
+    def flush(self):
+        """
+        Write this process's histograms to `METRICS_DIR`, for whichever process renders them next.
+        """
+        with self._lock:
+            self._next_flush = time.monotonic() + self.flush_interval
+            snapshot = [[name, list(labels), h.counts, h.sum, h.count]
+                        for (name, labels), h in self._histograms.items()]
+            path = Path(self.directory) / f'{self._pid}.json'
+
+        # written whole and renamed into place, so readers never see half a file
+        tmp = path.with_suffix(f'.{threading.get_ident()}.tmp')
+        tmp.write_text(json.dumps(snapshot))
+        os.replace(tmp, path)
+
+    def _collect(self) -> dict:
+        if not self.directory:
+            with self._lock:
+                return {key: (list(h.counts), h.sum, h.count) for key, h in self._histograms.items()}
+
+        self.flush()
+        totals = {}
+        for path in Path(self.directory).glob('*.json'):
+            try:
+                snapshot = json.loads(path.read_text())
+            except (OSError, ValueError):
+                logger.warning(f'skipping unreadable metrics file {path}')
+                continue
+            for name, labels, counts, total, count in snapshot:
+                key = (name, tuple(tuple(label) for label in labels))
+                if key in totals:
+                    old_counts, old_total, old_count = totals[key]
+                    counts = [a + b for a, b in zip(old_counts, counts)]
+                    total, count = old_total + total, old_count + count
+                totals[key] = (counts, total, count)
+        return totals
+
+    def render(self) -> str:
+        items = sorted((key, (DEFAULT_BUCKETS, counts, total, count))
+                       for key, (counts, total, count) in self._collect().items())
+
+        lines = []
+        last_name = None
+        for (name, labels), (buckets, counts, total, count) in items:
+            if name != last_name:
+                lines.append(f'# HELP {name} {HELP.get(name, name)}')
+                lines.append(f'# TYPE {name} histogram')
+                last_name = name
+
+            cumulative = 0
+            for bound, n in zip(buckets + (float('inf'),), counts):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{name}_bucket{_labels(labels + (("le", le),))} {cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {total}')
+            lines.append(f'{name}_count{_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def _start_request(self):
+        g.metrics_start = time.perf_counter()
+
+    def _end_request(self, response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            self.observe('s2_request_seconds', time.perf_counter() - start,
+                         endpoint=request.endpoint or 'unknown', status=str(response.status_code))
+        return response
+
+def _labels(labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+metrics = Metrics()
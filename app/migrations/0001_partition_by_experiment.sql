@@ -0,0 +1,241 @@
+-- Bring a database created by an earlier schema.sql up to date, partitioning nodes, edges and jobs by experiment.
+-- Their rows are set aside, the tables recreated as in schema.sql (one partition per existing experiment) and the
+-- rows copied back, which also rebuilds graph_stats and bumps graph_versions through their triggers.
+
+ALTER TABLE experiments ADD COLUMN IF NOT EXISTS queries_per_graph bigint NOT NULL DEFAULT 1;
+
+CREATE TABLE IF NOT EXISTS graph_versions (
+    exp_id bigint NOT NULL,
+    graph_id bigint NOT NULL,
+    version bigint NOT NULL DEFAULT 0,
+
+    PRIMARY KEY (exp_id, graph_id)
+);
+
+CREATE TABLE IF NOT EXISTS node_events (
+    id bigserial PRIMARY KEY,
+
+    exp_id bigint NOT NULL,
+    graph_id bigint NOT NULL,
+    node_id bigint NOT NULL,
+    created_at timestamp NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS graph_stats (
+    exp_id bigint NOT NULL,
+    graph_id bigint NOT NULL,
+
+    n_nodes bigint NOT NULL DEFAULT 0,
+    n_edges bigint NOT NULL DEFAULT 0,
+    n_labeled bigint NOT NULL DEFAULT 0,
+    n_positive bigint NOT NULL DEFAULT 0,
+    n_negative bigint NOT NULL DEFAULT 0,
+
+    PRIMARY KEY (exp_id, graph_id)
+);
+
+CREATE TABLE IF NOT EXISTS user_graphs (
+    exp_id bigint NOT NULL,
+    user_id bigint NOT NULL,
+    graph_id bigint NOT NULL,
+
+    PRIMARY KEY (exp_id, user_id, graph_id)
+);
+
+INSERT INTO user_graphs (exp_id, user_id, graph_id)
+    SELECT DISTINCT exp_id, completing_user, graph_id FROM jobs WHERE completing_user IS NOT NULL
+    ON CONFLICT DO NOTHING;
+
+CREATE TEMPORARY TABLE old_nodes ON COMMIT DROP AS SELECT exp_id, graph_id, id, basis_weights, label FROM nodes;
+CREATE TEMPORARY TABLE old_edges ON COMMIT DROP AS SELECT id, exp_id, graph_id, i, j FROM edges;
+CREATE TEMPORARY TABLE old_jobs ON COMMIT DROP AS
+    SELECT id, exp_id, graph_id, node_id, ballot_id, vote_label, status, checked_out_at, completing_user FROM jobs;
+DROP TABLE jobs, edges, nodes;
+
+CREATE TABLE nodes (
+    id integer NOT NULL, -- integer to keep pgrouting happy :)
+    exp_id bigint REFERENCES experiments(id) NOT NULL,
+    graph_id bigint REFERENCES images(id) NOT NULL,
+    
+    basis_weights float[] NOT NULL,
+    label integer NULL,
+    sample_key float8 NOT NULL DEFAULT random(), -- a random order for sampling unlabeled nodes by index
+
+    PRIMARY KEY (exp_id, graph_id, id)
+) PARTITION BY LIST (exp_id);
+
+CREATE TABLE edges (
+    id bigserial NOT NULL,
+
+    exp_id bigint NOT NULL,
+    graph_id bigint NOT NULL,
+
+    i integer NOT NULL,
+    j integer NOT NULL,
+
+    PRIMARY KEY (exp_id, id),
+    FOREIGN KEY (exp_id, graph_id, i) REFERENCES nodes(exp_id, graph_id, id),
+    FOREIGN KEY (exp_id, graph_id, j) REFERENCES nodes(exp_id, graph_id, id)
+) PARTITION BY LIST (exp_id);
+
+CREATE TABLE jobs (
+    id bigserial NOT NULL,
+
+    exp_id bigint NOT NULL,
+    graph_id bigint NOT NULL,
+    node_id bigint NOT NULL,
+    
+    ballot_id int NOT NULL,
+    vote_label int NULL,
+    status jobstatus NOT NULL,
+    checked_out_at timestamp NULL,
+    completing_user bigint NULL,
+
+    PRIMARY KEY (exp_id, id),
+    FOREIGN KEY (exp_id, graph_id, node_id) REFERENCES nodes (exp_id, graph_id, id)
+) PARTITION BY LIST (exp_id);
+
+CREATE OR REPLACE FUNCTION create_experiment_partitions(experiment bigint) RETURNS void AS $$
+DECLARE
+    parent text;
+BEGIN
+    FOREACH parent IN ARRAY ARRAY['nodes', 'edges', 'jobs'] LOOP
+        EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES IN (%s)', parent || '_exp_' || experiment, parent, experiment);
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION experiment_created() RETURNS trigger AS $$
+BEGIN
+    PERFORM create_experiment_partitions(NEW.id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION detach_experiment(experiment bigint) RETURNS void AS $$
+DECLARE
+    parent text;
+    fk record;
+BEGIN
+    FOREACH parent IN ARRAY ARRAY['jobs', 'edges', 'nodes'] LOOP
+        EXECUTE format('ALTER TABLE %I DETACH PARTITION %I', parent, parent || '_exp_' || experiment);
+        FOR fk IN
+            SELECT conname FROM pg_constraint
+            WHERE conrelid = (parent || '_exp_' || experiment)::regclass AND confrelid = 'nodes'::regclass
+        LOOP
+            EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I', parent || '_exp_' || experiment, fk.conname);
+        END LOOP;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS experiments_inserted ON experiments;
+CREATE TRIGGER experiments_inserted AFTER INSERT ON experiments
+    FOR EACH ROW EXECUTE PROCEDURE experiment_created();
+
+SELECT create_experiment_partitions(id) FROM experiments;
+
+CREATE OR REPLACE FUNCTION bump_graph_versions() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO graph_versions (exp_id, graph_id, version)
+        SELECT DISTINCT exp_id, graph_id, 1 FROM changed_rows
+        ON CONFLICT (exp_id, graph_id) DO UPDATE SET version = graph_versions.version + 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER nodes_inserted AFTER INSERT ON nodes REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE bump_graph_versions();
+CREATE TRIGGER nodes_updated AFTER UPDATE ON nodes REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE bump_graph_versions();
+CREATE TRIGGER nodes_deleted AFTER DELETE ON nodes REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE bump_graph_versions();
+CREATE TRIGGER edges_inserted AFTER INSERT ON edges REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE bump_graph_versions();
+CREATE TRIGGER edges_updated AFTER UPDATE ON edges REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE bump_graph_versions();
+CREATE TRIGGER edges_deleted AFTER DELETE ON edges REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE bump_graph_versions();
+
+CREATE OR REPLACE FUNCTION count_node_stats() RETURNS trigger AS $$
+BEGIN
+    -- an UPDATE adds its new rows and takes away its old ones
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO graph_stats (exp_id, graph_id, n_nodes, n_labeled, n_positive, n_negative)
+            SELECT exp_id, graph_id, count(*), count(label),
+                   count(*) FILTER (WHERE label > 0), count(*) FILTER (WHERE label < 0)
+            FROM new_rows GROUP BY exp_id, graph_id
+            ON CONFLICT (exp_id, graph_id) DO UPDATE SET
+                n_nodes = graph_stats.n_nodes + excluded.n_nodes,
+                n_labeled = graph_stats.n_labeled + excluded.n_labeled,
+                n_positive = graph_stats.n_positive + excluded.n_positive,
+                n_negative = graph_stats.n_negative + excluded.n_negative;
+    END IF;
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        INSERT INTO graph_stats (exp_id, graph_id, n_nodes, n_labeled, n_positive, n_negative)
+            SELECT exp_id, graph_id, -count(*), -count(label),
+                   -count(*) FILTER (WHERE label > 0), -count(*) FILTER (WHERE label < 0)
+            FROM old_rows GROUP BY exp_id, graph_id
+            ON CONFLICT (exp_id, graph_id) DO UPDATE SET
+                n_nodes = graph_stats.n_nodes + excluded.n_nodes,
+                n_labeled = graph_stats.n_labeled + excluded.n_labeled,
+                n_positive = graph_stats.n_positive + excluded.n_positive,
+                n_negative = graph_stats.n_negative + excluded.n_negative;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION count_edge_stats() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO graph_stats (exp_id, graph_id, n_edges)
+            SELECT exp_id, graph_id, count(*) FROM new_rows GROUP BY exp_id, graph_id
+            ON CONFLICT (exp_id, graph_id) DO UPDATE SET n_edges = graph_stats.n_edges + excluded.n_edges;
+    END IF;
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        INSERT INTO graph_stats (exp_id, graph_id, n_edges)
+            SELECT exp_id, graph_id, -count(*) FROM old_rows GROUP BY exp_id, graph_id
+            ON CONFLICT (exp_id, graph_id) DO UPDATE SET n_edges = graph_stats.n_edges + excluded.n_edges;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER nodes_inserted_stats AFTER INSERT ON nodes REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE count_node_stats();
+CREATE TRIGGER nodes_updated_stats AFTER UPDATE ON nodes REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE count_node_stats();
+CREATE TRIGGER nodes_deleted_stats AFTER DELETE ON nodes REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE count_node_stats();
+CREATE TRIGGER edges_inserted_stats AFTER INSERT ON edges REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE count_edge_stats();
+CREATE TRIGGER edges_updated_stats AFTER UPDATE ON edges REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE count_edge_stats();
+CREATE TRIGGER edges_deleted_stats AFTER DELETE ON edges REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE count_edge_stats();
+
+CREATE UNIQUE INDEX jobs_ballot ON jobs (exp_id, graph_id, node_id, ballot_id);
+
+-- job dispatch only ever looks at an experiment's unassigned jobs
+CREATE INDEX jobs_unassigned ON jobs (exp_id, graph_id) WHERE status = 'unassigned';
+
+-- checked-out jobs by how long ago, for reinstating expired ones
+CREATE INDEX jobs_waiting ON jobs (exp_id, checked_out_at) WHERE status = 'waiting';
+
+-- a graph's outstanding nodes, which S² must not query again
+CREATE INDEX jobs_outstanding ON jobs (exp_id, graph_id, node_id) WHERE status <> 'completed';
+
+-- loading a graph into the cache
+CREATE INDEX edges_graph ON edges (exp_id, graph_id);
+
+-- random sampling seeks into this from a random key, see S2.get_queries
+CREATE INDEX nodes_unlabeled_sample ON nodes (exp_id, graph_id, sample_key) WHERE label IS NULL;
+
+TRUNCATE graph_stats;
+INSERT INTO nodes (exp_id, graph_id, id, basis_weights, label) SELECT * FROM old_nodes;
+INSERT INTO edges (id, exp_id, graph_id, i, j) SELECT * FROM old_edges;
+INSERT INTO jobs (id, exp_id, graph_id, node_id, ballot_id, vote_label, status, checked_out_at, completing_user)
+    SELECT * FROM old_jobs;
+SELECT setval(pg_get_serial_sequence('edges', 'id'), coalesce(max(id), 0) + 1, false) FROM edges;
+SELECT setval(pg_get_serial_sequence('jobs', 'id'), coalesce(max(id), 0) + 1, false) FROM jobs;
@@ -0,0 +1,11 @@
+-- Per-experiment job leases, renewed by the client and expired by the lease reaper instead of on every checkout.
+
+ALTER TABLE experiments ADD COLUMN lease_seconds int NOT NULL DEFAULT 30;
+
+ALTER TABLE jobs ADD COLUMN lease_expires_at timestamp NULL;
+ALTER TABLE jobs ADD COLUMN leased_to bigint NULL;
+
+UPDATE jobs SET lease_expires_at = checked_out_at + interval '30 seconds' WHERE status = 'waiting';
+
+DROP INDEX jobs_waiting;
+CREATE INDEX jobs_leased ON jobs (lease_expires_at) WHERE status = 'waiting';
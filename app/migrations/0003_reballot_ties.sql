@@ -0,0 +1,12 @@
+-- Nodes whose votes tied were labeled 0, which S² takes for unlabeled and keeps proposing, while their ballots are
+-- all taken; give each another ballot instead, as voting_done now does.
+
+INSERT INTO jobs (exp_id, graph_id, node_id, ballot_id, status)
+    SELECT jobs.exp_id, jobs.graph_id, jobs.node_id, max(jobs.ballot_id) + 1, 'unassigned'
+    FROM nodes
+    JOIN jobs ON jobs.exp_id = nodes.exp_id AND jobs.graph_id = nodes.graph_id AND jobs.node_id = nodes.id
+    WHERE nodes.label = 0
+    GROUP BY jobs.exp_id, jobs.graph_id, jobs.node_id
+    ON CONFLICT (exp_id, graph_id, node_id, ballot_id) DO NOTHING;
+
+UPDATE nodes SET label = NULL WHERE label = 0;
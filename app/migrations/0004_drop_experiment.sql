@@ -0,0 +1,23 @@
+-- Lets launch-experiment clean up after itself when loading a graph fails.
+
+-- delete an experiment and everything in it, e.g. after its launch failed half way; its partitions are detached
+-- first (unless they already were), since the partitioned tables' foreign keys depend on them
+CREATE FUNCTION drop_experiment(experiment bigint) RETURNS void AS $$
+DECLARE
+    parent text;
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass('nodes_exp_' || experiment)) THEN
+        PERFORM detach_experiment(experiment);
+    END IF;
+    FOREACH parent IN ARRAY ARRAY['jobs', 'edges', 'nodes'] LOOP
+        EXECUTE format('DROP TABLE IF EXISTS %I', parent || '_exp_' || experiment);
+    END LOOP;
+    DELETE FROM node_events WHERE exp_id = experiment;
+    DELETE FROM user_graphs WHERE exp_id = experiment;
+    DELETE FROM graph_stats WHERE exp_id = experiment;
+    DELETE FROM graph_versions WHERE exp_id = experiment;
+    DELETE FROM bases WHERE exp_id = experiment;
+    DELETE FROM images WHERE exp_id = experiment;
+    DELETE FROM experiments WHERE id = experiment;
+END;
+$$ LANGUAGE plpgsql;
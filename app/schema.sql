@@ -3,7 +3,9 @@ CREATE EXTENSION pgrouting;
 
 CREATE TABLE experiments (
     id bigserial PRIMARY KEY,
-    required_votes_per_node bigint NOT NULL
+    required_votes_per_node bigint NOT NULL,
+    queries_per_graph bigint NOT NULL DEFAULT 1,
+    lease_seconds int NOT NULL DEFAULT 30
 );
 
 CREATE TABLE images (
@@ -12,6 +14,9 @@ CREATE TABLE images (
     uri VARCHAR NOT NULL
 );
 
+-- nodes, edges and jobs are list-partitioned by experiment: every hot query names its experiment, so it only
+-- touches that experiment's partitions, and a finished experiment can be detached (see detach_experiment) without
+-- rewriting anything. Partitions are created along with their experiment, by create_experiment_partitions.
 CREATE TABLE nodes (
     id integer NOT NULL, -- integer to keep pgrouting happy :)
     exp_id bigint REFERENCES experiments(id) NOT NULL,
@@ -19,12 +24,13 @@ CREATE TABLE nodes (
     
     basis_weights float[] NOT NULL,
     label integer NULL,
+    sample_key float8 NOT NULL DEFAULT random(), -- a random order for sampling unlabeled nodes by index
 
     PRIMARY KEY (exp_id, graph_id, id)
-);
+) PARTITION BY LIST (exp_id);
 
 CREATE TABLE edges (
-    id bigserial PRIMARY KEY,
+    id bigserial NOT NULL,
 
     exp_id bigint NOT NULL,
     graph_id bigint NOT NULL,
@@ -32,9 +38,10 @@ CREATE TABLE edges (
     i integer NOT NULL,
     j integer NOT NULL,
 
+    PRIMARY KEY (exp_id, id),
     FOREIGN KEY (exp_id, graph_id, i) REFERENCES nodes(exp_id, graph_id, id),
     FOREIGN KEY (exp_id, graph_id, j) REFERENCES nodes(exp_id, graph_id, id)
-);
+) PARTITION BY LIST (exp_id);
 
 CREATE TABLE bases (
     id bigserial PRIMARY KEY,
@@ -45,7 +52,7 @@ CREATE TABLE bases (
 
 CREATE TYPE jobstatus AS ENUM ('unassigned', 'waiting', 'completed');
 CREATE TABLE jobs (
-    id bigserial PRIMARY KEY,
+    id bigserial NOT NULL,
 
     exp_id bigint NOT NULL,
     graph_id bigint NOT NULL,
@@ -55,7 +62,218 @@ CREATE TABLE jobs (
     vote_label int NULL,
     status jobstatus NOT NULL,
     checked_out_at timestamp NULL,
+    lease_expires_at timestamp NULL, -- while waiting, when the job goes back up for grabs unless renewed
+    leased_to bigint NULL,
     completing_user bigint NULL,
 
+    PRIMARY KEY (exp_id, id),
     FOREIGN KEY (exp_id, graph_id, node_id) REFERENCES nodes (exp_id, graph_id, id)
-);
\ No newline at end of file
+) PARTITION BY LIST (exp_id);
+
+CREATE FUNCTION create_experiment_partitions(experiment bigint) RETURNS void AS $$
+DECLARE
+    parent text;
+BEGIN
+    FOREACH parent IN ARRAY ARRAY['nodes', 'edges', 'jobs'] LOOP
+        EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES IN (%s)', parent || '_exp_' || experiment, parent, experiment);
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION experiment_created() RETURNS trigger AS $$
+BEGIN
+    PERFORM create_experiment_partitions(NEW.id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER experiments_inserted AFTER INSERT ON experiments
+    FOR EACH ROW EXECUTE PROCEDURE experiment_created();
+
+-- detach a finished experiment's partitions into standalone tables (nodes_exp_<id> and so on), which can then be
+-- archived or dropped; jobs and edges go first, and drop their foreign keys, since they reference nodes
+CREATE FUNCTION detach_experiment(experiment bigint) RETURNS void AS $$
+DECLARE
+    parent text;
+    fk record;
+BEGIN
+    FOREACH parent IN ARRAY ARRAY['jobs', 'edges', 'nodes'] LOOP
+        EXECUTE format('ALTER TABLE %I DETACH PARTITION %I', parent, parent || '_exp_' || experiment);
+        FOR fk IN
+            SELECT conname FROM pg_constraint
+            WHERE conrelid = (parent || '_exp_' || experiment)::regclass AND confrelid = 'nodes'::regclass
+        LOOP
+            EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I', parent || '_exp_' || experiment, fk.conname);
+        END LOOP;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- delete an experiment and everything in it, e.g. after its launch failed half way; its partitions are detached
+-- first (unless they already were), since the partitioned tables' foreign keys depend on them
+CREATE FUNCTION drop_experiment(experiment bigint) RETURNS void AS $$
+DECLARE
+    parent text;
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass('nodes_exp_' || experiment)) THEN
+        PERFORM detach_experiment(experiment);
+    END IF;
+    FOREACH parent IN ARRAY ARRAY['jobs', 'edges', 'nodes'] LOOP
+        EXECUTE format('DROP TABLE IF EXISTS %I', parent || '_exp_' || experiment);
+    END LOOP;
+    DELETE FROM node_events WHERE exp_id = experiment;
+    DELETE FROM user_graphs WHERE exp_id = experiment;
+    DELETE FROM graph_stats WHERE exp_id = experiment;
+    DELETE FROM graph_versions WHERE exp_id = experiment;
+    DELETE FROM bases WHERE exp_id = experiment;
+    DELETE FROM images WHERE exp_id = experiment;
+    DELETE FROM experiments WHERE id = experiment;
+END;
+$$ LANGUAGE plpgsql;
+
+-- bumped by every statement that changes a graph's nodes or edges, so in-process graph caches know when to reload
+CREATE TABLE graph_versions (
+    exp_id bigint NOT NULL,
+    graph_id bigint NOT NULL,
+    version bigint NOT NULL DEFAULT 0,
+
+    PRIMARY KEY (exp_id, graph_id)
+);
+
+CREATE FUNCTION bump_graph_versions() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO graph_versions (exp_id, graph_id, version)
+        SELECT DISTINCT exp_id, graph_id, 1 FROM changed_rows
+        ON CONFLICT (exp_id, graph_id) DO UPDATE SET version = graph_versions.version + 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- transition tables need one trigger per event
+CREATE TRIGGER nodes_inserted AFTER INSERT ON nodes REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE bump_graph_versions();
+CREATE TRIGGER nodes_updated AFTER UPDATE ON nodes REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE bump_graph_versions();
+CREATE TRIGGER nodes_deleted AFTER DELETE ON nodes REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE bump_graph_versions();
+CREATE TRIGGER edges_inserted AFTER INSERT ON edges REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE bump_graph_versions();
+CREATE TRIGGER edges_updated AFTER UPDATE ON edges REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE bump_graph_versions();
+CREATE TRIGGER edges_deleted AFTER DELETE ON edges REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE bump_graph_versions();
+
+-- nodes whose votes are all in, waiting for an S² worker to label them and queue the graph's next jobs
+CREATE TABLE node_events (
+    id bigserial PRIMARY KEY,
+
+    exp_id bigint NOT NULL,
+    graph_id bigint NOT NULL,
+    node_id bigint NOT NULL,
+    created_at timestamp NOT NULL DEFAULT now()
+);
+
+-- a node gets each ballot at most once, however many workers race to queue it; also finds a node's votes
+CREATE UNIQUE INDEX jobs_ballot ON jobs (exp_id, graph_id, node_id, ballot_id);
+
+-- job dispatch only ever looks at an experiment's unassigned jobs
+CREATE INDEX jobs_unassigned ON jobs (exp_id, graph_id) WHERE status = 'unassigned';
+
+-- checked-out jobs by when their lease runs out, for the lease reaper
+CREATE INDEX jobs_leased ON jobs (lease_expires_at) WHERE status = 'waiting';
+
+-- a graph's outstanding nodes, which S² must not query again
+CREATE INDEX jobs_outstanding ON jobs (exp_id, graph_id, node_id) WHERE status <> 'completed';
+
+-- loading a graph into the cache
+CREATE INDEX edges_graph ON edges (exp_id, graph_id);
+
+-- random sampling seeks into this from a random key, see S2.get_queries
+CREATE INDEX nodes_unlabeled_sample ON nodes (exp_id, graph_id, sample_key) WHERE label IS NULL;
+
+-- per-graph counters, kept up to date by triggers in the same transaction as every write to nodes and edges
+CREATE TABLE graph_stats (
+    exp_id bigint NOT NULL,
+    graph_id bigint NOT NULL,
+
+    n_nodes bigint NOT NULL DEFAULT 0,
+    n_edges bigint NOT NULL DEFAULT 0,
+    n_labeled bigint NOT NULL DEFAULT 0,
+    n_positive bigint NOT NULL DEFAULT 0,
+    n_negative bigint NOT NULL DEFAULT 0,
+
+    PRIMARY KEY (exp_id, graph_id)
+);
+
+CREATE FUNCTION count_node_stats() RETURNS trigger AS $$
+BEGIN
+    -- an UPDATE adds its new rows and takes away its old ones
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO graph_stats (exp_id, graph_id, n_nodes, n_labeled, n_positive, n_negative)
+            SELECT exp_id, graph_id, count(*), count(label),
+                   count(*) FILTER (WHERE label > 0), count(*) FILTER (WHERE label < 0)
+            FROM new_rows GROUP BY exp_id, graph_id
+            ON CONFLICT (exp_id, graph_id) DO UPDATE SET
+                n_nodes = graph_stats.n_nodes + excluded.n_nodes,
+                n_labeled = graph_stats.n_labeled + excluded.n_labeled,
+                n_positive = graph_stats.n_positive + excluded.n_positive,
+                n_negative = graph_stats.n_negative + excluded.n_negative;
+    END IF;
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        INSERT INTO graph_stats (exp_id, graph_id, n_nodes, n_labeled, n_positive, n_negative)
+            SELECT exp_id, graph_id, -count(*), -count(label),
+                   -count(*) FILTER (WHERE label > 0), -count(*) FILTER (WHERE label < 0)
+            FROM old_rows GROUP BY exp_id, graph_id
+            ON CONFLICT (exp_id, graph_id) DO UPDATE SET
+                n_nodes = graph_stats.n_nodes + excluded.n_nodes,
+                n_labeled = graph_stats.n_labeled + excluded.n_labeled,
+                n_positive = graph_stats.n_positive + excluded.n_positive,
+                n_negative = graph_stats.n_negative + excluded.n_negative;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION count_edge_stats() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO graph_stats (exp_id, graph_id, n_edges)
+            SELECT exp_id, graph_id, count(*) FROM new_rows GROUP BY exp_id, graph_id
+            ON CONFLICT (exp_id, graph_id) DO UPDATE SET n_edges = graph_stats.n_edges + excluded.n_edges;
+    END IF;
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        INSERT INTO graph_stats (exp_id, graph_id, n_edges)
+            SELECT exp_id, graph_id, -count(*) FROM old_rows GROUP BY exp_id, graph_id
+            ON CONFLICT (exp_id, graph_id) DO UPDATE SET n_edges = graph_stats.n_edges + excluded.n_edges;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER nodes_inserted_stats AFTER INSERT ON nodes REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE count_node_stats();
+CREATE TRIGGER nodes_updated_stats AFTER UPDATE ON nodes REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE count_node_stats();
+CREATE TRIGGER nodes_deleted_stats AFTER DELETE ON nodes REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE count_node_stats();
+CREATE TRIGGER edges_inserted_stats AFTER INSERT ON edges REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE count_edge_stats();
+CREATE TRIGGER edges_updated_stats AFTER UPDATE ON edges REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE count_edge_stats();
+CREATE TRIGGER edges_deleted_stats AFTER DELETE ON edges REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE count_edge_stats();
+
+-- the graphs each user has voted on
+CREATE TABLE user_graphs (
+    exp_id bigint NOT NULL,
+    user_id bigint NOT NULL,
+    graph_id bigint NOT NULL,
+
+    PRIMARY KEY (exp_id, user_id, graph_id)
+);
+
+-- the migrations in migrations/ already reflected in this database; init-db marks them all applied
+CREATE TABLE schema_migrations (
+    name varchar PRIMARY KEY,
+    applied_at timestamp NOT NULL DEFAULT now()
+);
@@ -0,0 +1,126 @@
+"""
+Check that the hot queries are served by indexes: each is EXPLAINed against schema.sql with sequential scans
+disabled, so a plan that still scans a table sequentially means no index fits it.
+
+Needs an empty scratch UTF-8 database on PostgreSQL 12 or later, with postgis and pgrouting available, at
+`S2_TEST_POSTGRES_URL`; everything happens in one transaction that is rolled back.
+"""
+
+import os
+from pathlib import Path
+import pytest
+
+psycopg2 = pytest.importorskip('psycopg2')
+
+TEST_URL = os.environ.get('S2_TEST_POSTGRES_URL')
+pytestmark = pytest.mark.skipif(TEST_URL is None, reason='S2_TEST_POSTGRES_URL is not set')
+
+PARAMS = {'exp_id': 1, 'graph_id': 1, 'node_id': 7, 'user_id': 1, 'job_id': 5, 'edge_ids': [1, 2, 3],
+          'start': 0.5, 'exclude': [1, 2], 'k': 4,
+          'node_ids': [7, 8, 9], 'job_ids': [5, 6, 7]}
+
+HOT_QUERIES = {
+    'graph cache nodes': 'SELECT id, label FROM nodes WHERE exp_id = %(exp_id)s AND graph_id = %(graph_id)s ORDER BY id',
+    'graph cache edges': 'SELECT id, i, j FROM edges WHERE exp_id = %(exp_id)s AND graph_id = %(graph_id)s',
+    'graph version': 'SELECT version FROM graph_versions WHERE exp_id = %(exp_id)s AND graph_id = %(graph_id)s',
+    'obvious cuts': '''
+        DELETE FROM edges WHERE exp_id = %(exp_id)s AND graph_id = %(graph_id)s AND id = ANY(%(edge_ids)s)
+    ''',
+    'random sampling': '''
+        SELECT id FROM nodes
+        WHERE exp_id = %(exp_id)s AND graph_id = %(graph_id)s AND label IS NULL
+          AND sample_key >= %(start)s AND id <> ALL(%(exclude)s)
+        ORDER BY sample_key
+        LIMIT %(k)s
+    ''',
+    'expired leases': '''
+        SELECT exp_id, id FROM jobs WHERE status = 'waiting' AND lease_expires_at < now() LIMIT 1000
+    ''',
+    'renew lease': '''
+        UPDATE jobs SET lease_expires_at = now() + interval '30 seconds'
+        WHERE exp_id = %(exp_id)s AND id = %(job_id)s AND status = 'waiting' AND leased_to = %(user_id)s
+    ''',
+    'leased job': '''
+        SELECT id FROM jobs
+        WHERE exp_id = %(exp_id)s AND status = 'waiting' AND leased_to = %(user_id)s AND lease_expires_at > now()
+    ''',
+    'candidate graphs': '''
+        SELECT DISTINCT graph_id FROM jobs WHERE exp_id = %(exp_id)s AND status = 'unassigned'
+    ''',
+    'graph progress': 'SELECT n_labeled, n_nodes FROM graph_stats WHERE exp_id = %(exp_id)s AND graph_id = %(graph_id)s',
+    'touched graphs': 'SELECT graph_id FROM user_graphs WHERE exp_id = %(exp_id)s AND user_id = %(user_id)s',
+    'complete job': '''
+        UPDATE jobs SET status = 'completed', vote_label = 1, completing_user = %(user_id)s
+        WHERE exp_id = %(exp_id)s AND id = %(job_id)s
+    ''',
+    'remaining votes': '''
+        SELECT count(*) FROM jobs
+        WHERE exp_id = %(exp_id)s AND graph_id = %(graph_id)s AND node_id = %(node_id)s AND status <> 'completed'
+    ''',
+    'majority vote': '''
+        SELECT node_id, sign(sum(vote_label)) FROM jobs
+        WHERE exp_id = %(exp_id)s AND graph_id = %(graph_id)s AND node_id = ANY(%(node_ids)s)
+        GROUP BY node_id
+    ''',
+    'set labels': '''
+        UPDATE nodes SET label = 1
+        WHERE exp_id = %(exp_id)s AND graph_id = %(graph_id)s AND id = ANY(%(node_ids)s)
+    ''',
+    'bulk votes': '''
+        UPDATE jobs SET status = 'completed', vote_label = 1, completing_user = %(user_id)s
+        WHERE exp_id = %(exp_id)s AND id = ANY(%(job_ids)s) AND status <> 'completed'
+    ''',
+    'outstanding nodes': '''
+        SELECT DISTINCT node_id FROM jobs
+        WHERE exp_id = %(exp_id)s AND graph_id = %(graph_id)s AND status <> 'completed'
+    ''',
+}
+
+
+@pytest.fixture(scope='module')
+def conn():
+    conn = psycopg2.connect(TEST_URL)
+    try:
+        with conn.cursor() as c:
+            c.execute((Path(__file__).parent / 'schema.sql').read_text())
+            c.execute('INSERT INTO experiments (required_votes_per_node) VALUES (3) RETURNING id')
+            exp_id = c.fetchone()[0]
+            c.execute('INSERT INTO images (exp_id, uri) SELECT %s, g::text FROM generate_series(1, 20) g', (exp_id,))
+            c.execute('''
+            INSERT INTO nodes (exp_id, graph_id, id, basis_weights)
+                SELECT %s, images.id, n, ARRAY[0.0] FROM images, generate_series(0, 999) n
+            ''', (exp_id,))
+            c.execute('''
+            INSERT INTO edges (exp_id, graph_id, i, j)
+                SELECT exp_id, graph_id, id, id + 1 FROM nodes WHERE id < 999
+            ''')
+            c.execute('''
+            INSERT INTO jobs (exp_id, graph_id, node_id, ballot_id, status, checked_out_at, lease_expires_at)
+                SELECT exp_id, graph_id, id, ballot,
+                       (ARRAY['unassigned', 'waiting', 'completed']::jobstatus[])[1 + id % 3], now(), now()
+                FROM nodes, generate_series(0, 2) ballot
+            ''')
+            c.execute('ANALYZE')
+            c.execute('SET LOCAL enable_seqscan = off')
+            c.execute('SELECT min(id) FROM images')
+            PARAMS.update(exp_id=exp_id, graph_id=c.fetchone()[0])
+        yield conn
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+@pytest.mark.parametrize('name', sorted(HOT_QUERIES))
+def test_hot_query_uses_index(conn, name):
+    with conn.cursor() as c:
+        c.execute('EXPLAIN (FORMAT JSON) ' + HOT_QUERIES[name], PARAMS)
+        plan = c.fetchone()[0][0]['Plan']
+
+    seq_scans = [node['Relation Name'] for node in plan_nodes(plan) if node['Node Type'] == 'Seq Scan']
+    assert not seq_scans, f'{name} scans {seq_scans} sequentially'
@@ -1,16 +1,21 @@
-from flask import Blueprint, render_template, escape, request, abort, redirect, url_for, session
+from flask import Blueprint, render_template, escape, request, abort, redirect, url_for, session, make_response, \
+    current_app, jsonify
 import logging
 import numpy as np
+from .dispatch import job_notifier
 from .master import S2, Master
-from .db import db, uri_for_image, get_basis_uris, basis_weights_for_node, graphs_percent_done, \
-    graphs_touched_by
-from PIL import Image
-from .imgen import as_base64_png, load_image, perturb_image
+from .db import db
+from .graphcache import graph_cache
+from .imgen import renderer, FORMATS
+from .metrics import metrics
 
 logger = logging.getLogger(__name__)
 
 views = Blueprint('views', __name__)
 
+# how many of the next jobs' images to render ahead of time on each query
+PRERENDER_JOBS = 4
+
 @views.route('/exp/<int:exp_id>/query')
 def get_query(exp_id):
     user_id = session['user_id']
@@ -18,36 +23,81 @@ def get_query(exp_id):
     with db.connection as conn:
         master = Master(conn, exp_id)
 
-        proportion_labeled = graphs_percent_done(conn, exp_id)
-
-        graphs_touched = graphs_touched_by(conn, exp_id, user_id)
-        logger.debug(f'this user has previously touched graphs {graphs_touched}')
-
-        def priority(job, user_id, state):
-            COMPLETION_WEIGHT = 100
-            RECENCY_WEIGHT = -10000
-
-            return proportion_labeled[job['graph_id']] * COMPLETION_WEIGHT \
-                + (job['graph_id'] in graphs_touched) * RECENCY_WEIGHT
-
-        job = master.get_job_for(conn, user_id, priority)
+        # a job checked out by `next_job` for this page, or before a reload, is still theirs
+        job = master.leased_job_of(conn, user_id) or master.get_job_for(conn, user_id)
 
+        # start rendering this job's image while the page loads, and warm the cache for whoever asks next
+        nodes = master.upcoming_nodes(conn, PRERENDER_JOBS)
         if job is not None:
-            x = load_image(uri_for_image(conn, exp_id, job['graph_id']))
-            bases = [np.load(uri)
-                for uri in get_basis_uris(conn, exp_id, job['graph_id'])]
-            w = basis_weights_for_node(conn, exp_id, job['node_id'])
-            
-            logger.debug(f'basis weights are {w}')
-            x_perturbed = perturb_image(x, w, bases)
-            img = Image.fromarray((x_perturbed * 255).astype(np.uint8))
-        else:
-            img = None
+            nodes.insert(0, (job['graph_id'], job['node_id']))
+        renderer.prerender(current_app._get_current_object(), exp_id, nodes, preferred_image_format())
 
     return render_template('query.html',
         exp_id=exp_id,
         job=job,
-        image=img and as_base64_png(img))
+        image_format=preferred_image_format())
+
+@views.route('/exp/<int:exp_id>/job.json')
+def next_job(exp_id):
+    """
+    Check out a job as JSON, with the URLs to show, vote on and renew it. With `?wait=<seconds>`, the request is
+    held open until a job becomes available (for at most `JOB_WAIT_SECONDS`) instead of answering 204 right away.
+    """
+    user_id = session['user_id']
+
+    def attempt():
+        with db.connection as conn:
+            job = Master(conn, exp_id).get_job_for(conn, user_id)
+        # don't hold on to a pooled connection while waiting
+        db.release()
+        return job
+
+    job = job_notifier.wait_for(exp_id, attempt, request.args.get('wait', 0.0, type=float))
+    if job is None:
+        return '', 204
+
+    format = preferred_image_format()
+    return jsonify(
+        **job,
+        image_url=url_for('.node_image', exp_id=exp_id, graph_id=job['graph_id'], node_id=job['node_id'],
+                          format=format),
+        vote_url=url_for('.complete_job', exp_id=exp_id, job_id=job['job_id']),
+        lease_url=url_for('.renew_lease', exp_id=exp_id, job_id=job['job_id']))
+
+@views.route('/metrics')
+def prometheus_metrics():
+    if not metrics.enabled:
+        abort(404)
+    response = make_response(metrics.render())
+    response.mimetype = 'text/plain; version=0.0.4'
+    return response
+
+@views.route('/exp/<int:exp_id>/graph/<int:graph_id>/node/<int:node_id>.<format>')
+def node_image(exp_id, graph_id, node_id, format):
+    if format not in FORMATS:
+        abort(404)
+
+    # a node's image never changes, so it's named by its key and can be cached forever
+    etag = f'{exp_id}-{graph_id}-{node_id}-{format}'
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        with db.connection as conn:
+            try:
+                data = renderer.render(conn, exp_id, graph_id, node_id, format)
+            except KeyError:
+                abort(404)
+        response = make_response(data)
+        response.mimetype = FORMATS[format][1]
+
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = 365 * 24 * 60 * 60
+    response.cache_control.immutable = True
+    return response
+
+def preferred_image_format() -> str:
+    return 'webp' if request.accept_mimetypes['image/webp'] else current_app.config['IMAGE_FORMAT']
 
 @views.route('/exp/<int:exp_id>/job/<int:job_id>', methods=['POST'])
 def complete_job(exp_id, job_id):
@@ -57,42 +107,90 @@ def complete_job(exp_id, job_id):
     if label not in [-1, 1]:
         abort(422, "label must be ∈ {-1, 1}")
     
-    ## TODO: move to master.py
     with db.connection as conn:
-        with conn.cursor() as c:
-            # update this job to completed status, set the voted label, and who completed it
-            c.execute('''
-            UPDATE jobs
-            SET status = 'completed',
-                vote_label = %s,
-                completing_user = %s
-            WHERE
-                exp_id = %s AND id = %s
-            ''', (label, session['user_id'], exp_id, job_id))
-
-            # find graph_id, node_id, ballot_id of job
-            c.execute("SELECT graph_id, node_id, ballot_id FROM jobs WHERE exp_id = %s AND id = %s", (exp_id, job_id))
-            graph_id, node_id, ballot_id = c.fetchone()
-            logger.debug(f'exp: {exp_id}, job: {job_id}, graph: {graph_id}, node: {node_id}, label: {label}, ballot: {ballot_id}')
-
-            # count uncompleted ballots
-            c.execute("""
-            SELECT count(*)
-            FROM jobs
-            WHERE exp_id = %s AND graph_id = %s AND node_id = %s
-              AND status <> 'completed'
-            """, (exp_id, graph_id, node_id))
-
-            n_votes_remaining = c.fetchone()[0]
-            logger.debug(f'there are {n_votes_remaining} votes for {graph_id}:{node_id} remaining')
-            if n_votes_remaining == 0: # we're done with this node
-                # tell the master
-                master = Master(conn, exp_id)
-                master.voting_done(conn, graph_id, node_id)
+        master = Master(conn, exp_id)
+        job = master.complete_job(conn, job_id, session['user_id'], label)
+        if job is None:
+            abort(404)
+        graph_id, node_id, n_votes_remaining = job
+        logger.debug(f'there are {n_votes_remaining} votes for {graph_id}:{node_id} remaining')
+        if n_votes_remaining == 0: # we're done with this node
+            # tell the master; an S² worker picks it up from there
+            master.node_finished(conn, graph_id, node_id)
 
     return redirect(url_for(".get_query", exp_id=exp_id))
 
 
+@views.route('/exp/<int:exp_id>/votes', methods=['POST'])
+def submit_votes(exp_id):
+    """
+    Record many labels in one request, from a JSON array. Each element is either a vote on a job,
+    `{"job_id": ..., "label": ...}`, or a label collected offline for a node, `{"graph_id": ..., "node_id": ...,
+    "label": ...}`, which is set as is. Nodes that end up finished are queued for an S² worker together.
+    """
+    items = request.get_json(silent=True)
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        abort(400, "body must be a JSON array of objects")
+
+    votes, labels = [], []
+    try:
+        for item in items:
+            label = int(item['label'])
+            if label not in [-1, 1]:
+                abort(422, "label must be ∈ {-1, 1}")
+            if 'job_id' in item:
+                votes.append((int(item['job_id']), label))
+            else:
+                labels.append((int(item['graph_id']), int(item['node_id']), label))
+    except (KeyError, TypeError, ValueError):
+        abort(400, "each vote needs a label, and a job_id or a graph_id and node_id")
+
+    with db.connection as conn:
+        master = Master(conn, exp_id)
+        n_votes, finished = master.submit_votes(conn, session['user_id'], votes) if votes else (0, [])
+        imported = master.import_labels(conn, labels) if labels else []
+        nodes = sorted(set(finished) | set(imported))
+        master.nodes_finished(conn, nodes)
+
+    return jsonify(votes=n_votes, labels=len(imported), finished=len(nodes))
+
+
+@views.route('/exp/<int:exp_id>/job/<int:job_id>/lease', methods=['POST'])
+def renew_lease(exp_id, job_id):
+    """
+    Keep a job checked out while its image is still being looked at; the query page calls this periodically.
+    """
+    with db.connection as conn:
+        renewed = Master(conn, exp_id).renew_lease(conn, job_id, session['user_id'])
+    if not renewed:
+        abort(409, "job is no longer leased to you")
+    return '', 204
+
+
+@views.route('/exp/<int:exp_id>/graph/<int:graph_id>/predictions')
+def graph_predictions(exp_id, graph_id):
+    """
+    Predicted labels for every node of a graph, from label propagation over what S² has cut so far: `scores` in
+    [-1, 1] and their signs as `labels` (0 where nothing is known), indexed like `node_ids`.
+    """
+    with db.connection as conn:
+        graph = graph_cache.get(conn, exp_id, graph_id)
+
+    # predictions only change with the graph's version
+    etag = f'{exp_id}-{graph_id}-v{graph.version}'
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        scores = graph.predictions()
+        response = jsonify(
+            graph_id=graph_id,
+            version=graph.version,
+            node_ids=graph.node_ids.tolist(),
+            scores=scores.tolist(),
+            labels=np.sign(scores).astype(int).tolist())
+    response.set_etag(etag)
+    return response
+
 @views.route('/exp/<int:exp_id>/graph/<int:graph_id>')
 def graph_info(exp_id, graph_id):
     with db.connection as conn:
@@ -0,0 +1,85 @@
+import select
+from collections import defaultdict
+import logging
+import multiprocessing
+from .db import db
+from .master import Master, EVENTS_CHANNEL
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+def process_events(db, batch_size: int = 100) -> int:
+    """
+    Claim up to `batch_size` queued node events, then label their nodes and queue the next jobs once per graph,
+    all in one transaction. Returns how many events were processed.
+    """
+    with db.cursor() as c:
+        # other workers skip the events we're holding instead of waiting for them
+        c.execute('''
+        DELETE FROM node_events
+            WHERE id IN (SELECT id FROM node_events ORDER BY id FOR UPDATE SKIP LOCKED LIMIT %s)
+            RETURNING exp_id, graph_id, node_id
+        ''', (batch_size,))
+        events = c.fetchall()
+
+    if not events:
+        db.commit()
+        return 0
+
+    graphs = defaultdict(list)
+    for exp_id, graph_id, node_id in events:
+        graphs[exp_id, graph_id].append(node_id)
+
+    try:
+        # lock graphs in a fixed order, so two workers holding overlapping batches can't deadlock
+        for (exp_id, graph_id), node_ids in sorted(graphs.items()):
+            logger.debug(f'[exp:{exp_id}] processing {len(node_ids)} finished nodes of {graph_id}')
+            with db.cursor() as c:
+                # only one worker runs S² on a graph at a time, so two can't top it up past its queries per graph
+                c.execute('SELECT pg_advisory_xact_lock(%s, %s)', (exp_id, graph_id))
+
+            with metrics.timer('s2_phase_seconds', phase='voting_done'):
+                Master(db, exp_id).voting_done(db, graph_id, node_ids)
+    except Exception:
+        # put the events back for another try
+        db.rollback()
+        raise
+
+    db.commit()
+    return len(events)
+
+def run_worker(poll_interval: float = 5.0, batch_size: int = 100):
+    """
+    Process node events until killed, sleeping on `LISTEN` whenever the queue is empty. Events that were queued
+    without a notification we saw are picked up at least every `poll_interval` seconds.
+    """
+    conn = db.connection
+    with conn.cursor() as c:
+        c.execute(f'LISTEN {EVENTS_CHANNEL}')
+    conn.commit()
+    logger.debug(f'worker listening on {EVENTS_CHANNEL}')
+
+    while True:
+        try:
+            while process_events(conn, batch_size):
+                pass
+        except Exception:
+            logger.exception('failed to process node event')
+
+        if select.select([conn], [], [], poll_interval) != ([], [], []):
+            conn.poll()
+            conn.notifies.clear()
+
+def _worker_main(poll_interval: float, batch_size: int):
+    # every process needs its own connection pool and graph cache
+    from . import make_app
+    with make_app().app_context():
+        run_worker(poll_interval, batch_size)
+
+def run_workers(n_processes: int, poll_interval: float = 5.0, batch_size: int = 100):
+    processes = [multiprocessing.Process(target=_worker_main, args=(poll_interval, batch_size), daemon=True)
+                 for _ in range(n_processes)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
@@ -11,25 +11,46 @@ Implements S², an Efficient Graph-Based Active Learning Algorithm.
 """
 
 import networkx as nx
+import numpy as np
 import random
 import itertools
+import asyncio
+from .graph import CSRGraph
+from .bundle import GraphBundle
+from .moss import disjoint_midpoints
+from .components import ComponentIndex, StoppingRule, _VertexPool
 
 
-def s2(G, oracle, find_moss):
+def s2(G, oracle, find_moss, incremental_cuts=True, rng=None, stop=None):
     """
     Runs the S² algorithm on a graph, returning the unzipped graph.
 
     Parameters
     ----------
-    G : nx.Graph
-        The input graph to the algorithm.
-    oracle : fn(vertex) -> bool
+    G : nx.Graph, CSRGraph or GraphBundle
+        The input graph to the algorithm. A `CSRGraph` is labeled in its int8 `labels` array (`±1`) rather than
+        with node attributes, and its vertices are the integers `0..n-1`. A `GraphBundle` runs on its `CSRGraph`.
+    oracle : fn(vertex) -> bool, or BatchOracle
         An oracle function, taking a vertex and returning the label as a `bool`.
     find_moss : fn(G : nx.Graph, U : [vertex], V : [vertex]) -> list of vertices or `None`
         A function which, given a graph and two sets of vertices, returns the Midpoint Of the Shortest Shortest path
         between any pair of vertices across these two sets.
+    incremental_cuts : bool
+        If true (the default), only the edges incident to a newly-labeled vertex are checked for obvious cuts,
+        making each query O(degree) rather than O(labeled edges). The resulting cuts are identical to rescanning
+        every labeled vertex with `find_obvious_cuts`, which is done when this is false.
+    rng : random.Random, optional
+        The source of random vertices. Defaults to the global `random` module; pass a seeded instance for
+        reproducible runs, or to run several at once.
+    stop : StoppingRule, optional
+        If given, random vertices are only drawn from the components of the cut graph that `stop` keeps open, and
+        S² stops once none are left or its budget is spent, instead of labeling every vertex.
     """
+    if isinstance(G, GraphBundle):
+        G = G.graph
     G = G.copy()
+    rng = random if rng is None else rng
+    oracle = _one_at_a_time(oracle)
 
     # number of vertices
     n = G.order()
@@ -37,29 +58,29 @@ def s2(G, oracle, find_moss):
     # labeled sets. U is positively labeled vertices, V is negatively labeled.
     U = set()
     V = set()
+    unlabeled = _VertexPool(G.nodes())
+    components = None if stop is None else ComponentIndex(G, stop, lambda v: v not in unlabeled)
 
     while True:
         if len(U) + len(V) == n:
             break
 
         # pick a random vertex that we haven't seen before
-        vert = random.choice(list(G.nodes()))
-        if vert in U or vert in V:
-            continue
+        if components is None:
+            vert = unlabeled.choice(rng)
+        else:
+            vert = components.choice(rng)
+            if vert is None or stop.exhausted(len(U) + len(V)):
+                break
 
         while True:
             # query the current vertex
             y = oracle(vert)
-            # add the current vertex to one of the labeled sets
-            {True: U, False: V}[y].add(vert)
-            # mark it as labeled
-            G.node[vert]['label'] = y
+            # label it and unzip
+            _add_label(G, U, V, unlabeled, vert, y, incremental_cuts, components)
 
-
-            # find obvious cuts
-            cuts = find_obvious_cuts(G, [(i, True) for i in U] + [(i, False) for i in V])
-            # unzip
-            G.remove_edges_from(cuts)
+            if stop is not None and stop.exhausted(len(U) + len(V)):
+                return G
 
             # try to pick a new vertex via midpoint of shortest shortest path
             vert = find_moss(G, U, V)
@@ -70,21 +91,208 @@ def s2(G, oracle, find_moss):
 
     return G
 
+def s2_batch(G, oracle, k, find_midpoints=disjoint_midpoints, incremental_cuts=True, rng=None, stop=None):
+    """
+    Runs S² proposing up to `k` query vertices per round, returning the unzipped graph.
+
+    Each round labels its whole batch before looking for the next one: `k` distinct unlabeled vertices at random
+    while no U–V path is left, and otherwise whatever `find_midpoints` proposes (by default, the midpoints of up to
+    `k` vertex-disjoint shortest U–V paths).
+
+    Parameters
+    ----------
+    G : nx.Graph, CSRGraph or GraphBundle
+        The input graph to the algorithm, as for `s2()`.
+    oracle : fn(vertex) -> bool, or BatchOracle
+        An oracle function, taking a vertex and returning the label as a `bool`. A `BatchOracle` is called once per
+        round, with the whole batch.
+    k : int
+        The maximum number of vertices to query per round.
+    find_midpoints : fn(G, U : [vertex], V : [vertex], k : int) -> list of vertices
+        A function returning up to `k` distinct unlabeled vertices to query next, or an empty list if there is no
+        U–V path left.
+    incremental_cuts : bool
+        As for `s2()`.
+    rng : random.Random, optional
+        As for `s2()`.
+    stop : StoppingRule, optional
+        As for `s2()`. A round may overshoot the budget by up to `k - 1` queries.
+    """
+    if isinstance(G, GraphBundle):
+        G = G.graph
+    G = G.copy()
+    rng = random if rng is None else rng
+    oracle = _all_at_once(oracle)
+    n = G.order()
+    U = set()
+    V = set()
+    unlabeled = _VertexPool(G.nodes())
+    components = None if stop is None else ComponentIndex(G, stop, lambda v: v not in unlabeled)
+
+    batch = []
+    while len(U) + len(V) < n:
+        if stop is not None and stop.exhausted(len(U) + len(V)):
+            break
+        if not batch:
+            if components is None:
+                batch = unlabeled.sample(rng, min(k, len(unlabeled)))
+            else:
+                batch = components.sample(rng, k)
+                if not batch:
+                    break
+
+        for vert, y in zip(batch, oracle(batch)):
+            _add_label(G, U, V, unlabeled, vert, y, incremental_cuts, components)
+
+        batch = find_midpoints(G, U, V, k)
+
+    return G
+
+async def s2_async(G, oracle, find_moss, max_in_flight=2, incremental_cuts=True, rng=None):
+    """
+    Runs S² with an `async` oracle, keeping up to `max_in_flight` queries outstanding at once, and returns the
+    unzipped graph.
+
+    Whenever there is room, the vertex S² would query next (the midpoint from `find_moss`, if there is one) is sent
+    first, and the rest of the room goes to random unlabeled vertices. S² labels every vertex in the end, so no
+    query is wasted, and since cuts only depend on labels the result is the same as `s2()`'s; only the order of
+    queries changes. Labels are applied as their answers arrive, and the midpoint is recomputed after each.
+
+    Parameters
+    ----------
+    G : nx.Graph, CSRGraph or GraphBundle
+        The input graph to the algorithm, as for `s2()`.
+    oracle : async fn(vertex) -> bool, or BatchOracle
+        A coroutine function, taking a vertex and returning the label as a `bool`. A `BatchOracle` of a coroutine
+        function gets every vertex sent at the same time in one call.
+    find_moss : fn(G, U : [vertex], V : [vertex]) -> vertex or `None`
+        As for `s2()`.
+    max_in_flight : int
+        The most queries to have outstanding at once.
+    incremental_cuts : bool
+        As for `s2()`.
+    rng : random.Random, optional
+        As for `s2()`.
+    """
+    if isinstance(G, GraphBundle):
+        G = G.graph
+    G = G.copy()
+    rng = random if rng is None else rng
+    batched = isinstance(oracle, BatchOracle)
+
+    n = G.order()
+    U = set()
+    V = set()
+    unlabeled = _VertexPool(G.nodes())
+
+    # outstanding oracle calls, and the vertices each one is labeling
+    in_flight = {}
+    pending = set()
+
+    def unknown(vert):
+        return vert not in U and vert not in V and vert not in pending
+
+    midpoint = None
+    while len(U) + len(V) < n:
+        send = []
+        if midpoint is not None and unknown(midpoint) and len(pending) < max_in_flight:
+            send.append(midpoint)
+            pending.add(midpoint)
+        while len(pending) < max_in_flight and len(U) + len(V) + len(pending) < n:
+            # few vertices are pending, so this rarely draws more than once
+            vert = unlabeled.choice(rng)
+            if unknown(vert):
+                send.append(vert)
+                pending.add(vert)
+
+        if batched and send:
+            in_flight[asyncio.ensure_future(oracle(send))] = send
+        else:
+            for vert in send:
+                in_flight[asyncio.ensure_future(oracle(vert))] = [vert]
+
+        done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+        for call in done:
+            verts = in_flight.pop(call)
+            labels = call.result() if batched else [call.result()]
+            for vert, y in zip(verts, labels):
+                pending.discard(vert)
+                _add_label(G, U, V, unlabeled, vert, y, incremental_cuts)
+
+        midpoint = find_moss(G, U, V)
+
+    return G
+
+class BatchOracle:
+    """
+    Marks an oracle that labels many vertices per call: `fn(list of vertices) -> list of bool`, or a coroutine
+    function returning one for `s2_async`. `s2_batch` calls it once per round; `s2` calls it with one vertex at a
+    time.
+    """
+
+    def __init__(self, fn):
+        self.fn = fn
+
+    def __call__(self, verts):
+        return self.fn(verts)
+
+def _one_at_a_time(oracle):
+    if isinstance(oracle, BatchOracle):
+        return lambda vert: oracle([vert])[0]
+    return oracle
+
+def _all_at_once(oracle):
+    if isinstance(oracle, BatchOracle):
+        return lambda verts: list(oracle(list(verts)))
+    return lambda verts: [oracle(vert) for vert in verts]
+
+def _add_label(G, U, V, unlabeled, vert, y, incremental_cuts, components=None):
+    """
+    Record the label `y` of `vert` and cut the edges it makes obvious, keeping `components` (if any) up to date.
+    """
+    # add the current vertex to one of the labeled sets, and take it out of the unlabeled pool
+    {True: U, False: V}[y].add(vert)
+    unlabeled.remove(vert)
+    # mark it as labeled
+    if isinstance(G, CSRGraph):
+        G.set_label(vert, 1 if y else -1)
+    else:
+        G.nodes[vert]['label'] = y
+
+    # find obvious cuts
+    if incremental_cuts:
+        # every other labeled pair was already checked when its second vertex got labeled
+        cuts = find_incident_cuts(G, vert)
+    else:
+        cuts = find_obvious_cuts(G, [(i, True) for i in U] + [(i, False) for i in V])
+    # unzip
+    G.remove_edges_from(cuts)
+
+    if components is not None:
+        components.label(vert)
+        components.cut(cuts)
+
 def find_obvious_cuts(G, L=None):
     """
     Find obvious cuts between adjacent verts of different labels.
 
     Parameters
     ----------
-    G : nx.Graph
+    G : nx.Graph or CSRGraph
         The input graph, with nodes with known label marked with the data attribute `label`.
     L : optional list of (vert, label)
         A list of tuples of vertices with known labels, and their corresponding label.
 
         Is only used to accelerate slightly so we don't have to re-search the graph; if None,
-        we do our own search for `label`s.
+        we do our own search for `label`s. Ignored for a `CSRGraph`, whose label array is scanned directly.
     """
-    
+
+    if isinstance(G, CSRGraph):
+        alive = np.flatnonzero(G.alive)
+        i, j = G.edges[alive, 0], G.edges[alive, 1]
+        cut = G.labels[i] * G.labels[j] < 0
+        return [tuple(edge) for edge in G.edges[alive[cut]].tolist()]
+
     if L is None:
         labeled_nodes = [v[0] for v in G.nodes(data=True) if v[1].get('label') is not None]
     else:
@@ -96,11 +304,40 @@ def find_obvious_cuts(G, L=None):
     # for every pair of labeled vertices
     for edge in labeled_subgraph.edges():
         # for every cut pair of labels
-        if G.node[edge[0]]['label'] != G.node[edge[1]]['label']:
+        if G.nodes[edge[0]]['label'] != G.nodes[edge[1]]['label']:
             cuts.append(edge)
 
     return cuts
 
+def find_incident_cuts(G, vert):
+    """
+    Find obvious cuts between a single labeled vertex and its labeled neighbors.
+
+    If this is called every time a vertex gets labeled, the union of the returned cuts is exactly what
+    `find_obvious_cuts` would find, while only looking at `vert`'s neighborhood.
+
+    Parameters
+    ----------
+    G : nx.Graph or CSRGraph
+        The input graph, with nodes with known label marked with the data attribute `label`.
+    vert : vertex
+        The newly-labeled vertex.
+    """
+
+    if isinstance(G, CSRGraph):
+        neighbors = G.neighbors(vert)
+        return [(vert, int(u)) for u in neighbors[G.labels[neighbors] == -G.labels[vert]]]
+
+    label = G.nodes[vert]['label']
+
+    cuts = []
+    for neighbor in G.neighbors(vert):
+        neighbor_label = G.nodes[neighbor].get('label')
+        if neighbor_label is not None and neighbor_label != label:
+            cuts.append((vert, neighbor))
+
+    return cuts
+
 def path_midpoint(path):
     if path is None:
         return None
@@ -0,0 +1,436 @@
+"""
+Benchmarks for the hot paths of S².
+
+Run with `python -m s2.bench [cuts|moss|mssp|batch] [--max-nodes N]` for rough comparisons between
+implementations, or `python -m s2.bench suite [--save FILE | --compare FILE]` for the regression suite: obvious cuts,
+the MSSP finders and full `s2()` runs on lattices, random geometric graphs and kNN graphs of 10² nodes and up, with
+fixed seeds, recording time, peak memory and query counts against a stored baseline (`bench_baseline.json`).
+"""
+
+import argparse
+import json
+import math
+import platform
+import random
+import sys
+import timeit
+import tracemalloc
+from pathlib import Path
+import numpy as np
+import networkx as nx
+from s2 import s2, s2_batch, find_obvious_cuts, find_incident_cuts, enumerate_find_ssp, StoppingRule
+from s2.graph import CSRGraph
+from s2.moss import moss, frontier_moss, IncrementalMoss, disjoint_midpoints
+
+BASELINE = Path(__file__).with_name('bench_baseline.json')
+
+
+def lattice_oracle(side):
+    """
+    Ground truth for a `side` x `side` lattice: two opposite corner blocks are positive.
+    """
+    lo, hi = side * 3 // 10, side * 7 // 10
+
+    def oracle(vert):
+        return ((vert[0] < lo) and (vert[1] < lo)) or ((vert[0] >= hi) and (vert[1] >= hi))
+
+    return oracle
+
+
+def lattice_edges(side):
+    """
+    Edge arrays of a `side` x `side` lattice, with vertex `x*side + y` at `(x, y)`.
+    """
+    ids = np.arange(side * side).reshape(side, side)
+    i = np.concatenate([ids[:-1, :].ravel(), ids[:, :-1].ravel()])
+    j = np.concatenate([ids[1:, :].ravel(), ids[:, 1:].ravel()])
+    return i, j
+
+
+def random_points(n, seed=0):
+    """
+    The `n` uniform points in the unit square that `random_geometric_edges` and `knn_edges` connect.
+    """
+    return np.random.default_rng(seed).random((n, 2))
+
+
+def random_geometric_edges(n, seed=0, mean_degree=None):
+    """
+    Edge arrays of a random geometric graph on `n` uniform points in the unit square, connecting points closer than
+    a radius chosen for the given mean degree (by default ~1.5 log n, which is connected with high probability).
+
+    Points are bucketed into a grid of radius-sized cells, so only neighboring cells are compared.
+    """
+    if mean_degree is None:
+        mean_degree = 1.5 * math.log(n)
+    radius = math.sqrt(mean_degree / (math.pi * n))
+
+    points = random_points(n, seed)
+    n_cells = max(1, int(1 / radius))
+    cell_xy = np.minimum((points * n_cells).astype(np.int64), n_cells - 1)
+    cell = cell_xy[:, 0] * n_cells + cell_xy[:, 1]
+
+    order = np.argsort(cell, kind='stable')
+    cell_start = np.searchsorted(cell[order], np.arange(n_cells * n_cells + 1))
+
+    i, j = [], []
+    for dx, dy in [(0, 0), (1, -1), (1, 0), (1, 1), (0, 1)]:
+        nx_, ny_ = cell_xy[:, 0] + dx, cell_xy[:, 1] + dy
+        ok = (nx_ < n_cells) & (ny_ >= 0) & (ny_ < n_cells)
+        p = np.flatnonzero(ok)
+        other = nx_[p] * n_cells + ny_[p]
+        starts, lengths = cell_start[other], cell_start[other + 1] - cell_start[other]
+        q = order[np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())]
+        p = np.repeat(p, lengths)
+
+        keep = ((points[p] - points[q]) ** 2).sum(axis=1) < radius ** 2
+        if (dx, dy) == (0, 0):
+            keep &= p < q
+        i.append(p[keep])
+        j.append(q[keep])
+
+    return np.concatenate(i), np.concatenate(j)
+
+
+def knn_edges(n, k=6, seed=0):
+    """
+    Edge arrays of a (symmetrized) k-nearest-neighbor graph on `random_points(n, seed)`.
+
+    Neighbors are only looked for within a random geometric graph of mean degree `2.5 k`, so the few points with
+    fewer than `k` points that close get fewer neighbors.
+    """
+    points = random_points(n, seed)
+    i, j = random_geometric_edges(n, seed, mean_degree=2.5 * k)
+    src, dst = np.concatenate([i, j]), np.concatenate([j, i])
+
+    # rank every point's candidates by distance, and keep the closest k
+    dist = ((points[src] - points[dst]) ** 2).sum(axis=1)
+    order = np.lexsort((dist, src))
+    src, dst = src[order], dst[order]
+    rank = np.arange(len(src)) - np.searchsorted(src, src)
+    return src[rank < k], dst[rank < k]
+
+
+def corner_truth(xy):
+    """
+    Ground truth on points of the unit square, like `lattice_oracle`: two opposite corner blocks are positive.
+    """
+    x, y = xy[:, 0], xy[:, 1]
+    return np.where(((x < 0.3) & (y < 0.3)) | ((x >= 0.7) & (y >= 0.7)), 1, -1).astype(np.int8)
+
+
+def graph_family(family, n, seed=0):
+    """
+    A benchmark graph of about `n` vertices and its ground truth, as a `CSRGraph` and an array of `±1`.
+    """
+    if family == 'lattice':
+        side = int(round(math.sqrt(n)))
+        xy = np.stack(np.divmod(np.arange(side * side), side), axis=1) / side
+        return CSRGraph.from_edges(side * side, *lattice_edges(side)), corner_truth(xy)
+    if family == 'geometric':
+        return CSRGraph.from_edges(n, *random_geometric_edges(n, seed)), corner_truth(random_points(n, seed))
+    if family == 'knn':
+        return CSRGraph.from_edges(n, *knn_edges(n, seed=seed)), corner_truth(random_points(n, seed))
+    raise ValueError(f'unknown graph family {family!r}')
+
+
+def bench_cuts(side, n_labels, incremental, seed=0):
+    """
+    Label `n_labels` random vertices of a `side` x `side` lattice one at a time, performing obvious cuts after
+    every label like `s2()` does, and return the total time spent finding and removing cuts.
+    """
+    G = nx.grid_2d_graph(side, side)
+    oracle = lattice_oracle(side)
+    order = random.Random(seed).sample(list(G.nodes()), n_labels)
+
+    elapsed = 0.0
+    labeled = []
+    for vert in order:
+        G.nodes[vert]['label'] = oracle(vert)
+        labeled.append((vert, G.nodes[vert]['label']))
+
+        start = timeit.default_timer()
+        if incremental:
+            cuts = find_incident_cuts(G, vert)
+        else:
+            cuts = find_obvious_cuts(G, labeled)
+        G.remove_edges_from(cuts)
+        elapsed += timeit.default_timer() - start
+
+    return elapsed
+
+
+def bench_moss(n, i, j, n_sources=5, repeat=3, seed=0):
+    """
+    Time `moss` on an `nx.Graph` against `frontier_moss` on a `CSRGraph`, from `n_sources` random vertices on each
+    side. Returns the best time of each.
+    """
+    C = CSRGraph.from_edges(n, i, j)
+    G = nx.Graph()
+    G.add_nodes_from(range(n))
+    G.add_edges_from(C.edges.tolist())
+
+    sources = random.Random(seed).sample(range(n), 2 * n_sources)
+    U, V = set(sources[:n_sources]), set(sources[n_sources:])
+
+    t_python = min(timeit.repeat(lambda: moss(G, U, V), number=1, repeat=repeat))
+    t_frontier = min(timeit.repeat(lambda: frontier_moss(C, U, V), number=1, repeat=repeat))
+    return t_python, t_frontier
+
+
+def bench_mssp(side, n_labels, seed=0):
+    """
+    Run the first `n_labels` queries of S² on a `side` x `side` lattice, following the MSSP midpoints that
+    `IncrementalMoss` picks, and return the total time spent finding them with `frontier_moss` and with
+    `IncrementalMoss`.
+    """
+    C = CSRGraph.from_edges(side * side, *lattice_edges(side))
+    oracle = lattice_oracle(side)
+    rng = random.Random(seed)
+
+    find_moss = IncrementalMoss()
+    t_frontier = t_incremental = 0.0
+    U, V = set(), set()
+    vert = None
+    for _ in range(n_labels):
+        while vert is None or vert in U or vert in V:
+            vert = rng.randrange(side * side)
+
+        y = oracle(divmod(vert, side))
+        {True: U, False: V}[y].add(vert)
+        C.set_label(vert, 1 if y else -1)
+        C.remove_edges_from(find_incident_cuts(C, vert))
+
+        start = timeit.default_timer()
+        frontier_moss(C, U, V)
+        t_frontier += timeit.default_timer() - start
+
+        start = timeit.default_timer()
+        vert = find_moss(C, U, V)
+        t_incremental += timeit.default_timer() - start
+
+    return t_frontier, t_incremental
+
+
+def bench_batch(side, k, seed=0):
+    """
+    Run S² on a `side` x `side` lattice, sequentially with `IncrementalMoss` if `k` is `None` and otherwise with
+    `s2_batch` proposing `k` vertices per round. Returns how many queries and rounds it took until every cut edge
+    of the ground truth was found.
+    """
+    C = CSRGraph.from_edges(side * side, *lattice_edges(side))
+    truth = lattice_oracle(side)
+    boundary = set(v for e in C.edges.tolist() if truth(divmod(e[0], side)) != truth(divmod(e[1], side)) for v in e)
+
+    calls = []
+    def oracle(vert):
+        calls.append(vert)
+        return truth(divmod(vert, side))
+
+    rounds = []
+    def find_midpoints(G, U, V, k):
+        rounds.append(len(calls))
+        return disjoint_midpoints(G, U, V, k)
+
+    random.seed(seed)
+    if k is None:
+        s2(C, oracle, IncrementalMoss())
+    else:
+        s2_batch(C, oracle, k, find_midpoints=find_midpoints)
+
+    # a cut edge is found once both its endpoints are labeled
+    n_queries = 1 + max(i for i, vert in enumerate(calls) if vert in boundary)
+    n_rounds = sum(1 for r in rounds if r < n_queries) + 1 if k is not None else n_queries
+    return n_queries, n_rounds
+
+
+FAMILIES = ('lattice', 'geometric', 'knn')
+
+# the python implementations are only run up to these sizes
+NX_MAX_NODES = 10**5
+ENUMERATE_MAX_NODES = 10**3
+
+
+def measure(fn, repeat=3):
+    """
+    Run `fn` `repeat` times for its best time, then once more under `tracemalloc` for its peak memory (which
+    includes numpy arrays). Returns a dict of `seconds`, `peak_bytes` and anything `fn` returned.
+    """
+    seconds = min(timeit.repeat(fn, number=1, repeat=repeat))
+
+    tracemalloc.start()
+    try:
+        extra = fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    result = {'seconds': seconds, 'peak_bytes': peak}
+    if isinstance(extra, dict):
+        result.update(extra)
+    return result
+
+
+def suite_cases(G, truth, seed=0):
+    """
+    The benchmarks of the regression suite on one graph, as `(name, fn)`; each `fn` runs on a fresh copy.
+    """
+    n = G.order()
+    rng = random.Random(seed)
+    labeled = np.array(rng.sample(range(n), max(2, n // 5)))
+    # sources as S² would have them, from either side of the cut
+    U = rng.sample(np.flatnonzero(truth > 0).tolist(), 5)
+    V = rng.sample(np.flatnonzero(truth < 0).tolist(), 5)
+
+    def cuts():
+        C = G.copy()
+        C.labels[labeled] = truth[labeled]
+        find_obvious_cuts(C)
+
+    def run_s2():
+        queries = []
+        def oracle(vert):
+            queries.append(vert)
+            return bool(truth[vert] > 0)
+        s2(G, oracle, IncrementalMoss(), rng=random.Random(seed), stop=StoppingRule())
+        return {'queries': len(queries)}
+
+    cases = [('find_obvious_cuts', cuts),
+             ('frontier_moss', lambda: frontier_moss(G, set(U), set(V))),
+             ('incremental_moss', lambda: IncrementalMoss()(G, set(U), set(V)))]
+    if n <= NX_MAX_NODES or n <= ENUMERATE_MAX_NODES:
+        N = nx.Graph()
+        N.add_nodes_from(range(n))
+        N.add_edges_from(G.edges.tolist())
+        if n <= NX_MAX_NODES:
+            cases.append(('moss', lambda: moss(N, set(U), set(V))))
+        if n <= ENUMERATE_MAX_NODES:
+            # every pair of sources, so keep them few
+            cases.append(('enumerate_find_ssp', lambda: enumerate_find_ssp(N, set(U[:3]), set(V[:3]))))
+    cases.append(('s2', run_s2))
+    return cases
+
+
+def run_suite(max_nodes=10**5, families=FAMILIES, repeat=3, seed=0, progress=None):
+    """
+    Run the regression suite on every graph family at 10², 10³, ... up to `max_nodes` vertices. Returns a dict of
+    `results`, keyed by `'benchmark/family/n'`, and a description of the machine.
+    """
+    results = {}
+    n = 100
+    while n <= max_nodes:
+        for family in families:
+            G, truth = graph_family(family, n, seed)
+            for name, fn in suite_cases(G, truth, seed):
+                key = f'{name}/{family}/{n}'
+                # a full run is slow enough that one timing will do
+                results[key] = measure(fn, repeat=1 if name == 's2' else repeat)
+                if progress is not None:
+                    progress(key, results[key])
+        n *= 10
+
+    machine = {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+               'processor': platform.processor()}
+    return {'machine': machine, 'results': results}
+
+
+def compare(baseline, current, tolerance=1.5):
+    """
+    Compare suite results to a baseline, returning the regressions as `(key, metric, baseline, current)`: time or
+    peak memory more than `tolerance` times the baseline's, or more queries than before. Times only compare
+    meaningfully on the machine that made the baseline.
+    """
+    regressions = []
+    for key, result in current['results'].items():
+        base = baseline['results'].get(key)
+        if base is None:
+            continue
+        for metric in ('seconds', 'peak_bytes'):
+            if result[metric] > tolerance * base[metric]:
+                regressions.append((key, metric, base[metric], result[metric]))
+        if 'queries' in base and result['queries'] > base['queries']:
+            regressions.append((key, 'queries', base['queries'], result['queries']))
+    return regressions
+
+
+def format_result(key, result):
+    queries = f' {result["queries"]:>8} queries' if 'queries' in result else ''
+    return f'{key:<36} {result["seconds"]*1e3:>12.2f}ms {result["peak_bytes"]/2**20:>10.2f}MiB{queries}'
+
+
+def main():
+    benchmarks = ['cuts', 'moss', 'mssp', 'batch', 'suite']
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark', help=f'any of {", ".join(benchmarks)} (default: all)')
+    parser.add_argument('--max-nodes', type=int, default=10**5)
+    parser.add_argument('--families', nargs='+', choices=FAMILIES, default=list(FAMILIES), help='suite graph families')
+    parser.add_argument('--repeat', type=int, default=3, help='suite timings to take the best of')
+    parser.add_argument('--save', type=Path, nargs='?', const=BASELINE, help='write suite results as the baseline')
+    parser.add_argument('--compare', type=Path, nargs='?', const=BASELINE,
+                        help='fail if suite results regressed from the baseline')
+    parser.add_argument('--tolerance', type=float, default=1.5, help='slowdown or memory growth counted as a regression')
+    args = parser.parse_args()
+
+    for name in args.benchmarks:
+        if name not in benchmarks:
+            parser.error(f'unknown benchmark {name!r}, expected one of {", ".join(benchmarks)}')
+    args.benchmarks = args.benchmarks or benchmarks
+
+    if 'cuts' in args.benchmarks:
+        print('obvious cuts, total over all labels')
+        print(f'{"lattice":>12} {"labels":>8} {"batch":>12} {"incremental":>12} {"speedup":>8}')
+        for side, n_labels in [(30, 300), (100, 1000), (300, 1000)]:
+            if side * side > args.max_nodes:
+                continue
+            batch = bench_cuts(side, n_labels, incremental=False)
+            incremental = bench_cuts(side, n_labels, incremental=True)
+            print(f'{f"{side}x{side}":>12} {n_labels:>8} {batch*1e3:>10.1f}ms {incremental*1e3:>10.1f}ms {batch/incremental:>7.0f}x')
+
+    if 'moss' in args.benchmarks:
+        print('moss, single call')
+        print(f'{"graph":>12} {"nodes":>8} {"python":>12} {"frontier":>12} {"speedup":>8}')
+        for n in [10**2, 10**3, 10**4, 10**5, 10**6]:
+            if n > args.max_nodes:
+                continue
+            side = int(math.sqrt(n))
+            for name, (i, j) in [('lattice', lattice_edges(side)), ('geometric', random_geometric_edges(n))]:
+                t_python, t_frontier = bench_moss(side * side if name == 'lattice' else n, i, j)
+                print(f'{name:>12} {n:>8} {t_python*1e3:>10.2f}ms {t_frontier*1e3:>10.2f}ms {t_python/t_frontier:>7.1f}x')
+
+    if 'mssp' in args.benchmarks:
+        print('MSSP midpoint for the first queries of S², total')
+        print(f'{"lattice":>12} {"labels":>8} {"frontier":>12} {"incremental":>12} {"speedup":>8}')
+        for side, n_labels in [(30, 300), (100, 1000), (300, 1000), (1000, 1000)]:
+            if side * side > args.max_nodes:
+                continue
+            t_frontier, t_incremental = bench_mssp(side, n_labels)
+            print(f'{f"{side}x{side}":>12} {n_labels:>8} {t_frontier*1e3:>10.1f}ms {t_incremental*1e3:>10.1f}ms {t_frontier/t_incremental:>7.1f}x')
+
+    if 'batch' in args.benchmarks:
+        print('queries and rounds until the whole cut set is found')
+        print(f'{"lattice":>12} {"k":>8} {"queries":>12} {"rounds":>12}')
+        for side in [20, 40]:
+            if side * side > args.max_nodes:
+                continue
+            for k in [None, 1, 4, 16]:
+                n_queries, n_rounds = bench_batch(side, k)
+                print(f'{f"{side}x{side}":>12} {"seq" if k is None else k:>8} {n_queries:>12} {n_rounds:>12}')
+
+    if 'suite' in args.benchmarks:
+        print('regression suite')
+        current = run_suite(args.max_nodes, args.families, args.repeat,
+                            progress=lambda key, result: print(format_result(key, result), flush=True))
+        if args.save is not None:
+            args.save.write_text(json.dumps(current, indent=1, sort_keys=True) + '\n')
+            print(f'saved baseline to {args.save}')
+        if args.compare is not None:
+            regressions = compare(json.loads(args.compare.read_text()), current, args.tolerance)
+            for key, metric, before, after in regressions:
+                print(f'REGRESSION {key} {metric}: {before:.4g} -> {after:.4g}')
+            if regressions:
+                sys.exit(1)
+            print(f'no regressions against {args.compare}')
+
+
+if __name__ == '__main__':
+    main()
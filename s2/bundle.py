@@ -0,0 +1,174 @@
+"""
+An on-disk graph bundle: a directory of `.npy` arrays that open memory-mapped, so graphs of any size load without
+being parsed or copied.
+
+A bundle holds the CSR structure of a `CSRGraph` (`indptr.npy`, `indices.npy`, `edge_ids.npy`, `edges.npy`), the
+original id of every vertex (`node_ids.npy`), and optionally a `(n, n_bases)` node-weight matrix (`weights.npy`),
+a stacked `(n_bases, *image_shape)` basis tensor (`bases.npy`), a base image (`image.npy`) and ground-truth `±1`
+labels (`truth.npy`). `meta.json` records the format version and which optional arrays are present.
+
+Convert to one with `python -m s2.bundle <graph dir or .gpickle> <bundle dir>`.
+"""
+
+import argparse
+import json
+from pathlib import Path
+import numpy as np
+from .graph import CSRGraph
+
+FORMAT_VERSION = 1
+_STRUCTURE = ('indptr', 'indices', 'edge_ids', 'edges')
+_OPTIONAL = ('weights', 'bases', 'image', 'truth')
+
+
+class GraphBundle:
+    """
+    A graph along with its node data, as stored in a bundle directory.
+
+    Attributes
+    ----------
+    graph : CSRGraph
+        The graph. Its structural arrays are shared with the bundle (memory-mapped when opened), while its edge mask
+        and labels are fresh, so running S² on it never writes to the bundle.
+    node_ids : np.ndarray of int64, shape (n,)
+        The original id of each vertex.
+    weights, bases, image, truth : np.ndarray or None
+        The optional arrays described in the module docstring.
+    """
+
+    def __init__(self, graph, node_ids, weights=None, bases=None, image=None, truth=None):
+        self.graph = graph
+        self.node_ids = node_ids
+        self.weights = weights
+        self.bases = bases
+        self.image = image
+        self.truth = truth
+
+    @classmethod
+    def open(cls, path, mmap_mode='r'):
+        """
+        Open a bundle directory, memory-mapping every array (or reading them in, if `mmap_mode` is `None`).
+        """
+        path = Path(path)
+        meta = json.loads((path / 'meta.json').read_text())
+        if meta['version'] > FORMAT_VERSION:
+            raise ValueError(f'{path} is a version {meta["version"]} bundle, but only up to {FORMAT_VERSION} is known')
+
+        def load(name):
+            return np.load(path / f'{name}.npy', mmap_mode=mmap_mode)
+
+        graph = CSRGraph(*(load(name) for name in _STRUCTURE))
+        return cls(graph, load('node_ids'), **{name: load(name) for name in _OPTIONAL if name in meta['arrays']})
+
+    def save(self, path):
+        """
+        Write the bundle to the directory `path`, creating it if needed.
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+
+        arrays = {name: getattr(self.graph, name) for name in _STRUCTURE}
+        arrays['node_ids'] = self.node_ids
+        arrays.update((name, getattr(self, name)) for name in _OPTIONAL if getattr(self, name) is not None)
+        for name, array in arrays.items():
+            np.save(path / f'{name}.npy', np.ascontiguousarray(array))
+
+        meta = {'version': FORMAT_VERSION, 'order': self.graph.order(), 'size': len(self.graph.edges),
+                'arrays': sorted(arrays)}
+        (path / 'meta.json').write_text(json.dumps(meta, indent=2))
+
+    @classmethod
+    def from_networkx(cls, G, weight_attr='basis_weights', truth_attr='truth'):
+        """
+        Build a bundle from an `nx.Graph` with integer nodes, taking weights and ground truth (bool or `±1`) from
+        node attributes if every node has them.
+        """
+        graph = CSRGraph.from_networkx(G)
+        node_ids = np.asarray(graph.nodelist, dtype=np.int64)
+        graph.nodelist = None
+
+        weights = [w for _, w in G.nodes(data=weight_attr)]
+        truth = [t for _, t in G.nodes(data=truth_attr)]
+        return cls(graph, node_ids,
+                   weights=np.asarray(weights, dtype=np.float32) if None not in weights else None,
+                   truth=np.where(np.asarray(truth) > 0, 1, -1).astype(np.int8) if None not in truth else None)
+
+    @classmethod
+    def from_csv_dir(cls, graph_dir):
+        """
+        Build a bundle from an experiment graph directory: `nodes.csv` (id, then basis weights), `edges.csv` (pairs
+        of node ids), `basis_*.npy` and, if Pillow is installed, `image.png`.
+        """
+        graph_dir = Path(graph_dir)
+        nodes = np.loadtxt(graph_dir / 'nodes.csv', delimiter=',', ndmin=2)
+        node_ids, weights = nodes[:, 0].astype(np.int64), nodes[:, 1:].astype(np.float32)
+
+        edges = np.loadtxt(graph_dir / 'edges.csv', delimiter=',', dtype=np.int64, ndmin=2).reshape(-1, 2)
+
+        # vertices are the nodes in id order
+        order = np.argsort(node_ids, kind='stable')
+        node_ids, weights = node_ids[order], weights[order]
+        graph = CSRGraph.from_edges(len(node_ids), np.searchsorted(node_ids, edges[:, 0]),
+                                    np.searchsorted(node_ids, edges[:, 1]))
+
+        basis_paths = sorted(graph_dir.glob('basis_*.npy'))
+        bases = np.stack([np.load(p).astype(np.float32) for p in basis_paths]) if basis_paths else None
+
+        image = None
+        if (graph_dir / 'image.png').exists():
+            try:
+                from PIL import Image
+            except ImportError:
+                pass
+            else:
+                image = np.asarray(Image.open(graph_dir / 'image.png'))
+                image = (image / np.iinfo(image.dtype).max).astype(np.float32)
+
+        return cls(graph, node_ids, weights=weights, bases=bases, image=image)
+
+    def oracle(self):
+        """
+        An oracle for `s2()` answering from the ground truth.
+        """
+        if self.truth is None:
+            raise ValueError('bundle has no ground truth')
+        truth = self.truth
+
+        def oracle(vert):
+            return bool(truth[vert] > 0)
+
+        return oracle
+
+    def __repr__(self):
+        present = ', '.join(name for name in _OPTIONAL if getattr(self, name) is not None)
+        return f'<GraphBundle {self.graph!r}{f" with {present}" if present else ""}>'
+
+
+def open_bundle(path, mmap_mode='r'):
+    return GraphBundle.open(path, mmap_mode=mmap_mode)
+
+
+def is_bundle(path):
+    return (Path(path) / 'meta.json').is_file()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert a graph to a bundle.')
+    parser.add_argument('source', help='an experiment graph directory (nodes.csv, edges.csv, ...) or a pickled nx.Graph')
+    parser.add_argument('bundle', help='the bundle directory to write')
+    args = parser.parse_args()
+
+    source = Path(args.source)
+    if source.is_dir():
+        bundle = GraphBundle.from_csv_dir(source)
+    else:
+        import pickle
+        with open(source, 'rb') as f:
+            bundle = GraphBundle.from_networkx(pickle.load(f))
+
+    bundle.save(args.bundle)
+    print(f'wrote {bundle!r} to {args.bundle}')
+
+
+if __name__ == '__main__':
+    main()
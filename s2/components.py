@@ -0,0 +1,219 @@
+"""
+Connected components of a graph as S² cuts it, for sampling only where labels are still needed and stopping early.
+"""
+
+import math
+import numpy as np
+from .graph import CSRGraph
+
+
+class _VertexPool:
+    """
+    A set of vertices with O(1) uniform sampling, insertion and removal: they're kept in a list, and removing one
+    moves the last into its slot.
+    """
+
+    def __init__(self, verts=()):
+        self._verts = list(verts)
+        self._index = {vert: i for i, vert in enumerate(self._verts)}
+
+    def __len__(self):
+        return len(self._verts)
+
+    def __contains__(self, vert):
+        return vert in self._index
+
+    def add(self, vert):
+        if vert not in self._index:
+            self._index[vert] = len(self._verts)
+            self._verts.append(vert)
+
+    def remove(self, vert):
+        i = self._index.pop(vert)
+        last = self._verts.pop()
+        if i < len(self._verts):
+            self._verts[i] = last
+            self._index[last] = i
+
+    def discard(self, vert):
+        if vert in self._index:
+            self.remove(vert)
+
+    def choice(self, rng):
+        return self._verts[rng.randrange(len(self._verts))]
+
+    def sample(self, rng, k):
+        return rng.sample(self._verts, k)
+
+
+class StoppingRule:
+    """
+    When S² may stop sampling a component, and when it may stop altogether.
+
+    Once no U–V path is left, every component holds at most one label. Random sampling then only draws from
+    components that are still open: unlabeled ones of at least `min_component_size` vertices, and labeled ones with
+    fewer than `min_labels` labels or a labeled fraction below `min_fraction`. S² stops once no component is open,
+    or after `budget` queries.
+
+    The labels a component needs guard against an island of the other label hiding inside it: one covering a
+    fraction β of a component is missed with probability about (1 - β)^(min_fraction * size). With
+    `min_fraction=0`, a component closes on its first label, which only finds every cut if the graph falls apart
+    into one component per class region as soon as each is labeled.
+    """
+
+    def __init__(self, min_labels=1, min_fraction=0.05, min_component_size=1, budget=None):
+        self.min_labels = min_labels
+        self.min_fraction = min_fraction
+        self.min_component_size = min_component_size
+        self.budget = budget
+
+    def is_open(self, size, n_labeled):
+        if n_labeled == 0:
+            return size >= self.min_component_size
+        return n_labeled < max(self.min_labels, math.ceil(self.min_fraction * size))
+
+    def exhausted(self, n_queries):
+        return self.budget is not None and n_queries >= self.budget
+
+
+class ComponentIndex:
+    """
+    The connected components of `G`'s remaining edges and how many labeled vertices each one holds, along with a
+    pool of the unlabeled vertices in components that `rule` keeps open.
+
+    Labels are counted as they arrive, and cuts only mark their component dirty; dirty components are split lazily,
+    the next time a random vertex is needed, by a search over just their own vertices.
+    """
+
+    def __init__(self, G, rule, is_labeled):
+        self.G = G
+        self.rule = rule
+        self._is_labeled = is_labeled
+        self._csr = isinstance(G, CSRGraph)
+
+        self.component = np.zeros(G.order(), dtype=np.int64) if self._csr else {}
+        self.members = {}
+        self.n_labeled = {}
+        self._dirty = set()
+        self._closed = set()
+        self._next_id = 0
+        self.open = _VertexPool()
+        self._seen = np.zeros(G.order(), dtype=bool) if self._csr else None
+
+        verts = np.arange(G.order()) if self._csr else list(G.nodes())
+        for members in self._split(verts):
+            self._add_component(members)
+
+    def label(self, vert):
+        c = self.component[vert]
+        self.n_labeled[c] += 1
+        self.open.discard(vert)
+        if c not in self._dirty and c not in self._closed and not self._is_open(c):
+            self._close(c)
+
+    def cut(self, edges):
+        for u, _ in edges:
+            self._dirty.add(self.component[u])
+
+    def choice(self, rng):
+        """
+        A uniformly random unlabeled vertex from an open component, or `None` if none is left.
+        """
+        self.refresh()
+        return self.open.choice(rng) if len(self.open) else None
+
+    def sample(self, rng, k):
+        self.refresh()
+        return self.open.sample(rng, min(k, len(self.open)))
+
+    def refresh(self):
+        for c in self._dirty:
+            members = self.members.pop(c)
+            del self.n_labeled[c]
+            self._closed.discard(c)
+            for vert in members:
+                self.open.discard(vert)
+            for part in self._split(members):
+                self._add_component(part)
+        self._dirty.clear()
+
+    def _is_open(self, c):
+        return self.rule.is_open(len(self.members[c]), self.n_labeled[c])
+
+    def _close(self, c):
+        self._closed.add(c)
+        for vert in self.members[c]:
+            self.open.discard(vert)
+
+    def _add_component(self, members):
+        c = self._next_id
+        self._next_id += 1
+        self.members[c] = members
+        if self._csr:
+            self.component[members] = c
+            labeled = [self._is_labeled(v) for v in members.tolist()]
+        else:
+            for vert in members:
+                self.component[vert] = c
+            labeled = [self._is_labeled(v) for v in members]
+        self.n_labeled[c] = sum(labeled)
+
+        if not self._is_open(c):
+            self._closed.add(c)
+        else:
+            for vert, is_labeled in zip(members.tolist() if self._csr else members, labeled):
+                if not is_labeled:
+                    self.open.add(vert)
+
+    def _split(self, verts):
+        """
+        The connected components among `verts`, which must be a union of components.
+        """
+        if not self._csr:
+            parts, seen = [], set()
+            for seed in verts:
+                if seed in seen:
+                    continue
+                part, frontier = [seed], [seed]
+                seen.add(seed)
+                while frontier:
+                    frontier = [w for v in frontier for w in self.G.neighbors(v) if w not in seen and not seen.add(w)]
+                    part += frontier
+                parts.append(part)
+            return parts
+
+        return _split(self.G, verts, self._seen)
+
+
+def connected_components(G, verts=None):
+    """
+    The connected components of a `CSRGraph`'s remaining edges, as a list of vertex arrays. If `verts` is given,
+    only the components containing them are found.
+    """
+    seen = np.zeros(G.order(), dtype=bool)
+    if verts is None:
+        return _split(G, np.arange(G.order()), seen)
+    return _split(G, np.asarray(verts, dtype=np.int64), seen)
+
+
+def _split(G, verts, seen):
+    # the components containing `verts`, by a BFS from each vertex of `verts` not yet reached; `seen` is all false
+    # on entry and on return
+    parts = []
+    while True:
+        unseen = verts[~seen[verts]]
+        if not len(unseen):
+            break
+        frontier = unseen[:1]
+        seen[frontier] = True
+        part = [frontier]
+        while len(frontier):
+            frontier = np.unique(G.expand(frontier))
+            frontier = frontier[~seen[frontier]]
+            seen[frontier] = True
+            part.append(frontier)
+        parts.append(np.concatenate(part))
+
+    for part in parts:
+        seen[part] = False
+    return parts
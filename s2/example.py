@@ -1,8 +1,8 @@
 import networkx as nx
 import matplotlib.pyplot as plt
 from s2 import s2, path_midpoint, enumerate_find_ssp
-from moss import moss
-from util import draw_labeled_graph
+from s2.moss import moss
+from s2.util import draw_labeled_graph
 import timeit
 
 
@@ -22,7 +22,7 @@ def test_simple_lattice():
     draw_labeled_graph(G, oracle)
 
     fig.add_subplot(122).title.set_text('$S^2$')
-    draw_labeled_graph(G_cut, lambda v: G_cut.node[v].get('label'))
+    draw_labeled_graph(G_cut, lambda v: G_cut.nodes[v].get('label'))
 
     plt.show()
 
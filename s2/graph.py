@@ -0,0 +1,199 @@
+"""
+A compact, array-backed graph for running S² on large graphs.
+"""
+
+import numpy as np
+import networkx as nx
+
+
+def _index_dtype(n):
+    return np.int32 if n < np.iinfo(np.int32).max else np.int64
+
+
+class CSRGraph:
+    """
+    An undirected graph stored in compressed sparse row form.
+
+    Vertices are the integers `0..n-1`. Every undirected edge `e` is stored once in `edges[e]` and twice in the
+    adjacency (once in each endpoint's row), with `edge_ids` mapping each adjacency slot back to `e`. Edges are
+    never physically removed; instead `alive[e]` is cleared, so the structural arrays can be shared between copies
+    (and memory-mapped from disk).
+
+    Attributes
+    ----------
+    indptr : np.ndarray, shape (n+1,)
+        Row pointers: the neighbors of `v` are `indices[indptr[v]:indptr[v+1]]`, sorted ascending.
+    indices : np.ndarray, shape (2m,)
+        Neighbor of each adjacency slot.
+    edge_ids : np.ndarray, shape (2m,)
+        Edge index of each adjacency slot.
+    edges : np.ndarray, shape (m, 2)
+        Endpoints of each edge, with `edges[e, 0] < edges[e, 1]`.
+    alive : np.ndarray of bool, shape (m,)
+        Whether each edge is still present.
+    labels : np.ndarray of int8, shape (n,)
+        `+1`/`-1` for labeled vertices, `0` for unlabeled ones.
+    labeled : list
+        Every vertex labeled through `set_label`, in order. Stateful consumers (like `IncrementalMoss`) use it to
+        find what changed without rescanning `labels`.
+    nodelist : sequence or None
+        The original node of each vertex, if the graph was converted from elsewhere.
+    """
+
+    def __init__(self, indptr, indices, edge_ids, edges, alive=None, labels=None, nodelist=None, labeled=None):
+        self.indptr = indptr
+        self.indices = indices
+        self.edge_ids = edge_ids
+        self.edges = edges
+        self.alive = np.ones(len(edges), dtype=bool) if alive is None else alive
+        self.labels = np.zeros(len(indptr) - 1, dtype=np.int8) if labels is None else labels
+        self.nodelist = nodelist
+        self.labeled = [] if labeled is None else labeled
+
+    @classmethod
+    def from_edges(cls, n, i, j, nodelist=None):
+        """
+        Build a graph on `n` vertices from two arrays of edge endpoints.
+
+        Self-loops and duplicate edges are dropped.
+        """
+        i = np.asarray(i, dtype=np.int64)
+        j = np.asarray(j, dtype=np.int64)
+        if len(i) != len(j):
+            raise ValueError('edge endpoint arrays must have the same length')
+        if len(i) and (min(i.min(), j.min()) < 0 or max(i.max(), j.max()) >= n):
+            raise ValueError(f'edge endpoints must be in [0, {n})')
+
+        # canonicalize to i < j, and drop loops and duplicates
+        lo, hi = np.minimum(i, j), np.maximum(i, j)
+        keys = np.unique((lo * n + hi)[lo != hi])
+        lo, hi = keys // n, keys % n
+        m = len(keys)
+
+        vdtype, edtype = _index_dtype(n), _index_dtype(m)
+
+        src = np.concatenate([lo, hi])
+        dst = np.concatenate([hi, lo])
+        eid = np.concatenate([np.arange(m), np.arange(m)])
+        order = np.lexsort((dst, src))
+
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+
+        return cls(
+            indptr=indptr,
+            indices=dst[order].astype(vdtype),
+            edge_ids=eid[order].astype(edtype),
+            edges=np.stack([lo, hi], axis=1).astype(vdtype),
+            nodelist=nodelist)
+
+    @classmethod
+    def from_networkx(cls, G):
+        """
+        Build a graph from an `nx.Graph`. Vertex `k` corresponds to `nodelist[k]`, in `G.nodes()` order, and any
+        `label` node attributes (`bool` or `±1`) are carried over.
+        """
+        nodelist = list(G.nodes())
+        index = {node: k for k, node in enumerate(nodelist)}
+
+        m = G.number_of_edges()
+        i = np.fromiter((index[u] for u, _ in G.edges()), dtype=np.int64, count=m)
+        j = np.fromiter((index[v] for _, v in G.edges()), dtype=np.int64, count=m)
+        graph = cls.from_edges(len(nodelist), i, j, nodelist=nodelist)
+
+        for node, label in G.nodes(data='label'):
+            if label is not None:
+                graph.set_label(index[node], 1 if label > 0 else -1)
+
+        return graph
+
+    def to_networkx(self):
+        """
+        Convert the remaining edges back to an `nx.Graph` on the original nodes, with `label` node attributes of
+        `±1` for labeled vertices.
+        """
+        nodelist = self.nodelist if self.nodelist is not None else range(self.order())
+
+        G = nx.Graph()
+        G.add_nodes_from(nodelist)
+        G.add_edges_from((nodelist[i], nodelist[j]) for i, j in self.edges[self.alive].tolist())
+        for v in np.flatnonzero(self.labels):
+            G.nodes[nodelist[v]]['label'] = int(self.labels[v])
+
+        return G
+
+    def copy(self):
+        """
+        Copy the graph. The structure is shared; only the edge mask and labels are copied.
+        """
+        return CSRGraph(self.indptr, self.indices, self.edge_ids, self.edges,
+                        alive=self.alive.copy(), labels=self.labels.copy(), nodelist=self.nodelist,
+                        labeled=list(self.labeled))
+
+    def order(self):
+        return len(self.indptr) - 1
+
+    def number_of_edges(self):
+        return int(np.count_nonzero(self.alive))
+
+    def nodes(self):
+        return range(self.order())
+
+    def set_label(self, v, label):
+        """
+        Label vertex `v` with `label` (`±1`), recording it in `labeled`.
+        """
+        self.labels[v] = label
+        self.labeled.append(v)
+
+    def neighbors(self, v):
+        start, end = self.indptr[v], self.indptr[v + 1]
+        return self.indices[start:end][self.alive[self.edge_ids[start:end]]]
+
+    def expand(self, frontier, return_sources=False):
+        """
+        Find the neighbors of every vertex in `frontier` along alive edges, concatenated (with repeats).
+
+        If `return_sources` is true, also return the position in `frontier` that each neighbor was reached from.
+        """
+        slots, lengths = self._slots(frontier)
+        alive = self.alive[self.edge_ids[slots]]
+        if return_sources:
+            return self.indices[slots[alive]], np.repeat(np.arange(len(frontier)), lengths)[alive]
+        return self.indices[slots[alive]]
+
+    def incident_edges(self, vertices):
+        """
+        Find the indices of every edge incident to `vertices`, including removed ones.
+        """
+        slots, _ = self._slots(vertices)
+        return self.edge_ids[slots]
+
+    def _slots(self, vertices):
+        # adjacency slots of every row, laid end to end
+        starts = self.indptr[vertices]
+        lengths = self.indptr[vertices + 1] - starts
+        return np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum()), lengths
+
+    def edge_id(self, u, v):
+        """
+        Find the index of the edge between `u` and `v`, or `None` if there never was one.
+        """
+        start, end = self.indptr[u], self.indptr[u + 1]
+        k = start + np.searchsorted(self.indices[start:end], v)
+        if k < end and self.indices[k] == v:
+            return int(self.edge_ids[k])
+        return None
+
+    def has_edge(self, u, v):
+        e = self.edge_id(u, v)
+        return e is not None and bool(self.alive[e])
+
+    def remove_edges_from(self, edges):
+        for u, v in edges:
+            e = self.edge_id(u, v)
+            if e is not None:
+                self.alive[e] = False
+
+    def __repr__(self):
+        return f'<CSRGraph #v: {self.order()}, #e: {self.number_of_edges()}/{len(self.edges)}>'
@@ -1,7 +1,22 @@
 from collections import deque
+import numpy as np
 import networkx as nx
+from .graph import CSRGraph
+
+# below this many vertices, the per-level NumPy overhead of `frontier_moss` outweighs a plain BFS
+FRONTIER_MIN_ORDER = 256
 
 def moss(G, U, V):
+    """
+    Finds the midpoint of the shortest shortest path between U and V, or `None` if there is no U–V path.
+
+    A `CSRGraph` with at least `FRONTIER_MIN_ORDER` vertices is searched with `frontier_moss`. Note that converting
+    a small `nx.Graph` to a `CSRGraph` doesn't pay off: below roughly 10^4 vertices the plain BFS over an `nx.Graph`
+    is as fast or faster.
+    """
+    if isinstance(G, CSRGraph) and G.order() >= FRONTIER_MIN_ORDER:
+        return frontier_moss(G, U, V)
+
     queue_u,   queue_v = deque([]), deque([])
     visited_u, visited_v = set(), set()
 
@@ -29,3 +44,338 @@ def moss(G, U, V):
                 queue_v.append((child, G.neighbors(child)))
                 if child in visited_u and child not in U:
                     return child
+
+def frontier_moss(G, U, V):
+    """
+    Finds the midpoint of the shortest shortest path between U and V in a `CSRGraph`, like `moss`.
+
+    Both searches advance a whole BFS level at a time over the CSR arrays, alternating between U and V, and stop at
+    the first level that reaches a vertex the other side has already visited. The returned vertex is unlabeled and
+    lies on a shortest U–V path, with its distances to U and to V differing by at most one; ties within a level are
+    broken by discovery order. Returns `None` if no U–V path remains.
+    """
+    n = G.order()
+    sources_u, sources_v = _source_mask(n, U), _source_mask(n, V)
+    visited_u, visited_v = sources_u.copy(), sources_v.copy()
+    frontier_u, frontier_v = np.flatnonzero(sources_u), np.flatnonzero(sources_v)
+    scratch = np.empty(n, dtype=np.int64)
+
+    while len(frontier_u) and len(frontier_v):
+        frontier_u = _bfs_step(G, frontier_u, visited_u, scratch)
+        hits = frontier_u[visited_v[frontier_u] & ~sources_v[frontier_u]]
+        if len(hits):
+            return int(hits[0])
+
+        frontier_v = _bfs_step(G, frontier_v, visited_v, scratch)
+        hits = frontier_v[visited_u[frontier_v] & ~sources_u[frontier_v]]
+        if len(hits):
+            return int(hits[0])
+
+    return None
+
+def _source_mask(n, S):
+    mask = np.zeros(n, dtype=bool)
+    mask[np.fromiter(S, dtype=np.int64, count=len(S))] = True
+    return mask
+
+def _bfs_step(G, frontier, visited, scratch):
+    children = G.expand(frontier)
+    children = _dedupe(children[~visited[children]], scratch)
+    visited[children] = True
+    return children
+
+def _dedupe(vertices, scratch):
+    """
+    Drop repeated vertices, keeping the first occurrence of each in order. Cheaper than `np.unique` since it
+    doesn't sort; `scratch` is any int64 array with a slot per vertex, whose contents are overwritten.
+    """
+    positions = np.arange(len(vertices))
+    scratch[vertices] = len(vertices)
+    np.minimum.at(scratch, vertices, positions)
+    return vertices[scratch[vertices] == positions]
+
+class IncrementalMoss:
+    """
+    A stateful `find_moss` for `s2()` that keeps BFS distance fields to U and to V between calls.
+
+    The fields are only kept exact up to a search `radius`: anything farther is just known to be farther. Each call
+    looks at the vertices labeled since the previous one (from `CSRGraph.labeled`): they relax their side's field
+    outward, and the edges cut around them repair just the vertices whose shortest paths went through those edges,
+    all within the radius. The midpoint is then read off bucket queues of unlabeled vertices indexed by
+    dist to U + dist to V, ties going to the smallest |dist to U - dist to V|. The radius doubles when the shortest
+    path is out of reach and shrinks back when it gets short, so a query costs roughly the size of the changed
+    region within half the shortest path length rather than a fresh BFS.
+
+    It assumes labels are set with `CSRGraph.set_label` and edges are only removed around newly-labeled vertices
+    between calls, as `s2()` does. The state is rebuilt from scratch whenever it's handed a different graph or U
+    and V don't match the label log. Graphs other than `CSRGraph` fall back to `moss`.
+
+    Attributes
+    ----------
+    dist_u, dist_v : np.ndarray of int32
+        Distance of every vertex to the nearest vertex of U (resp. V). Only values up to `radius` are meaningful;
+        anything larger means "farther than `radius`".
+    radius : int
+        The current search radius.
+    """
+
+    INF = np.iinfo(np.int32).max
+
+    def __init__(self, initial_radius=8):
+        self.initial_radius = initial_radius
+        self._G = None
+
+    def __call__(self, G, U, V):
+        if not isinstance(G, CSRGraph):
+            return moss(G, U, V)
+
+        labeled = G.labeled
+        if G is not self._G or len(U) + len(V) != len(labeled) or len(labeled) < self._n_seen:
+            self._reset(G, U, V)
+        elif len(labeled) > self._n_seen:
+            self._update(G, np.array(labeled[self._n_seen:], dtype=np.int64))
+        self._n_seen = len(labeled)
+
+        while True:
+            found = self._best_candidate()
+            if found is not None and (found[0] + 1) // 2 <= self.radius:
+                # the true midpoint is within reach, so this one is as good
+                s, w = found
+                if 4 * ((s + 1) // 2) < self.radius:
+                    self.radius = max(self.initial_radius, 2 * ((s + 1) // 2))
+                return w
+
+            if self.radius >= G.order():
+                return None
+            self._extend(max(2 * self.radius, (found[0] + 1) // 2 if found else 0))
+
+    def _reset(self, G, U, V):
+        self._G = G
+        self._alive = G.alive.copy()
+        self._scratch = np.empty(G.order(), dtype=np.int64)
+        self.radius = self.initial_radius
+        self.dist_u = np.full(G.order(), self.INF, dtype=np.int32)
+        self.dist_v = np.full(G.order(), self.INF, dtype=np.int32)
+        self._relax(self.dist_u, np.fromiter(U, dtype=np.int64, count=len(U)))
+        self._relax(self.dist_v, np.fromiter(V, dtype=np.int64, count=len(V)))
+        self._rebuild_buckets()
+
+    def _update(self, G, new):
+        # edges cut since the last call are all incident to a newly-labeled vertex
+        edge_ids = G.incident_edges(new)
+        removed = edge_ids[self._alive[edge_ids] & ~G.alive[edge_ids]]
+        self._alive[removed] = False
+
+        changed = np.concatenate([
+            self._repair(self.dist_u, removed),
+            self._repair(self.dist_v, removed),
+            self._relax(self.dist_u, new[G.labels[new] > 0]),
+            self._relax(self.dist_v, new[G.labels[new] < 0]),
+        ])
+
+        if self._n_entries > 4 * G.order():
+            self._rebuild_buckets()
+        else:
+            self._push(changed)
+
+    def _bfs(self, dist, frontier, level):
+        """
+        Lower distances outward from `frontier` (at distance `level`), a level at a time up to the radius. Returns
+        the changed vertices.
+        """
+        changed = []
+        while len(frontier) and level < self.radius:
+            children = self._G.expand(frontier)
+            frontier = _dedupe(children[dist[children] > level + 1], self._scratch)
+            dist[frontier] = level + 1
+            changed.append(frontier)
+            level += 1
+
+        return np.concatenate(changed) if changed else np.empty(0, dtype=np.int64)
+
+    def _relax(self, dist, sources):
+        sources = sources[dist[sources] != 0]
+        dist[sources] = 0
+        return np.concatenate([sources, self._bfs(dist, sources, 0)])
+
+    def _extend(self, radius):
+        """
+        Grow the radius, continuing both searches from the old boundary.
+        """
+        old_radius, self.radius = self.radius, radius
+        reached = False
+        for dist in (self.dist_u, self.dist_v):
+            # anything past the old radius may be stale
+            dist[dist > old_radius] = self.INF
+            reached |= len(self._bfs(dist, np.flatnonzero(dist == old_radius), old_radius)) > 0
+
+        if not reached:
+            # both searches died out, so the fields are complete
+            self.radius = self._G.order()
+        self._rebuild_buckets()
+
+    def _repair(self, dist, removed):
+        """
+        Fix up `dist` after the edges `removed` were cut. Returns the changed vertices.
+        """
+        G, radius, scratch = self._G, self.radius, self._scratch
+
+        # vertices that may have lost their only parent: the far endpoint of every cut tree edge
+        a, b = G.edges[removed, 0], G.edges[removed, 1]
+        da, db = dist[a].astype(np.int64), dist[b].astype(np.int64)
+        orphans = np.concatenate([b[(da < radius) & (db == da + 1)], a[(db < radius) & (da == db + 1)]])
+        if not len(orphans):
+            return orphans
+
+        # a vertex is affected if none of its parents is left unaffected; going a level at a time, everything one
+        # level closer has been decided by the time we look at a vertex
+        levels = dist[orphans]
+        is_affected = np.zeros(G.order(), dtype=bool)
+        affected = []
+        candidates = np.empty(0, dtype=np.int64)
+        level = int(levels.min())
+        while level <= radius and (len(candidates) or (levels >= level).any()):
+            candidates = _dedupe(np.concatenate([candidates, orphans[levels == level]]), scratch)
+            candidates = candidates[~is_affected[candidates]]
+
+            neighbors, which = G.expand(candidates, return_sources=True)
+            parents = (dist[neighbors] == level - 1) & ~is_affected[neighbors]
+            orphaned = candidates[np.bincount(which[parents], minlength=len(candidates)) == 0]
+            is_affected[orphaned] = True
+            affected.append(orphaned)
+
+            children = G.expand(orphaned)
+            candidates = children[dist[children] == level + 1]
+            level += 1
+
+        affected = np.concatenate(affected)
+        if not len(affected):
+            return affected
+
+        # recompute the affected region from its unaffected boundary, a level at a time
+        dist[affected] = self.INF
+        neighbors, which = G.expand(affected, return_sources=True)
+        trusted = dist[neighbors] < radius
+        boundary = np.full(len(affected), self.INF, dtype=np.int64)
+        np.minimum.at(boundary, which[trusted], dist[neighbors[trusted]].astype(np.int64) + 1)
+        seeded = boundary <= radius
+        seeds, seed_levels = affected[seeded], boundary[seeded]
+        dist[seeds] = seed_levels
+
+        frontier = np.empty(0, dtype=np.int64)
+        level = int(seed_levels.min()) if len(seeds) else radius
+        while level < radius and (len(frontier) or (seed_levels >= level).any()):
+            starting = seeds[seed_levels == level]
+            frontier = np.concatenate([frontier, starting[dist[starting] == level]])
+            children = G.expand(frontier)
+            frontier = _dedupe(children[dist[children] > level + 1], scratch)
+            dist[frontier] = level + 1
+            level += 1
+
+        return affected
+
+    def _candidates(self, vertices):
+        """
+        Filter `vertices` to the unlabeled ones within the radius of both sides, returning them along with their
+        distance sums.
+        """
+        du = self.dist_u[vertices].astype(np.int64)
+        dv = self.dist_v[vertices].astype(np.int64)
+        ok = (du > 0) & (dv > 0) & (du <= self.radius) & (dv <= self.radius)
+        return vertices[ok], (du + dv)[ok]
+
+    def _push(self, vertices):
+        vertices, sums = self._candidates(vertices)
+        order = np.argsort(sums, kind='stable')
+        vertices, sums = vertices[order], sums[order]
+        bounds = np.flatnonzero(np.diff(sums)) + 1
+        for chunk, s in zip(np.split(vertices, bounds), sums[np.r_[0, bounds]].tolist() if len(sums) else []):
+            self._buckets.setdefault(s, []).append(chunk)
+        self._n_entries += len(vertices)
+
+    def _rebuild_buckets(self):
+        self._buckets = {}
+        self._n_entries = 0
+        self._push(np.arange(self._G.order()))
+
+    def _best_candidate(self):
+        """
+        Find the lowest distance sum with a live candidate, and its candidate with the smallest gap between the two
+        distances. Stale entries are dropped on the way.
+        """
+        while self._buckets:
+            s = min(self._buckets)
+            chunks = self._buckets.pop(s)
+            self._n_entries -= sum(len(chunk) for chunk in chunks)
+
+            vertices, sums = self._candidates(_dedupe(np.concatenate(chunks), self._scratch))
+            vertices = vertices[sums == s]
+            if not len(vertices):
+                continue
+
+            self._buckets[s] = [vertices]
+            self._n_entries += len(vertices)
+            gaps = np.abs(self.dist_u[vertices].astype(np.int64) - self.dist_v[vertices])
+            return s, int(vertices[np.argmin(gaps)])
+
+        return None
+
+def disjoint_midpoints(G, U, V, k, exclude=()):
+    """
+    Finds up to `k` distinct query vertices at once: the midpoints of successively shortest, vertex-disjoint U–V
+    paths in a `CSRGraph`.
+
+    Greedily, each round finds the midpoint of the shortest U–V path that avoids the interiors of the paths already
+    picked, then blocks that path. Paths never go through the vertices in `exclude` (e.g. ones that are already
+    being queried). Costs two BFS per midpoint. Graphs other than `CSRGraph` only get the single midpoint from
+    `moss`, and ignore `exclude`.
+    """
+    if not isinstance(G, CSRGraph):
+        vert = moss(G, U, V)
+        return [] if vert is None else [vert]
+
+    n = G.order()
+    INF = IncrementalMoss.INF
+    sources_u, sources_v = _source_mask(n, U), _source_mask(n, V)
+    blocked = _source_mask(n, exclude)
+    scratch = np.empty(n, dtype=np.int64)
+
+    midpoints = []
+    while len(midpoints) < k:
+        dist_u = _distances(G, sources_u, blocked, scratch)
+        dist_v = _distances(G, sources_v, blocked, scratch)
+
+        candidates = np.flatnonzero((dist_u > 0) & (dist_v > 0) & (dist_u != INF) & (dist_v != INF))
+        if not len(candidates):
+            break
+        du, dv = dist_u[candidates].astype(np.int64), dist_v[candidates].astype(np.int64)
+        w = int(candidates[np.lexsort((np.abs(du - dv), du + dv))[0]])
+        midpoints.append(w)
+
+        # block the interior of the path through w, walking down both fields
+        blocked[w] = True
+        for dist in (dist_u, dist_v):
+            x = w
+            while dist[x] > 1:
+                neighbors = G.neighbors(x)
+                x = int(neighbors[(dist[neighbors] == dist[x] - 1) & ~blocked[neighbors]][0])
+                blocked[x] = True
+
+    return midpoints
+
+def _distances(G, sources, blocked, scratch):
+    """
+    Multi-source BFS distances from the vertices in the mask `sources`, never entering `blocked` vertices.
+    """
+    dist = np.full(G.order(), IncrementalMoss.INF, dtype=np.int32)
+    frontier = np.flatnonzero(sources)
+    dist[frontier] = 0
+
+    level = 0
+    while len(frontier):
+        children = G.expand(frontier)
+        frontier = _dedupe(children[(dist[children] == IncrementalMoss.INF) & ~blocked[children]], scratch)
+        dist[frontier] = level + 1
+        level += 1
+
+    return dist
@@ -0,0 +1,77 @@
+"""
+Predict labels for the unlabeled vertices of a graph S² has cut.
+"""
+
+import numpy as np
+from .graph import CSRGraph
+from .components import connected_components
+
+
+def predict(G, vertices=None, out=None, max_iter=200, tol=1e-3):
+    """
+    Scores every vertex of a cut graph in [-1, 1], by label propagation within each connected component of its
+    remaining edges. The sign of a score is the predicted label, and 0 means there is nothing to go on.
+
+    A component holding labels of one class gets that label throughout; an unlabeled one gets 0. Only components
+    holding both labels (whose cut S² hasn't finished) need propagation: labeled vertices are clamped, and every
+    other vertex repeatedly takes the mean score of its neighbors, until no score moves by more than `tol` (the
+    harmonic solution of Zhu et al., 2003), all components at once.
+
+    Parameters
+    ----------
+    G : CSRGraph or nx.Graph
+        The cut graph. An `nx.Graph` takes its labels from `label` node attributes (`bool` or `±1`).
+    vertices : array of int, optional
+        Only rescore the components containing these vertices, updating `out` (the scores from an earlier call) in
+        place, e.g. after labeling them or cutting edges at them.
+    out : np.ndarray of float, optional
+        Where to write the scores, required with `vertices`.
+    max_iter : int
+        The most propagation sweeps to run.
+    tol : float
+        The largest change in a score that counts as converged.
+
+    Returns
+    -------
+    np.ndarray of float, or dict
+        The score of each vertex; for an `nx.Graph`, a dict from node to score.
+    """
+    if not isinstance(G, CSRGraph):
+        C = CSRGraph.from_networkx(G)
+        return dict(zip(C.nodelist, predict(C, max_iter=max_iter, tol=tol).tolist()))
+
+    n = G.order()
+    if vertices is None:
+        out = np.zeros(n, dtype=np.float64)
+    elif out is None:
+        raise ValueError('rescoring some vertices needs the earlier scores as `out`')
+    labels = G.labels.astype(np.float64)
+
+    mixed = []
+    for component in connected_components(G, vertices):
+        component_labels = labels[component]
+        has_pos, has_neg = (component_labels > 0).any(), (component_labels < 0).any()
+        if has_pos and has_neg:
+            mixed.append(component)
+        else:
+            out[component] = 1.0 if has_pos else -1.0 if has_neg else 0.0
+
+    if mixed:
+        _propagate(G, np.concatenate(mixed), labels, out, max_iter, tol)
+    return out
+
+
+def _propagate(G, verts, labels, out, max_iter, tol):
+    # Jacobi sweeps over `verts`, which must be a union of components
+    neighbors, sources = G.expand(verts, return_sources=True)
+    degree = np.maximum(np.bincount(sources, minlength=len(verts)), 1)
+    clamped = labels[verts] != 0
+
+    out[verts] = labels[verts]
+    for _ in range(max_iter):
+        scores = np.bincount(sources, weights=out[neighbors], minlength=len(verts)) / degree
+        scores[clamped] = labels[verts][clamped]
+        delta = np.abs(scores - out[verts]).max()
+        out[verts] = scores
+        if delta <= tol:
+            break
@@ -0,0 +1,191 @@
+"""
+Run S² on many graphs and seeds at once, across processes, and measure how quickly it finds each cut set.
+
+Every distinct graph is written once as a `GraphBundle` (with its ground truth) to a temporary directory, which
+every worker process memory-maps, so the graph arrays are shared through the page cache rather than pickled to
+each task. Each task seeds its own `random.Random`, so results don't depend on scheduling.
+
+Run with `python -m s2.simulate [--sides 30 60 ...] [--seeds N] [--workers N] [-k K]`.
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import timeit
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import networkx as nx
+from . import s2, s2_batch
+from .bundle import GraphBundle, open_bundle
+from .graph import CSRGraph
+from .moss import IncrementalMoss
+
+
+class SimulationTask:
+    """
+    One run of S².
+
+    Parameters
+    ----------
+    graph : nx.Graph, CSRGraph or GraphBundle
+        The graph to run on. Tasks that share a graph object (and oracle) share its arrays too.
+    oracle : fn(vertex) -> bool, optional
+        The ground truth, called once per vertex in the parent process (so it needn't be picklable). A
+        `GraphBundle` with `truth` can leave it out.
+    seed : int
+        Seed for the task's random vertex choices.
+    name : str, optional
+        Shown in the results; defaults to a description of the graph.
+    """
+
+    def __init__(self, graph, oracle=None, seed=0, name=None):
+        self.graph = graph
+        self.oracle = oracle
+        self.seed = seed
+        self.name = name if name is not None else f'{type(graph).__name__}#{id(graph):x}'
+
+
+def simulate(tasks, k=None, budgets=(), max_workers=None):
+    """
+    Run every task to completion and measure it, returning one dict per task (in order) with:
+
+    `name`, `seed`, `nodes`, `edges`
+        Which run, and the size of its graph.
+    `cut_edges`
+        How many edges the ground truth cuts.
+    `queries`
+        How many vertices S² queried in all.
+    `queries_to_cut`
+        How many queries it took until every cut edge was found (both its endpoints labeled).
+    `cut_accuracy`
+        The fraction of edges S² cut correctly (cut iff the ground truth cuts them) by the end.
+    `recall@b`, for each `b` in `budgets`
+        The fraction of cut edges found within the first `b` queries.
+    `seconds`
+        Wall time of the run itself, excluding setup.
+
+    Runs use `s2()` with `IncrementalMoss` if `k` is `None`, and `s2_batch()` with batches of `k` otherwise.
+    """
+    tasks = list(tasks)
+    with tempfile.TemporaryDirectory(prefix='s2-simulate-', dir='/dev/shm' if os.path.isdir('/dev/shm') else None) as tmp:
+        paths = {}
+        jobs = []
+        for task in tasks:
+            key = (id(task.graph), id(task.oracle))
+            if key not in paths:
+                paths[key] = os.path.join(tmp, f'graph{len(paths)}')
+                _with_truth(task.graph, task.oracle).save(paths[key])
+            jobs.append((paths[key], task.name, task.seed, k, tuple(budgets)))
+
+        if max_workers == 1:
+            return [_run(*job) for job in jobs]
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(_run, *zip(*jobs)))
+
+
+def format_table(results):
+    """
+    Format `simulate()` results as an aligned text table.
+    """
+    if not results:
+        return ''
+    columns = list(results[0])
+
+    def cell(value):
+        return f'{value:.3f}' if isinstance(value, float) else str(value)
+
+    rows = [columns] + [[cell(result[c]) for c in columns] for result in results]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    return '\n'.join(' '.join(value.rjust(width) for value, width in zip(row, widths)) for row in rows)
+
+
+def _with_truth(graph, oracle):
+    """
+    A `GraphBundle` of `graph`, with `truth` filled in from `oracle` if given.
+    """
+    if isinstance(graph, GraphBundle):
+        bundle = GraphBundle(graph.graph, graph.node_ids, truth=graph.truth)
+        nodelist = None
+    else:
+        if isinstance(graph, nx.Graph):
+            graph = CSRGraph.from_networkx(graph)
+        nodelist = graph.nodelist
+        bundle = GraphBundle(CSRGraph(graph.indptr, graph.indices, graph.edge_ids, graph.edges),
+                             np.arange(graph.order(), dtype=np.int64))
+
+    if oracle is not None:
+        nodes = nodelist if nodelist is not None else range(bundle.graph.order())
+        bundle.truth = np.array([1 if oracle(v) else -1 for v in nodes], dtype=np.int8)
+    if bundle.truth is None:
+        raise ValueError('a task needs an oracle, or a GraphBundle with ground truth')
+    return bundle
+
+
+def _run(path, name, seed, k, budgets):
+    bundle = open_bundle(path)
+    G, truth = bundle.graph, np.asarray(bundle.truth)
+    truth_oracle = bundle.oracle()
+
+    order = []
+    def oracle(vert):
+        order.append(vert)
+        return truth_oracle(vert)
+
+    rng = random.Random(seed)
+    start = timeit.default_timer()
+    if k is None:
+        G_cut = s2(G, oracle, IncrementalMoss(), rng=rng)
+    else:
+        G_cut = s2_batch(G, oracle, k, rng=rng)
+    seconds = timeit.default_timer() - start
+
+    # a cut edge is found once both its endpoints are labeled
+    position = np.empty(G.order(), dtype=np.int64)
+    position[order] = np.arange(len(order))
+    edges = np.asarray(G.edges)
+    is_cut = truth[edges[:, 0]] != truth[edges[:, 1]]
+    found_at = position[edges[is_cut]].max(axis=1) + 1
+
+    result = {
+        'name': name,
+        'seed': seed,
+        'nodes': G.order(),
+        'edges': len(edges),
+        'cut_edges': int(is_cut.sum()),
+        'queries': len(order),
+        'queries_to_cut': int(found_at.max()) if len(found_at) else 0,
+        'cut_accuracy': float(np.mean(G_cut.alive != is_cut)) if len(edges) else 1.0,
+    }
+    for b in budgets:
+        result[f'recall@{b}'] = float(np.mean(found_at <= b)) if len(found_at) else 1.0
+    result['seconds'] = seconds
+    return result
+
+
+def main():
+    from .bench import lattice_edges, lattice_oracle
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sides', type=int, nargs='+', default=[30, 60], help='lattice side lengths')
+    parser.add_argument('--seeds', type=int, default=8, help='runs per lattice')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('-k', type=int, default=None, help='batch size (default: sequential)')
+    parser.add_argument('--budgets', type=int, nargs='*', default=[50, 100, 200])
+    args = parser.parse_args()
+
+    tasks = []
+    for side in args.sides:
+        graph = CSRGraph.from_edges(side * side, *lattice_edges(side))
+        truth = lattice_oracle(side)
+        tasks += [SimulationTask(graph, lambda v, truth=truth, side=side: truth(divmod(v, side)), seed=seed,
+                                 name=f'lattice{side}') for seed in range(args.seeds)]
+
+    start = timeit.default_timer()
+    results = simulate(tasks, k=args.k, budgets=args.budgets, max_workers=args.workers)
+    print(format_table(results))
+    print(f'{len(tasks)} runs in {timeit.default_timer() - start:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,13 @@
+import random
+import asyncio
+import numpy as np
 import networkx as nx
-from s2 import find_obvious_cuts
+from s2 import s2, s2_batch, s2_async, BatchOracle, StoppingRule, find_obvious_cuts, find_incident_cuts
+from s2.moss import moss, frontier_moss, IncrementalMoss, disjoint_midpoints
+from s2.graph import CSRGraph
+from s2.bundle import GraphBundle, open_bundle
+from s2.simulate import SimulationTask, simulate
+from s2.predict import predict
 
 
 def test_find_obvious_cuts_simple():
@@ -18,3 +26,338 @@ def test_find_obvious_cuts_simple():
 
     # with presearched vertices
     assert find_obvious_cuts(G, [(0, -1), (1, +1), (2, +1)]) == [(0, 1), (0, 2)]
+
+
+def test_find_incident_cuts():
+    G = nx.Graph()
+    G.add_node(0, label=-1)
+    G.add_node(1, label=+1)
+    G.add_node(2)
+    G.add_edges_from([(0, 1), (0, 2), (1, 2)])
+    assert find_incident_cuts(G, 0) == [(0, 1)]
+    assert find_incident_cuts(G, 1) == [(1, 0)]
+
+
+def test_incremental_cuts_match_batch():
+    G = nx.grid_2d_graph(12, 12)
+
+    def oracle(vert):
+        return ((vert[0] < 4) and (vert[1] < 4)) or ((vert[0] > 7) and (vert[1] > 7))
+
+    random.seed(0)
+    G_batch = s2(G, oracle, moss, incremental_cuts=False)
+    random.seed(0)
+    G_incremental = s2(G, oracle, moss, incremental_cuts=True)
+
+    edges = lambda G: set(frozenset(e) for e in G.edges())
+    assert edges(G_incremental) == edges(G_batch)
+    assert edges(G_incremental) != edges(G)
+
+
+def test_csr_graph_from_networkx():
+    G = nx.grid_2d_graph(5, 7)
+    G.nodes[(0, 0)]['label'] = True
+    G.nodes[(4, 6)]['label'] = -1
+    C = CSRGraph.from_networkx(G)
+
+    assert C.order() == G.order()
+    assert C.number_of_edges() == G.number_of_edges()
+    for k, node in enumerate(C.nodelist):
+        assert set(C.nodelist[u] for u in C.neighbors(k)) == set(G.neighbors(node))
+    assert C.labels.tolist().count(1) == 1 and C.labels.tolist().count(-1) == 1
+
+    H = C.to_networkx()
+    assert set(H.nodes()) == set(G.nodes())
+    assert set(map(frozenset, H.edges())) == set(map(frozenset, G.edges()))
+    assert H.nodes[(0, 0)]['label'] == 1 and H.nodes[(4, 6)]['label'] == -1
+
+
+def test_csr_graph_from_edges():
+    C = CSRGraph.from_edges(4, [0, 1, 2, 1, 3], [1, 0, 2, 2, 1])
+    assert C.number_of_edges() == 3
+    assert C.neighbors(1).tolist() == [0, 2, 3]
+
+    D = C.copy()
+    D.remove_edges_from([(2, 1)])
+    assert not D.has_edge(1, 2) and C.has_edge(1, 2)
+    assert D.neighbors(1).tolist() == [0, 3]
+    assert D.indices is C.indices
+
+
+def test_find_obvious_cuts_csr():
+    C = CSRGraph.from_edges(3, [0, 0, 1], [1, 2, 2])
+    C.labels[:] = [-1, 1, 1]
+    assert find_obvious_cuts(C) == [(0, 1), (0, 2)]
+    assert find_incident_cuts(C, 0) == [(0, 1), (0, 2)]
+    assert find_incident_cuts(C, 2) == [(2, 0)]
+
+
+def test_s2_csr_graph():
+    G = nx.grid_2d_graph(10, 10)
+
+    def oracle(vert):
+        return ((vert[0] < 3) and (vert[1] < 3)) or ((vert[0] > 6) and (vert[1] > 6))
+
+    C = CSRGraph.from_networkx(G)
+    C_cut = s2(C, lambda v: oracle(C.nodelist[v]), moss)
+    assert C.number_of_edges() == G.number_of_edges()
+
+    # every vertex ends up labeled, so what's left is exactly the edges within each class
+    assert set(map(frozenset, C_cut.to_networkx().edges())) == \
+        set(frozenset((u, v)) for u, v in G.edges() if oracle(u) == oracle(v))
+
+
+def test_frontier_moss_midpoint():
+    rng = random.Random(1)
+    for trial in range(30):
+        G = nx.gnp_random_graph(60, 0.05, seed=trial)
+        U = set(rng.sample(range(60), 3))
+        V = set(rng.sample([v for v in range(60) if v not in U], 3))
+        C = CSRGraph.from_networkx(G)
+        # drop U-V edges, like obvious cuts would
+        C.remove_edges_from([(u, v) for u in U for v in V])
+        G = C.to_networkx()
+
+        w = frontier_moss(C, U, V)
+        assert (w is None) == (moss(G, U, V) is None)
+        if w is None:
+            continue
+
+        d_u = nx.multi_source_dijkstra_path_length(G, U)
+        d_v = nx.multi_source_dijkstra_path_length(G, V)
+        d = min(d_u[u] + d_v[u] for u in G.nodes() if u in d_u and u in d_v)
+        assert w not in U and w not in V
+        assert d_u[w] + d_v[w] == d
+        assert abs(d_u[w] - d_v[w]) <= 1
+
+
+def test_incremental_moss_matches_fresh_bfs():
+    for trial in range(5):
+        G = nx.connected_watts_strogatz_graph(300, 4, 0.05, seed=trial)
+        C = CSRGraph.from_networkx(G)
+        rng = random.Random(trial)
+        oracle = lambda v: (v // 40) % 2 == 0
+
+        find_moss = IncrementalMoss(initial_radius=2)
+        U, V = set(), set()
+        for vert in rng.sample(range(300), 100):
+            {True: U, False: V}[oracle(vert)].add(vert)
+            C.set_label(vert, 1 if oracle(vert) else -1)
+            C.remove_edges_from(find_incident_cuts(C, vert))
+
+            w = find_moss(C, U, V)
+            H = C.to_networkx()
+            for S, dist in [(U, find_moss.dist_u), (V, find_moss.dist_v)]:
+                expected = nx.multi_source_dijkstra_path_length(H, S) if S else {}
+                for v in range(300):
+                    if expected.get(v, IncrementalMoss.INF) <= find_moss.radius:
+                        assert dist[v] == expected[v]
+                    else:
+                        assert dist[v] > find_moss.radius
+
+            assert (w is None) == (frontier_moss(C, U, V) is None)
+            if w is not None:
+                d_u = nx.multi_source_dijkstra_path_length(H, U)
+                d_v = nx.multi_source_dijkstra_path_length(H, V)
+                unlabeled = [v for v in range(300) if v not in U and v not in V and v in d_u and v in d_v]
+                assert w in unlabeled
+                assert d_u[w] + d_v[w] == min(d_u[v] + d_v[v] for v in unlabeled)
+                assert abs(d_u[w] - d_v[w]) <= 1
+
+
+def test_s2_incremental_moss():
+    G = nx.grid_2d_graph(20, 20)
+
+    def oracle(vert):
+        return ((vert[0] < 6) and (vert[1] < 6)) or ((vert[0] > 13) and (vert[1] > 13))
+
+    C = CSRGraph.from_networkx(G)
+    C_cut = s2(C, lambda v: oracle(C.nodelist[v]), IncrementalMoss())
+    assert set(map(frozenset, C_cut.to_networkx().edges())) == \
+        set(frozenset((u, v)) for u, v in G.edges() if oracle(u) == oracle(v))
+
+
+def test_disjoint_midpoints():
+    # 0 and 9 joined by paths of length 4 (through 1, 2, 3) and 6 (through 4..8), plus a shortcut 2-5
+    C = CSRGraph.from_edges(10, [0, 1, 2, 3, 0, 4, 5, 6, 7, 8, 2], [1, 2, 3, 9, 4, 5, 6, 7, 8, 9, 5])
+    assert disjoint_midpoints(C, {0}, {9}, 1) == [2]
+    assert disjoint_midpoints(C, {0}, {9}, 3) == [2, 6]
+    assert disjoint_midpoints(C, {0}, {9}, 3, exclude=[3]) == [6]
+
+
+def test_s2_batch():
+    G = nx.grid_2d_graph(12, 12)
+
+    def oracle(vert):
+        return ((vert[0] < 4) and (vert[1] < 4)) or ((vert[0] > 7) and (vert[1] > 7))
+
+    C = CSRGraph.from_networkx(G)
+    C_cut = s2_batch(C, lambda v: oracle(C.nodelist[v]), 4)
+    assert set(map(frozenset, C_cut.to_networkx().edges())) == \
+        set(frozenset((u, v)) for u, v in G.edges() if oracle(u) == oracle(v))
+
+
+def test_bundle_round_trip(tmp_path):
+    # a 6x6 grid with shuffled node ids, written in the experiment CSV layout
+    G = nx.convert_node_labels_to_integers(nx.grid_2d_graph(6, 6), ordering='sorted', label_attribute='pos')
+    ids = random.Random(0).sample(range(100, 1000), G.order())
+    with open(tmp_path / 'nodes.csv', 'w') as f:
+        f.writelines(f'{ids[v]},{v / 10},{-v / 10}\n' for v in G.nodes())
+    with open(tmp_path / 'edges.csv', 'w') as f:
+        f.writelines(f'{ids[u]},{ids[v]}\n' for u, v in G.edges())
+
+    GraphBundle.from_csv_dir(tmp_path).save(tmp_path / 'bundle')
+    bundle = open_bundle(tmp_path / 'bundle')
+    assert bundle.bases is None and bundle.truth is None
+    assert sorted(ids) == bundle.node_ids.tolist()
+
+    index = {node_id: v for v, node_id in enumerate(ids)}
+    vertex = {node_id: k for k, node_id in enumerate(bundle.node_ids.tolist())}
+    assert set(frozenset((vertex[ids[u]], vertex[ids[v]])) for u, v in G.edges()) == \
+        set(map(frozenset, bundle.graph.edges.tolist()))
+    assert bundle.weights[:, 0].tolist() == [np.float32(index[node_id] / 10) for node_id in bundle.node_ids]
+
+    # S² never writes to the mapped arrays
+    pos = [G.nodes[index[node_id]]['pos'] for node_id in bundle.node_ids.tolist()]
+    bundle.truth = np.array([1 if x < 3 and y < 3 else -1 for x, y in pos], dtype=np.int8)
+    bundle.save(tmp_path / 'bundle')
+    bundle = open_bundle(tmp_path / 'bundle')
+    C_cut = s2(bundle, bundle.oracle(), IncrementalMoss())
+    assert set(map(frozenset, C_cut.edges[C_cut.alive].tolist())) == \
+        set(frozenset(e) for e in bundle.graph.edges.tolist() if bundle.truth[e[0]] == bundle.truth[e[1]])
+
+
+def test_bundle_from_networkx_truth():
+    G = nx.path_graph(4)
+    for v in G.nodes():
+        G.nodes[v]['truth'] = 1 if v < 2 else -1
+    assert GraphBundle.from_networkx(G).truth.tolist() == [1, 1, -1, -1]
+
+    nx.set_node_attributes(G, {v: v < 2 for v in G.nodes()}, 'truth')
+    assert GraphBundle.from_networkx(G).truth.tolist() == [1, 1, -1, -1]
+
+
+def test_simulate():
+    G = nx.grid_2d_graph(10, 10)
+
+    def oracle(vert):
+        return (vert[0] < 4) and (vert[1] < 4)
+
+    tasks = [SimulationTask(G, oracle, seed=seed) for seed in [0, 1, 0]]
+    results = simulate(tasks, budgets=[100], max_workers=2)
+    assert [r['seed'] for r in results] == [0, 1, 0]
+    assert all(r['queries'] == 100 and r['cut_edges'] == 8 and r['cut_accuracy'] == 1.0 for r in results)
+    assert all(r['recall@100'] == 1.0 for r in results)
+    # runs are reproducible from their seed
+    assert results[0]['queries_to_cut'] == results[2]['queries_to_cut']
+
+
+def test_batch_oracle():
+    G = nx.grid_2d_graph(12, 12)
+
+    def oracle(vert):
+        return ((vert[0] < 4) and (vert[1] < 4)) or ((vert[0] > 7) and (vert[1] > 7))
+
+    C = CSRGraph.from_networkx(G)
+    calls = []
+    def batch_oracle(verts):
+        calls.append(verts)
+        return [oracle(C.nodelist[v]) for v in verts]
+
+    C_cut = s2_batch(C, BatchOracle(batch_oracle), 4)
+    assert sum(map(len, calls)) == C.order() and max(map(len, calls)) == 4
+    assert set(map(frozenset, C_cut.to_networkx().edges())) == \
+        set(frozenset((u, v)) for u, v in G.edges() if oracle(u) == oracle(v))
+
+
+def test_s2_async():
+    G = nx.grid_2d_graph(10, 10)
+
+    def oracle(vert):
+        return ((vert[0] < 4) and (vert[1] < 4)) or ((vert[0] > 5) and (vert[1] > 5))
+
+    C = CSRGraph.from_networkx(G)
+    in_flight = []
+    async def async_oracle(vert):
+        in_flight.append(vert)
+        await asyncio.sleep(0)
+        in_flight.remove(vert)
+        return oracle(C.nodelist[vert])
+
+    C_cut = asyncio.run(s2_async(C, async_oracle, IncrementalMoss(), max_in_flight=3, rng=random.Random(0)))
+    assert set(map(frozenset, C_cut.to_networkx().edges())) == \
+        set(frozenset((u, v)) for u, v in G.edges() if oracle(u) == oracle(v))
+
+
+def test_vertex_pool():
+    from s2 import _VertexPool
+    pool = _VertexPool(range(10))
+    rng = random.Random(0)
+    for vert in [3, 9, 0, 4]:
+        pool.remove(vert)
+    assert len(pool) == 6 and 9 not in pool and 5 in pool
+    assert set(pool.choice(rng) for _ in range(200)) == {1, 2, 5, 6, 7, 8}
+    assert sorted(pool.sample(rng, 6)) == [1, 2, 5, 6, 7, 8]
+
+
+def test_s2_stopping_rule():
+    G = nx.grid_2d_graph(40, 40)
+
+    def oracle(vert):
+        return ((vert[0] < 12) and (vert[1] < 12)) or ((vert[0] >= 28) and (vert[1] >= 28))
+
+    C = CSRGraph.from_networkx(G)
+    expected = set(frozenset((u, v)) for u, v in G.edges() if oracle(u) == oracle(v))
+    for stop in [StoppingRule(), StoppingRule(min_fraction=0, min_labels=200)]:
+        calls = []
+        def counting_oracle(v):
+            calls.append(v)
+            return oracle(C.nodelist[v])
+
+        C_cut = s2(C, counting_oracle, IncrementalMoss(), rng=random.Random(0), stop=stop)
+        assert set(map(frozenset, C_cut.to_networkx().edges())) == expected
+        assert len(calls) < C.order() // 2
+
+    # a closed component stops S² right away, and a budget caps it
+    G_cut = s2(G, oracle, moss, rng=random.Random(0), stop=StoppingRule(min_fraction=0))
+    assert sum(1 for v in G_cut.nodes() if 'label' in G_cut.nodes[v]) == 1
+    C_cut = s2_batch(C, lambda v: oracle(C.nodelist[v]), 4, rng=random.Random(0), stop=StoppingRule(budget=30))
+    assert 30 <= np.count_nonzero(C_cut.labels) < 34
+
+
+def test_predict():
+    # two paths, 0-1-2-3-4 with both ends labeled and 5-6-7 with one label, and an isolated vertex 8
+    C = CSRGraph.from_edges(9, [0, 1, 2, 3, 5, 6], [1, 2, 3, 4, 6, 7])
+    C.set_label(0, 1)
+    C.set_label(4, -1)
+    C.set_label(6, -1)
+    scores = predict(C, tol=1e-9)
+    assert np.allclose(scores, [1, 0.5, 0, -0.5, -1, -1, -1, -1, 0])
+
+    # rescoring only the first component after cutting 2-3 and labeling 2
+    C.remove_edges_from([(2, 3)])
+    C.set_label(2, 1)
+    scores[5:] = 7
+    predict(C, vertices=[2, 3], out=scores, tol=1e-9)
+    assert np.allclose(scores, [1, 1, 1, -1, -1, 7, 7, 7, 7])
+
+    G = C.to_networkx()
+    assert predict(G)[1] == 1.0 and predict(G)[3] == -1.0
+
+
+def test_bench_suite():
+    from s2.bench import run_suite, compare, knn_edges
+
+    # only points with too few others nearby get fewer than k neighbors
+    i, j = knn_edges(500, k=4)
+    assert np.mean(np.bincount(np.concatenate([i, j]), minlength=500) < 4) < 0.02
+
+    current = run_suite(max_nodes=100, families=['lattice', 'knn'], repeat=1)
+    assert {key.split('/')[0] for key in current['results']} == \
+        {'find_obvious_cuts', 'frontier_moss', 'incremental_moss', 'moss', 'enumerate_find_ssp', 's2'}
+    assert compare(current, current) == []
+
+    # fewer queries in the baseline count as a regression, whatever the tolerance
+    baseline = {'results': {key: dict(result) for key, result in current['results'].items()}}
+    baseline['results']['s2/knn/100']['queries'] -= 1
+    assert [r[:2] for r in compare(baseline, current, tolerance=1e9)] == [('s2/knn/100', 'queries')]